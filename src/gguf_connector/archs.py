@@ -0,0 +1,160 @@
+
+import math
+from .loader import PREFIXES, read_state_dict_keys
+
+# model architectures known to the safetensors/pt -> gguf converters (d6, d7, t, t4, t7, t8); detection
+# only needs the key names, so it runs on the file header before any tensor is loaded
+class ModelTemplate:
+    arch = "invalid"  # string describing architecture
+    shape_fix = False # whether to reshape tensors
+    keys_detect = []  # list of lists to match in state dict
+    keys_banned = []  # list of keys that should mark model as invalid for conversion
+    keys_hiprec = []  # list of keys that need to be kept in fp32 for some reason
+
+class ModelFlux(ModelTemplate):
+    arch = "flux"
+    keys_detect = [
+        ("transformer_blocks.0.attn.norm_added_k.weight",),
+        ("double_blocks.0.img_attn.proj.weight",),
+    ]
+    keys_banned = ["transformer_blocks.0.attn.norm_added_k.weight",]
+
+class ModelSD3(ModelTemplate):
+    arch = "sd3"
+    keys_detect = [
+        ("transformer_blocks.0.attn.add_q_proj.weight",),
+        ("joint_blocks.0.x_block.attn.qkv.weight",),
+    ]
+    keys_banned = ["transformer_blocks.0.attn.add_q_proj.weight",]
+
+class ModelAura(ModelTemplate):
+    arch = "aura"
+    keys_detect = [
+        ("double_layers.3.modX.1.weight",),
+        ("joint_transformer_blocks.3.ff_context.out_projection.weight",),
+    ]
+    keys_banned = ["joint_transformer_blocks.3.ff_context.out_projection.weight",]
+
+class ModelHiDream(ModelTemplate):
+    arch = "hidream"
+    keys_detect = [
+        (
+            "caption_projection.0.linear.weight",
+            "double_stream_blocks.0.block.ff_i.shared_experts.w3.weight"
+        )
+    ]
+    keys_hiprec = [
+        ".ff_i.gate.weight", # nn.parameter, can't load from BF16 ver
+        "img_emb.emb_pos"
+    ]
+
+class ModelHyVid(ModelTemplate):
+    arch = "hyvid"
+    keys_detect = [
+        (
+            "double_blocks.0.img_attn_proj.weight",
+            "txt_in.individual_token_refiner.blocks.1.self_attn_qkv.weight",
+        ),
+        ("txt_in.individual_token_refiner.blocks.0.norm1.weight",),
+    ]
+
+class ModelWan(ModelHyVid):
+    arch = "wan"
+    keys_detect = [
+        (
+            "blocks.0.self_attn.norm_q.weight",
+            "text_embedding.2.weight",
+            "head.modulation",
+        )
+    ]
+
+class ModelLTXV(ModelTemplate):
+    arch = "ltxv"
+    keys_detect = [
+        (
+            "adaln_single.emb.timestep_embedder.linear_2.weight",
+            "transformer_blocks.27.scale_shift_table",
+            "caption_projection.linear_2.weight",
+        )
+    ]
+    keys_hiprec = [
+        "scale_shift_table" # nn.parameter, can't load from BF16 base quant
+    ]
+
+class ModelCosmos(ModelTemplate):
+    arch = "cosmos"
+    keys_detect = [("blocks.block0.blocks.0.block.attn.to_q.0.weight",),]
+
+class ModelPixArt(ModelTemplate):
+    arch = "pixart"
+    keys_detect = [("transformer_blocks.27.scale_shift_table",),]
+
+class ModelMochi(ModelTemplate):
+    arch = "mochi"
+    keys_detect = [("t5_yproj.weight",),]
+
+class ModelLumina(ModelTemplate):
+    arch = "lumina"
+    keys_detect = [("cap_embedder.0.weight",),]
+
+class ModelSDXL(ModelTemplate):
+    arch = "sdxl"
+    shape_fix = True
+    keys_detect = [
+        ("down_blocks.0.downsamplers.0.conv.weight", "add_embedding.linear_1.weight",),
+        (
+            "input_blocks.3.0.op.weight", "input_blocks.6.0.op.weight",
+            "output_blocks.2.2.conv.weight", "output_blocks.5.2.conv.weight",
+        ), # Non-diffusers
+        ("label_emb.0.0.weight",),
+    ]
+
+class ModelSD1(ModelTemplate):
+    arch = "sd1"
+    shape_fix = True
+    keys_detect = [
+        ("down_blocks.0.downsamplers.0.conv.weight",),
+        (
+            "input_blocks.3.0.op.weight", "input_blocks.6.0.op.weight", "input_blocks.9.0.op.weight",
+            "output_blocks.2.1.conv.weight", "output_blocks.5.2.conv.weight", "output_blocks.8.2.conv.weight"
+        ), # Non-diffusers
+    ]
+
+# order matters: an architecture whose keys are a subset of another's comes after it (ltxv before
+# pixart, sdxl before sd1)
+arch_list = [ModelFlux, ModelSD3, ModelAura, ModelHiDream, ModelLTXV, ModelHyVid, ModelWan, ModelCosmos, ModelPixArt, ModelMochi, ModelLumina, ModelSDXL, ModelSD1]
+
+def is_model_arch(model, keys):
+    matched = False
+    invalid = False
+    for match_list in model.keys_detect:
+        if all(key in keys for key in match_list):
+            matched = True
+            invalid = any(key in keys for key in model.keys_banned)
+            break
+    assert not invalid, "Model architecture not allowed for conversion! (i.e. reference VS diffusers format)"
+    return matched
+
+# keys: any container of (prefix stripped) tensor names, a state dict works too
+def detect_arch(keys):
+    keys = keys if isinstance(keys, (set, dict)) else set(keys)
+    model_arch = None
+    for arch in arch_list:
+        if is_model_arch(arch, keys):
+            model_arch = arch()
+            break
+    assert model_arch is not None, "Unknown model architecture!"
+    return model_arch
+
+# from the safetensors header or the pickle of a .pt/.ckpt zip, without reading any tensor data
+def detect_arch_from_file(path, prefixes=PREFIXES, subkeys=("model", "module")):
+    return detect_arch(read_state_dict_keys(path, prefixes, subkeys))
+
+# ggml tensors have at most 4 dims: an N-D one (the 5-D patch embeddings of hyvid/wan) is stored with its
+# leading dims folded into the first and its real shape recorded by writer.add_orig_shape, which
+# reader.get_tensor_shape (and ComfyUI-GGUF) restore on load; no side file, no second pass (d4/d5)
+def fold_nd_shape(shape, max_dims=4):
+    shape = tuple(int(dim) for dim in shape)
+    if len(shape) <= max_dims:
+        return shape
+    return (math.prod(shape[:-(max_dims - 1)]), *shape[-(max_dims - 1):])
@@ -63,7 +63,7 @@ vit_config = SiglipVisionConfig.from_json_file(os.path.join(model_path, "vit_con
 vit_config.rope = False
 vit_config.num_hidden_layers -= 1
 
-from .quant3 import convert_gguf_to_safetensors
+from .cache import convert_gguf_to_safetensors_cached
 
 # gguf and safetensors detection
 gguf_files = [file for file in os.listdir() if file.endswith('.gguf')]
@@ -92,7 +92,7 @@ if gguf_files:
                 choice_index=int(choice2)-1
                 selected_model_file=safetensors_files[choice_index]
                 print(f"MODEL file: {selected_model_file} is selected!\n")
-                convert_gguf_to_safetensors(input_path, vae_path, use_bf16)
+                convert_gguf_to_safetensors_cached(input_path, vae_path, use_bf16)
                 vae_model, vae_config = load_ae(vae_path)
                 checkpoint = selected_model_file
             except (ValueError, IndexError):
@@ -0,0 +1,332 @@
+
+import glob, hashlib, json, math, os, threading, time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .cache import atomic_write_json, file_stat
+from .sfwriter import DEFAULT_MEMORY_BUDGET as STREAM_MEMORY, MemoryBudget
+
+# headless batch conversion: a manifest lists jobs (input glob, target type or plan, output naming), each
+# matched file becomes a conversion run in a pool of worker processes, as many at once as the memory
+# budget allows; finished outputs go in a state file so a rerun (after a crash, or with more models
+# added) only does what is left, and a json summary records the throughput of every conversion.
+#
+# manifest (json):
+#   {"workers": 2, "memory": "24G", "state": "batch.state.json", "summary": "batch.summary.json",
+#    "jobs": [
+#      {"input": "zoo/*.safetensors", "type": "q4_k", "output": "out/{stem}-{type}.gguf"},
+#      {"input": "zoo/*.safetensors", "type": "q4_k", "rules": [["*attn*", "q8_0"]], "output": "out/{stem}-attn8.gguf"},
+#      {"input": "zoo/*.safetensors", "plan": "{dir}/{stem}.plan.json", "output": "out/{stem}-mixed.gguf"},
+#      {"input": "zoo/*.gguf", "bpw": 4.5, "output": "out/{stem}-4.5bpw.gguf"},
+#      {"input": "zoo/*.gguf", "type": "bf16", "format": "safetensors", "output": "out/{stem}-bf16.safetensors"}
+#    ]}
+# conversions: safetensors -> gguf (quant1, type F32 or the default of the plan), gguf -> gguf (requant)
+# and gguf -> safetensors (quant3, type BF16 or F32); paths are relative to the manifest, and output
+# names take {dir} {stem} {name} {type} (default {dir}/{stem}-{type}.gguf or .safetensors). Files that
+# are the output of a job, or recorded in the state file, are never taken as inputs, so outputs written
+# next to the inputs aren't converted again by the next run.
+DEFAULT_WORKERS = int(os.environ.get('GGUF_BATCH_WORKERS', os.cpu_count() or 1))
+# torch and numpy imported, buffers of the reader; counted once per conversion on top of its estimate
+PROCESS_OVERHEAD = 512 << 20
+SIZE_UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+# half the physical memory, or GGUF_BATCH_MEMORY
+def default_memory_budget():
+    if 'GGUF_BATCH_MEMORY' in os.environ:
+        return parse_size(os.environ['GGUF_BATCH_MEMORY'])
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2
+    except (AttributeError, ValueError, OSError):
+        return 8 << 30
+# bytes, from an int or a string like "512M" or "24G"
+def parse_size(size):
+    if isinstance(size, (int, float)):
+        return int(size)
+    size = str(size).strip().upper().rstrip('IB')
+    if size and size[-1] in SIZE_UNITS:
+        return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+    return int(size)
+def input_kind(path):
+    if path.endswith('.gguf'):
+        return 'gguf'
+    if path.endswith('.safetensors'):
+        return 'safetensors'
+    raise ValueError(f"Unsupported input (not .gguf or .safetensors): {path}")
+def output_format(spec):
+    if 'format' in spec:
+        return spec['format']
+    if 'output' in spec and spec['output'].endswith('.safetensors'):
+        return 'safetensors'
+    return 'gguf'
+def type_label(spec):
+    if 'type' in spec:
+        return str(spec['type']).lower()
+    if 'bpw' in spec:
+        return f"{spec['bpw']}bpw"
+    return 'mixed'
+def format_path(template, path, spec):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return template.format(dir=os.path.dirname(path), stem=stem, name=os.path.basename(path), type=type_label(spec))
+# types checked before anything runs, so a bad entry fails the batch up front rather than in a worker
+def check_job(job):
+    if job['kind'] == 'gguf-safetensors':
+        if type_label(job) not in ('bf16', 'f32'):
+            raise ValueError(f"gguf -> safetensors converts to bf16 or f32, not {type_label(job)}: {job['input']}")
+        return
+    from .planner import parse_qtype
+    from .quant import can_quantize_to
+    for qtype in ([job['type']] if 'type' in job else []) + [rule[1] for rule in job.get('rules', [])]:
+        if not can_quantize_to(parse_qtype(qtype)):
+            raise ValueError(f"No quantization to {parse_qtype(qtype).name}: {job['input']}")
+# one job per input file matched by a manifest entry, in manifest order; fields other than input are
+# the conversion's parameters, plan paths can use the same {dir} {stem} names as the output. Matches
+# which are the output of some job, or in exclude (the outputs of the state file), are left out.
+def expand_jobs(manifest, base_dir='.', exclude=()):
+    jobs = []
+    for spec in manifest['jobs']:
+        fmt = output_format(spec)
+        template = spec.get('output', os.path.join('{dir}', f"{{stem}}-{{type}}.{fmt}"))
+        paths = sorted(glob.glob(os.path.join(base_dir, spec['input']), recursive=True))
+        if not paths:
+            print(f"[WARNING] No input matches: {spec['input']}")
+        for path in paths:
+            path = os.path.abspath(path)
+            job = {key: value for key, value in spec.items() if key not in ('input', 'output')}
+            job.update(input=path, output=os.path.abspath(os.path.join(base_dir, format_path(template, path, spec))))
+            job['kind'] = f"{input_kind(path)}-{fmt}"
+            if job['kind'] not in RUNNERS:
+                raise ValueError(f"No {input_kind(path)} -> {fmt} conversion: {path}")
+            if 'plan' in job:
+                job['plan'] = os.path.abspath(os.path.join(base_dir, format_path(job['plan'], path, spec)))
+            jobs.append(job)
+    outputs = {job['output'] for job in jobs} | {os.path.abspath(path) for path in exclude}
+    jobs = [job for job in jobs if job['input'] not in outputs]
+    for job in jobs:
+        check_job(job)
+    return jobs
+# what a finished output depends on: the job's parameters and the input's size and mtime
+def job_digest(job):
+    params = {key: value for key, value in job.items() if key not in ('threads',)}
+    params['input_stat'] = file_stat(job['input'])
+    if 'plan' in job and os.path.exists(job['plan']):
+        params['plan_stat'] = file_stat(job['plan'])
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+# peak memory of a conversion, roughly: quant1 and requant are streamed and hold one tensor (float32
+# in, quantized out, and the numpy quantizers' temporaries for quant1), the safetensors stream is capped
+# by its own budget
+def estimate_memory(job):
+    size = os.path.getsize(job['input'])
+    if job['kind'] == 'safetensors-gguf':
+        from .loader import read_safetensors_header
+        header = read_safetensors_header(job['input'])
+        largest = max((math.prod(entry['shape']) for name, entry in header.items() if name != '__metadata__'), default=0)
+        return PROCESS_OVERHEAD + largest * 16
+    if job['kind'] == 'gguf-gguf':
+        from .reader import GGUFReader
+        reader = GGUFReader(job['input'])
+        largest = max((int(tensor.n_elements) for tensor in reader.tensors), default=0)
+        return PROCESS_OVERHEAD + largest * 8
+    return PROCESS_OVERHEAD + min(STREAM_MEMORY, size * 4)
+# {tensor name: type} for a safetensors job: its plan file, a size budget (bpw/size) or rules with type
+# as default (gguf inputs go through requant.plan_requantization, which does the same)
+def job_plan(job, tensors):
+    from .loader import match_plan
+    from .planner import load_plan, plan_budget, plan_rules
+    if 'plan' in job:
+        return match_plan(load_plan(job['plan']), tensors)
+    if 'bpw' in job or 'size' in job:
+        return plan_budget(tensors, target_bpw=job.get('bpw'), target_size=parse_size(job['size']) if 'size' in job else None)
+    return plan_rules(tensors, [tuple(rule) for rule in job.get('rules', [])], default=job.get('type', 'F16'))
+# architecture name for the gguf header when the manifest doesn't give one (None, as d8 writes it, when
+# the model isn't one archs.py knows)
+def detect_arch_name(path):
+    from .archs import detect_arch_from_file
+    try:
+        return detect_arch_from_file(path).arch
+    except AssertionError:
+        return None
+def convert_safetensors_to_gguf(job, output_path):
+    from .const import GGML_QUANT_VERSION
+    from .planner import parse_qtype
+    from .loader import write_streamed
+    from .quant1 import load_model, handle_tensors
+    from .requant import file_type_of
+    writer, state_dict, _ = load_model(job['input'], job.get('arch') or detect_arch_name(job['input']))
+    writer.add_quantization_version(GGML_QUANT_VERSION)
+    fp32 = type_label(job) == 'f32'
+    plan = None if fp32 else job_plan(job, {key: state_dict.get_slice(key) for key in state_dict})
+    if 'type' in job and not any(key in job for key in ('plan', 'bpw', 'size', 'rules')):
+        if (ftype := file_type_of(parse_qtype(job['type']))) is not None:
+            writer.add_file_type(ftype)
+    planned = handle_tensors(writer, state_dict, fp32, plan)
+    write_streamed(writer, output_path, state_dict, planned, progress=False)
+def convert_gguf_to_gguf(job, output_path):
+    from .planner import load_plan, parse_qtype
+    from .reader import GGUFReader
+    from .requant import plan_requantization, requantize
+    reader = GGUFReader(job['input'])
+    budget = {}
+    if 'bpw' in job or 'size' in job:
+        budget = dict(target_bpw=job.get('bpw'), target_size=parse_size(job['size']) if 'size' in job else None)
+    plan = plan_requantization(
+        reader,
+        job.get('type', 'Q4_0'),
+        rules=[tuple(rule) for rule in job.get('rules', [])],
+        plan=load_plan(job['plan']) if 'plan' in job else None,
+        **budget,
+    )
+    del reader
+    file_type = parse_qtype(job['type']) if 'type' in job else None
+    requantize(job['input'], output_path, plan, n_threads=job.get('threads'), file_type=file_type, progress=False)
+def convert_gguf_to_safetensors(job, output_path):
+    from .quant3 import convert_gguf_to_safetensors
+    label = type_label(job)
+    if label not in ('bf16', 'f32'):
+        raise ValueError(f"gguf -> safetensors converts to bf16 or f32, not {label}")
+    convert_gguf_to_safetensors(job['input'], output_path, label == 'bf16', workers=job.get('threads'))
+RUNNERS = {
+    'safetensors-gguf': convert_safetensors_to_gguf,
+    'gguf-gguf': convert_gguf_to_gguf,
+    'gguf-safetensors': convert_gguf_to_safetensors,
+}
+# runs in a worker process; the output is written under a temp name and renamed when complete, so an
+# interrupted conversion never looks finished
+def run_job(job):
+    os.makedirs(os.path.dirname(job['output']), exist_ok=True)
+    tmp = f"{job['output']}.{os.getpid()}.tmp"
+    t0 = time.perf_counter()
+    try:
+        RUNNERS[job['kind']](job, tmp)
+        os.replace(tmp, job['output'])
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return time.perf_counter() - t0
+def read_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+# a job is done when the state file has it with the same digest, and the output is still the file
+# that was recorded
+def is_done(state, job, digest):
+    entry = state.get(job['output'])
+    if entry is None or entry['digest'] != digest or not os.path.exists(job['output']):
+        return False
+    return file_stat(job['output']) == entry['output_stat']
+def job_result(job, status, seconds=0.0, error=None):
+    in_bytes = os.path.getsize(job['input'])
+    out_bytes = os.path.getsize(job['output']) if status != 'failed' and os.path.exists(job['output']) else 0
+    result = {'input': job['input'], 'output': job['output'], 'kind': job['kind'], 'type': type_label(job), 'status': status, 'seconds': round(seconds, 3), 'in_bytes': in_bytes, 'out_bytes': out_bytes}
+    if status == 'done':
+        result['mb_per_s'] = round(in_bytes / max(seconds, 1e-9) / 1e6, 2)
+    if error is not None:
+        result['error'] = error
+    return result
+def run_batch(jobs, state_path, summary_path=None, workers=None, memory_budget=None, force=False):
+    workers = max(1, min(workers or DEFAULT_WORKERS, len(jobs) or 1))
+    memory_budget = memory_budget or default_memory_budget()
+    state = read_state(state_path)
+    results, pending = [], []
+    for job in jobs:
+        # threads of a conversion, so the pool as a whole uses every core once
+        job.setdefault('threads', max(1, (os.cpu_count() or 1) // workers))
+        digest = job_digest(job)
+        if not force and is_done(state, job, digest):
+            print(f"[INFO] Up to date: {job['output']}")
+            results.append(job_result(job, 'skipped'))
+        else:
+            pending.append((job, digest))
+    print(f"[INFO] {len(pending)} conversion(s) to run, {len(results)} up to date; {workers} worker(s), {memory_budget / 2**30:.1f} GiB memory budget")
+    t0 = time.perf_counter()
+    budget = MemoryBudget(memory_budget)
+    lock = threading.Lock()
+    def finished(future, job, digest, cost):
+        budget.release(cost)
+        with lock:
+            try:
+                seconds = future.result()
+            except Exception as e:
+                print(f"[ERROR] {job['input']} -> {job['output']}: {e!r}")
+                results.append(job_result(job, 'failed', error=repr(e)))
+                return
+            print(f"[INFO] Done in {seconds:.1f} s: {job['output']}")
+            # only this process writes the state, after every conversion, so a crash loses nothing finished
+            state[job['output']] = {'input': job['input'], 'digest': digest, 'output_stat': file_stat(job['output']), 'seconds': round(seconds, 3), 'finished': time.strftime('%Y-%m-%dT%H:%M:%S')}
+            atomic_write_json(state_path, state)
+            results.append(job_result(job, 'done', seconds))
+    # a fresh process per conversion, so each one gives its memory back to the system when it ends
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as pool:
+        for i, (job, digest) in enumerate(pending):
+            cost = estimate_memory(job)
+            budget.acquire(cost)
+            try:
+                future = pool.submit(run_job, job)
+            except BrokenProcessPool as e:
+                # a worker died (killed, out of memory): the conversions not started yet fail with it, and
+                # the summary is still written
+                budget.release(cost)
+                with lock:
+                    for job, _ in pending[i:]:
+                        print(f"[ERROR] {job['input']} -> {job['output']}: {e!r}")
+                        results.append(job_result(job, 'failed', error=repr(e)))
+                break
+            future.add_done_callback(lambda f, job=job, digest=digest, cost=cost: finished(f, job, digest, cost))
+    wall = time.perf_counter() - t0
+    summary = batch_summary(results, wall, workers, memory_budget)
+    if summary_path:
+        atomic_write_json(summary_path, summary)
+    return summary
+def batch_summary(results, wall, workers, memory_budget):
+    done = [r for r in results if r['status'] == 'done']
+    in_bytes = sum(r['in_bytes'] for r in done)
+    totals = {status: sum(1 for r in results if r['status'] == status) for status in ('done', 'skipped', 'failed')}
+    totals.update(
+        wall_seconds=round(wall, 3),
+        worker_seconds=round(sum(r['seconds'] for r in done), 3),
+        in_bytes=in_bytes,
+        out_bytes=sum(r['out_bytes'] for r in done),
+        mb_per_s=round(in_bytes / max(wall, 1e-9) / 1e6, 2) if done else 0.0,
+    )
+    return {'workers': workers, 'memory_budget': memory_budget, 'totals': totals, 'jobs': results}
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="run the conversions of a batch manifest without prompts, skipping finished ones")
+    parser.add_argument('manifest', help="batch manifest (json)")
+    parser.add_argument('--workers', type=int, default=None, help="conversions at once at most (default: manifest, GGUF_BATCH_WORKERS or cores)")
+    parser.add_argument('--memory', default=None, help="memory budget of the conversions running at once, like 24G (default: manifest, GGUF_BATCH_MEMORY or half the RAM)")
+    parser.add_argument('--state', default=None, help="state file (default: manifest, or <manifest>.state.json)")
+    parser.add_argument('--summary', default=None, help="json summary (default: manifest, or <manifest>.summary.json)")
+    parser.add_argument('--force', action='store_true', help="run every conversion, finished or not")
+    parser.add_argument('--dry-run', action='store_true', help="list the conversions and exit")
+    args = parser.parse_args(argv)
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {'jobs': manifest}
+    base_dir = os.path.dirname(os.path.abspath(args.manifest))
+    stem = os.path.splitext(os.path.abspath(args.manifest))[0]
+    def setting(arg, key, default):
+        if arg is not None:
+            return arg
+        return os.path.join(base_dir, manifest[key]) if key in manifest else default
+    state_path = setting(args.state, 'state', f"{stem}.state.json")
+    jobs = expand_jobs(manifest, base_dir, exclude=read_state(state_path))
+    if args.dry_run:
+        for job in jobs:
+            print(f"{job['kind']:<17} {type_label(job):<8} {job['input']} -> {job['output']}")
+        return 0
+    memory = args.memory or manifest.get('memory')
+    summary = run_batch(
+        jobs,
+        state_path,
+        setting(args.summary, 'summary', f"{stem}.summary.json"),
+        workers=args.workers or manifest.get('workers'),
+        memory_budget=parse_size(memory) if memory is not None else None,
+        force=args.force,
+    )
+    totals = summary['totals']
+    print(f"[INFO] {totals['done']} done, {totals['skipped']} skipped, {totals['failed']} failed in {totals['wall_seconds']:.1f} s ({totals['mb_per_s']:.1f} MB/s)")
+    return 1 if totals['failed'] else 0
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import time
+from typing import Sequence
+import numpy as np
+from .const import GGML_QUANT_SIZES, GGMLQuantizationType
+from .quant import quantize
+
+# Benchmarks of the numpy quantizers.
+
+FAST_PATH_TYPES = (GGMLQuantizationType.Q4_0, GGMLQuantizationType.Q5_0)
+
+def compare_fast_path(exact: np.ndarray, fast: np.ndarray, qtype: GGMLQuantizationType) -> tuple[int, int]:
+    # number of blocks where the fast (float32) path differs from the reference, and the total number of blocks
+    type_size = GGML_QUANT_SIZES[qtype][1]
+    exact = exact.reshape((-1, type_size))
+    fast = fast.reshape((-1, type_size))
+    return int((exact != fast).any(axis=-1).sum()), exact.shape[0]
+
+def fast_path_mismatch(data: np.ndarray, qtype: GGMLQuantizationType) -> float:
+    # fraction of the blocks of data which the fast path quantizes differently than the reference
+    mismatched, n_blocks = compare_fast_path(quantize(data, qtype), quantize(data, qtype, exact=False), qtype)
+    return mismatched / n_blocks if n_blocks else 0.0
+
+def random_tensor(size_gib: float, n_cols: int = 4096, seed: int = 0) -> np.ndarray:
+    # float32, filled chunk by chunk to avoid a float64 temporary of the whole tensor
+    n_rows = max(1, int(size_gib * 1024**3) // (4 * n_cols))
+    data = np.empty((n_rows, n_cols), dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    for start in range(0, n_rows, 4096):
+        rng.standard_normal(out=data[start:start + 4096], dtype=np.float32)
+    return data
+
+def bench_fast_path(size_gib: float = 2.0, qtypes: Sequence[GGMLQuantizationType] = FAST_PATH_TYPES) -> list[dict]:
+    data = random_tensor(size_gib)
+    results = []
+    for qtype in qtypes:
+        t0 = time.perf_counter()
+        exact = quantize(data, qtype)
+        t1 = time.perf_counter()
+        fast = quantize(data, qtype, exact=False)
+        t2 = time.perf_counter()
+        mismatched, n_blocks = compare_fast_path(exact, fast, qtype)
+        del exact, fast
+        results.append({
+            "type": qtype.name,
+            "size_gib": data.nbytes / 1024**3,
+            "exact_s": t1 - t0,
+            "fast_s": t2 - t1,
+            "speedup": (t1 - t0) / (t2 - t1),
+            "mismatched_blocks": mismatched,
+            "mismatch_rate": mismatched / n_blocks,
+        })
+    return results
+
+def main(argv: Sequence[str] | None = None) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the float32 fast path of the numpy quantizers against the exact one")
+    parser.add_argument("--size", type=float, default=2.0, help="size of the test tensor in GiB (float32)")
+    parser.add_argument("--types", default=",".join(qtype.name for qtype in FAST_PATH_TYPES), help="comma separated types")
+    args = parser.parse_args(argv)
+
+    qtypes = [GGMLQuantizationType[name.strip().upper()] for name in args.types.split(",")]
+    print(f"{'type':<8} {'GiB':>6} {'exact s':>9} {'fast s':>9} {'speedup':>8} {'mismatch':>10}")
+    for r in bench_fast_path(args.size, qtypes):
+        print(f"{r['type']:<8} {r['size_gib']:>6.2f} {r['exact_s']:>9.2f} {r['fast_s']:>9.2f} {r['speedup']:>7.2f}x {r['mismatch_rate']:>9.4%}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
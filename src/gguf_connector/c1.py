@@ -18,7 +18,6 @@ from dataclasses import dataclass
 from pathlib import Path
 import librosa
 import torch.nn.functional as F
-from safetensors.torch import load_file
 
 from chichat import perth # need chichat; pip install chichat
 from chichat.chatterbox.models.t3 import T3
@@ -64,7 +63,7 @@ def punc_norm(text: str) -> str:
         text += "."
     return text
 
-from .quant3 import convert_gguf_to_safetensors
+from .quant3 import load_gguf_state_dict
 
 gguf_files = [file for file in os.listdir() if file.endswith('.gguf')]
 
@@ -101,26 +100,11 @@ if gguf_files:
                         # MODEL
                         print(f"s3gen file: {selected_model_file} is selected!\n")
                         s3_path=selected_model_file
-                        # create model folder
-                        model_folder = './models/box/'
-                        os.makedirs(model_folder, exist_ok=True)
+                        # tensors are loaded straight from the gguf files (see from_local); no safetensors copies
                         if DEVICE == "cuda":
-                            use_bf16 = True
-                            vae_path = f"{model_folder}{os.path.splitext(input_path)[0]}-bf16.safetensors"
-                            clip_path = f"{model_folder}{os.path.splitext(t3_path)[0]}-bf16.safetensors"
-                            model_path = f"{model_folder}{os.path.splitext(s3_path)[0]}-bf16.safetensors"
+                            dtype = torch.bfloat16
                         else:
-                            use_bf16 = False
-                            vae_path = f"{model_folder}{os.path.splitext(input_path)[0]}-f32.safetensors"
-                            clip_path = f"{model_folder}{os.path.splitext(t3_path)[0]}-f32.safetensors"
-                            model_path = f"{model_folder}{os.path.splitext(s3_path)[0]}-f32.safetensors"
-                        # dequantization process begins
-                        print(f"Prepare to dequantize VAE: {input_path}")
-                        convert_gguf_to_safetensors(input_path, vae_path, use_bf16)
-                        print(f"Prepare to dequantize ENCODER: {t3_path}")
-                        convert_gguf_to_safetensors(t3_path, clip_path, use_bf16)
-                        print(f"Prepare to dequantize MODEL: {s3_path}")
-                        convert_gguf_to_safetensors(s3_path, model_path, use_bf16)
+                            dtype = torch.float32
                     except (ValueError, IndexError):
                         print("Invalid choice. Please enter a valid number.")
             except (ValueError, IndexError):
@@ -203,12 +187,12 @@ class ChatterboxTTS:
             map_location = None
         ve = VoiceEncoder()
         ve.load_state_dict(
-            load_file(vae_path)
+            load_gguf_state_dict(input_path, dtype)
         )
         ve.to(device).eval()
 
         t3 = T3()
-        t3_state = load_file(clip_path)
+        t3_state = load_gguf_state_dict(t3_path, dtype)
         if "model" in t3_state.keys():
             t3_state = t3_state["model"][0]
         t3.load_state_dict(t3_state)
@@ -216,7 +200,7 @@ class ChatterboxTTS:
 
         s3gen = S3Gen()
         s3gen.load_state_dict(
-            load_file(model_path), strict=False
+            load_gguf_state_dict(s3_path, dtype), strict=False
         )
         s3gen.to(device).eval()
         
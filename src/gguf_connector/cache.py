@@ -0,0 +1,242 @@
+
+import hashlib, json, os, shutil, time
+from pathlib import Path
+
+# content-addressed cache for GGUF -> safetensors dequantization; app launchers convert the same gguf
+# into the same place on every start, this keeps one converted copy per (gguf content, output dtype,
+# metadata, converter version) and publishes it to the path the app loads from (hard link when the
+# cache is on the same filesystem, copy otherwise), so unchanged models skip the conversion entirely
+CONVERTER_VERSION = 1
+CACHE_DIR = os.environ.get('GGUF_CONNECTOR_CACHE', str(Path.home() / '.cache' / 'gguf-connector'))
+LOCK_TIMEOUT = float(os.environ.get('GGUF_CONNECTOR_LOCK_TIMEOUT', 3600))
+CHUNK_SIZE = 1 << 24
+MANIFEST = 'manifest.json'
+
+# exclusive lock held by the OS on a lock file (fcntl.flock, msvcrt.locking on windows), so it is gone
+# with its holder, even one that was OOM-killed or SIGKILLed; the file stays (removing it would race
+# with a process waiting on it) and only carries the holder's pid. Waiting longer than LOCK_TIMEOUT
+# raises TimeoutError, the holder is alive then
+try:
+    import fcntl
+    def try_lock(fd):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+    def unlock(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+except ImportError:
+    import msvcrt
+    def try_lock(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+    def unlock(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+class FileLock:
+    def __init__(self, path, timeout=LOCK_TIMEOUT, poll=0.5):
+        self.path = path
+        self.timeout = timeout
+        self.poll = poll
+        self.fd = None
+    def __enter__(self):
+        fd = os.open(self.path, os.O_CREAT | os.O_RDWR)
+        start = time.time()
+        waited = False
+        while not try_lock(fd):
+            if time.time() - start > self.timeout:
+                os.close(fd)
+                raise TimeoutError(f"Still locked by another process after {self.timeout:.0f} s: {self.path}")
+            if not waited:
+                print(f"Waiting for another process to finish: {self.path}")
+                waited = True
+            time.sleep(self.poll)
+        self.fd = fd
+        os.ftruncate(fd, 0)
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, str(os.getpid()).encode())
+        return self
+    def __exit__(self, *exc):
+        unlock(self.fd)
+        os.close(self.fd)
+        self.fd = None
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+def file_stat(path):
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+def atomic_write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+def atomic_write_bytes(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+class ConversionCache:
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or CACHE_DIR
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.manifest_path = os.path.join(self.cache_dir, MANIFEST)
+    def lock(self, name):
+        return FileLock(os.path.join(self.cache_dir, f"{name}.lock"))
+    def read_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            manifest = {}
+        manifest.setdefault('files', {})
+        manifest.setdefault('entries', {})
+        manifest.setdefault('outputs', {})
+        return manifest
+    def update_manifest(self, update):
+        # read-modify-write under the manifest lock, so concurrent launches do not drop each other's entries
+        with self.lock('manifest'):
+            manifest = self.read_manifest()
+            update(manifest)
+            atomic_write_json(self.manifest_path, manifest)
+        return manifest
+    # sha256 of the file content; hashing a multi-GB gguf takes a while, so the digest is remembered
+    # in the manifest by (path, size, mtime) and only recomputed when the file changed
+    def fingerprint(self, path):
+        path = os.path.abspath(path)
+        stat = file_stat(path)
+        known = self.read_manifest()['files'].get(path)
+        if known and known['size'] == stat['size'] and known['mtime_ns'] == stat['mtime_ns']:
+            return known['sha256']
+        print(f"Fingerprinting: {path}")
+        sha256 = file_sha256(path)
+        def update(manifest):
+            manifest['files'][path] = dict(stat, sha256=sha256)
+        self.update_manifest(update)
+        return sha256
+    def key(self, sha256, use_bf16, metadata=None, converter=None):
+        parts = {
+            'gguf': sha256,
+            'dtype': 'bf16' if use_bf16 else 'f32',
+            'metadata': metadata or {},
+            'converter': converter_name(converter),
+            'version': CONVERTER_VERSION,
+        }
+        digest = hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:16]
+        return f"{sha256[:16]}-{parts['dtype']}-{digest}"
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.safetensors")
+    def convert(self, gguf_path, output_path, use_bf16, metadata=None, converter=None):
+        sha256 = self.fingerprint(gguf_path)
+        key = self.key(sha256, use_bf16, metadata, converter)
+        entry = self.entry_path(key)
+        output_path = os.path.abspath(output_path)
+        if os.path.exists(entry) and self.is_published(key, output_path):
+            print(f"Up to date (cached): {output_path}")
+            return output_path
+        # one conversion per key: a second launch waits here and then finds the entry in place
+        with self.lock(key):
+            if not os.path.exists(entry):
+                print(f"Not in cache, converting: {gguf_path}")
+                build(gguf_path, entry, use_bf16, metadata, converter)
+                def add_entry(manifest):
+                    manifest['entries'][key] = {
+                        'gguf': os.path.abspath(gguf_path),
+                        'sha256': sha256,
+                        'dtype': 'bf16' if use_bf16 else 'f32',
+                        'metadata': metadata or {},
+                        'converter': converter_name(converter),
+                        'version': CONVERTER_VERSION,
+                        'size': os.path.getsize(entry),
+                        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    }
+                self.update_manifest(add_entry)
+            else:
+                print(f"Found in cache: {entry}")
+            publish(entry, output_path)
+        def add_output(manifest):
+            manifest['outputs'][output_path] = dict(file_stat(output_path), key=key)
+        self.update_manifest(add_output)
+        return output_path
+    # the output is current when it is the cache entry itself (hard link), or the copy we made of it
+    # last time and nobody has touched since
+    def is_published(self, key, output_path):
+        if not os.path.exists(output_path):
+            return False
+        if os.path.samefile(self.entry_path(key), output_path):
+            return True
+        return self.read_manifest()['outputs'].get(output_path) == dict(file_stat(output_path), key=key)
+    def clear(self):
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(('.safetensors', '.model')) or name == MANIFEST:
+                os.remove(os.path.join(self.cache_dir, name))
+                removed += 1
+        return removed
+def converter_name(converter):
+    if converter is None:
+        return 'quant3.convert_gguf_to_safetensors'
+    return f"{converter.__module__.rsplit('.', 1)[-1]}.{converter.__qualname__}"
+# convert into a temp file next to the entry and rename it in place, so a killed conversion never
+# leaves a half written entry behind
+def build(gguf_path, entry, use_bf16, metadata=None, converter=None):
+    if converter is None:
+        from .quant3 import convert_gguf_to_safetensors as converter
+    tmp = f"{entry}.{os.getpid()}.tmp"
+    try:
+        # metadata goes into the header as the file is streamed, the converter has to take it
+        if metadata:
+            converter(gguf_path, tmp, use_bf16, metadata=metadata)
+        else:
+            converter(gguf_path, tmp, use_bf16)
+        os.replace(tmp, entry)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+def publish(entry, output_path):
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        try:
+            os.link(entry, tmp)
+        except OSError:
+            shutil.copyfile(entry, tmp)
+        os.replace(tmp, output_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+# drop-in for quant3.convert_gguf_to_safetensors at app startup; metadata is merged into the header as
+# the file is written (what the apps used add_metadata_to_safetensors for afterwards, rewriting the output)
+def convert_gguf_to_safetensors_cached(gguf_path, output_path, use_bf16, metadata=None, converter=None, cache_dir=None):
+    return ConversionCache(cache_dir).convert(gguf_path, output_path, use_bf16, metadata, converter)
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="list or clear the GGUF -> safetensors conversion cache")
+    parser.add_argument('--dir', default=None, help=f"cache directory (default {CACHE_DIR}, or GGUF_CONNECTOR_CACHE)")
+    parser.add_argument('--clear', action='store_true', help="remove every cached conversion")
+    args = parser.parse_args(argv)
+    cache = ConversionCache(args.dir)
+    if args.clear:
+        print(f"Removed {cache.clear()} file(s) from {cache.cache_dir}")
+        return 0
+    entries = cache.read_manifest()['entries']
+    total = 0
+    for key, entry in sorted(entries.items()):
+        present = os.path.exists(cache.entry_path(key))
+        total += entry['size'] if present else 0
+        print(f"{key}  {entry['size'] / 2**20:10.1f} MiB  {entry['dtype']}  {entry['gguf']}{'' if present else '  (missing)'}")
+    print(f"{len(entries)} entries, {total / 2**30:.2f} GiB in {cache.cache_dir}")
+    return 0
+if __name__ == "__main__":
+    raise SystemExit(main())
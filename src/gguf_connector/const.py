@@ -199,6 +199,9 @@ class Keys:
         TYPE       = "adapter.type"
         LORA_ALPHA = "adapter.lora.alpha"
 
+    class Comfy:
+        ORIG_SHAPE = "comfy.gguf.orig_shape.{name}"
+
 class GGUFType:
     MODEL   = "model"
     ADAPTER = "adapter"
@@ -15,6 +15,8 @@ def get_file_type(reader):
     ft = int(field.parts[field.data[-1]])
     return LlamaFileType(ft)
 
+# legacy second pass for ggufs converted before N-D tensors were stored in the first one (see
+# archs.fold_nd_shape): appends the tensors of a fix_5d_tensors_{arch} side file
 import os
 gguf_files = [file for file in os.listdir() if file.endswith('.gguf')]
 
@@ -2,6 +2,7 @@
 import torch # optional (need torch to work; pip install torch)
 from .const import GGML_QUANT_VERSION, LlamaFileType
 from .quant1 import load_model, handle_tensors
+from .loader import write_streamed
 
 import os
 safetensors_files = [file for file in os.listdir() if file.endswith('.safetensors')]
@@ -25,13 +26,22 @@ if safetensors_files:
             fp32 = False
         else:
             fp32 = True
+        # a quantization plan next to the model (see planner.py) is picked up automatically
+        plan = None
+        plan_path = f"{os.path.splitext(path)[0]}.plan.json"
+        if not fp32 and os.path.isfile(plan_path):
+            from .planner import load_plan
+            plan = load_plan(plan_path)
+            print(f"Quantization plan: {plan_path} is loaded!")
         writer, state_dict, _ = load_model(path,given)
         writer.add_quantization_version(GGML_QUANT_VERSION)
-        if fp32:
+        if plan is not None:
+            out_path = f"{os.path.splitext(path)[0]}-mixed.gguf"
+        elif fp32:
             out_path = f"{os.path.splitext(path)[0]}-f32.gguf"
             writer.add_file_type(LlamaFileType.MOSTLY_F16)
         else:
-            if next(iter(state_dict.values())).dtype == torch.bfloat16:
+            if state_dict.tensor_info(next(iter(state_dict)))[1] == torch.bfloat16:
                 out_path = f"{os.path.splitext(path)[0]}-bf16.gguf"
                 writer.add_file_type(LlamaFileType.MOSTLY_BF16)
             else:
@@ -39,11 +49,11 @@ if safetensors_files:
                 writer.add_file_type(LlamaFileType.MOSTLY_F16)
         if os.path.isfile(out_path):
             input("Output exists enter to continue or ctrl+c to abort!")
-        handle_tensors(writer, state_dict, fp32)
-        writer.write_header_to_file(path=out_path)
-        writer.write_kv_data_to_file()
-        writer.write_tensors_to_file(progress=True)
-        writer.close()
+        planned = handle_tensors(writer, state_dict, fp32, plan)
+        if plan is not None:
+            from .planner import plan_file_type
+            writer.add_file_type(plan_file_type(planned))
+        write_streamed(writer, out_path, state_dict, planned)
         print(f"Conversion completed: {out_path}")
     except (ValueError, IndexError):
         print("Invalid choice. Please enter a valid number.")
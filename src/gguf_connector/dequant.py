@@ -0,0 +1,544 @@
+
+import logging, os, time
+import torch # need torch to work; pip install torch
+from .reader import GGMLQuantizationType, GGML_QUANT_SIZES
+from . import quant5 as nq
+
+# Torch dequantization of every type the numpy reference (quant.py/quant5.py) can decode.
+# The kernels mirror the float32 math of the numpy dequantize_blocks step by step,
+# so with float32 as the compute dtype the results are bit-exact (see validate);
+# a lower compute dtype (float16/bfloat16) is faster on gpu but rounds the scales.
+# Without one (dtype=None) each type computes in its native dtype, as the kernels always did:
+# float16 (the dtype of the block scales) for the legacy, K and ternary quants, float32 for the rest.
+# quant2, quant2a, quant2c, quant2d, quant5a and quant5c re-export this registry.
+
+logger = logging.getLogger(__name__)
+
+QK_K = 256
+K_SCALE_SIZE = 12
+TORCH_COMPATIBLE_QTYPES = {None, GGMLQuantizationType.F32, GGMLQuantizationType.F16}
+FLOAT16_QTYPES = {
+    GGMLQuantizationType.Q4_0, GGMLQuantizationType.Q4_1, GGMLQuantizationType.Q5_0, GGMLQuantizationType.Q5_1,
+    GGMLQuantizationType.Q8_0, GGMLQuantizationType.Q2_K, GGMLQuantizationType.Q3_K, GGMLQuantizationType.Q4_K,
+    GGMLQuantizationType.Q5_K, GGMLQuantizationType.Q6_K, GGMLQuantizationType.TQ1_0, GGMLQuantizationType.TQ2_0,
+}
+
+def is_torch_compatible(tensor):
+    return tensor is None or getattr(tensor, 'tensor_type', None) in TORCH_COMPATIBLE_QTYPES
+def is_quantized(tensor):
+    return not is_torch_compatible(tensor)
+def native_dtype(qtype):
+    return torch.float16 if qtype in FLOAT16_QTYPES else torch.float32
+def dequantize_tensor(tensor, dtype=None, dequant_dtype=None):
+    qtype = getattr(tensor, 'tensor_type', None)
+    oshape = getattr(tensor, 'tensor_shape', tensor.shape)
+    if qtype in TORCH_COMPATIBLE_QTYPES:
+        return tensor.to(dtype)
+    if qtype not in dequantize_functions:
+        # every type of the numpy reference has a kernel, no cpu round trip
+        raise NotImplementedError(f'Dequantization for {qtype.name} is not yet implemented')
+    dequant_dtype = dtype if dequant_dtype == 'target' else dequant_dtype
+    return dequantize(tensor.data, qtype, oshape, dtype=dequant_dtype).to(dtype)
+def dequantize(data, qtype, oshape, dtype=None):
+    block_size, type_size = GGML_QUANT_SIZES[qtype]
+    dequantize_blocks = dequantize_functions[qtype]
+    rows = data.reshape((-1, data.shape[-1])).view(torch.uint8)
+    n_blocks = rows.numel() // type_size
+    blocks = rows.reshape((n_blocks, type_size))
+    dtype = dtype or native_dtype(qtype)
+    if COMPILE:
+        dequantize_blocks = get_compiled(qtype, dtype, blocks.device)
+    blocks = dequantize_blocks(blocks, block_size, type_size, dtype)
+    return blocks.reshape(oshape)
+# add split block by dims
+def split_block_dims(blocks, *args):
+    n_max = blocks.shape[1]
+    dims = list(args) + [n_max - sum(args)]
+    return torch.split(blocks, dims, dim=1)
+# little-endian unsigned integers from bytes (int32 for uint16, int64 for uint32; no sign to care about)
+def to_uint16(x):
+    x = x.to(torch.int32)
+    return x[..., 0::2] | x[..., 1::2] << 8
+def to_uint32(x):
+    x = x.to(torch.int64)
+    return x[..., 0::4] | x[..., 1::4] << 8 | x[..., 2::4] << 16 | x[..., 3::4] << 24
+# constants of the kernels (shift vectors, iq grids, sign and value tables), built once per
+# (device, dtype) and only read afterwards; warmup() fills the cache ahead of time
+_constants = {}
+def cached_constant(key, device, build):
+    constant = _constants.get((key, device))
+    if constant is None:
+        constant = _constants[(key, device)] = build().to(device)
+    return constant
+def clear_cache():
+    _constants.clear()
+# shifts (or any small constant) shaped for broadcasting
+def shifts(values, shape, device, dtype=torch.uint8):
+    values = tuple(values)
+    return cached_constant(('shifts', values, shape, dtype), device, lambda: torch.tensor(values, dtype=dtype).reshape(shape))
+# +1/-1 for each bit of a byte (0 is positive), indexed by the byte
+def load_signs(device, dtype):
+    def build():
+        bits = torch.arange(256, dtype=torch.int32).reshape((256, 1)) >> torch.arange(8, dtype=torch.int32)
+        return (1 - 2 * (bits & 1)).to(dtype)
+    return cached_constant(('signs', dtype), device, build)
+def unpack_signs(signs, dtype):
+    return load_signs(signs.device, dtype)[signs.long()]
+# calculate scale min (for 4_k, 5_k)
+def get_scale_min(scales):
+    n_blocks = scales.shape[0]
+    scales = scales.view(torch.uint8)
+    scales = scales.reshape((n_blocks, 3, 4))
+    d, m, m_d = torch.split(scales, scales.shape[-2] // 3, dim=-2)
+    sc = torch.cat([d & 63, m_d & 15 | d >> 2 & 48], dim=-1)
+    min = torch.cat([m & 63, m_d >> 4 | m >> 2 & 48], dim=-1)
+    return sc.reshape((n_blocks, 8)), min.reshape((n_blocks, 8))
+# grids, sign masks and value tables of the numpy classes (for the iq types and mxfp4)
+def load_grid(qtype, device, dtype):
+    def build():
+        cls = nq._type_traits[qtype]
+        cls.init_grid()
+        return torch.from_numpy(cls.grid.reshape(cls.grid_shape)).to(dtype)
+    return cached_constant(('grid', qtype, dtype), device, build)
+def load_ksigns(device, dtype):
+    # the 128 sign patterns of 8 values (an even number of minus signs), already unpacked
+    def build():
+        ksigns = torch.tensor(list(nq.IQ2_XXS.ksigns), dtype=torch.long)
+        return load_signs('cpu', dtype)[ksigns]
+    return cached_constant(('ksigns', dtype), device, build)
+def load_kvalues(qtype, device, dtype):
+    return cached_constant(('kvalues', qtype, dtype), device, lambda: torch.tensor(nq._type_traits[qtype].kvalues, dtype=dtype))
+# convert e8m0 to fp32-half (for mxfp4)
+def e8m0_to_fp32_half(x):
+    x = x.to(torch.int32)
+    bits = torch.where(x < 2, 0x00200000 << x, (x - 1) << 23)
+    return bits.view(torch.float32)
+def dequantize_blocks_BF16(blocks, block_size, type_size, dtype=None):
+    return (blocks.view(torch.int16).to(torch.int32) << 16).view(torch.float32).to(dtype)
+def dequantize_blocks_Q8_0(blocks, block_size, type_size, dtype=None):
+    d, x = split_block_dims(blocks, 2)
+    d = d.view(torch.float16).to(dtype)
+    x = x.view(torch.int8)
+    return x * d
+def dequantize_blocks_Q4_0(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    d, qs = split_block_dims(blocks, 2)
+    d = d.view(torch.float16).to(dtype)
+    qs = qs.reshape((n_blocks, -1, 1, block_size // 2)) >> shifts([0, 4], (1, 1, 2, 1), d.device)
+    qs = (qs & 15).reshape((n_blocks, -1)).to(torch.int8) - 8
+    return d * qs
+def dequantize_blocks_Q4_1(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    d, m, qs = split_block_dims(blocks, 2, 2)
+    d = d.view(torch.float16).to(dtype)
+    m = m.view(torch.float16).to(dtype)
+    qs = qs.reshape((n_blocks, -1, 1, block_size // 2)) >> shifts([0, 4], (1, 1, 2, 1), d.device)
+    qs = (qs & 15).reshape((n_blocks, -1))
+    return d * qs + m
+def dequantize_blocks_Q5_0(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    d, qh, qs = split_block_dims(blocks, 2, 4)
+    d = d.view(torch.float16).to(dtype)
+    qh = to_uint32(qh) >> shifts(range(32), (1, 32), d.device, torch.int64)
+    ql = qs.reshape((n_blocks, -1, 1, block_size // 2)) >> shifts([0, 4], (1, 1, 2, 1), d.device)
+    qh = (qh & 1).to(torch.uint8)
+    ql = (ql & 15).reshape((n_blocks, -1))
+    qs = (ql | qh << 4).to(torch.int8) - 16
+    return d * qs
+def dequantize_blocks_Q5_1(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    d, m, qh, qs = split_block_dims(blocks, 2, 2, 4)
+    d = d.view(torch.float16).to(dtype)
+    m = m.view(torch.float16).to(dtype)
+    qh = to_uint32(qh) >> shifts(range(32), (1, 32), d.device, torch.int64)
+    ql = qs.reshape((n_blocks, -1, 1, block_size // 2)) >> shifts([0, 4], (1, 1, 2, 1), d.device)
+    qh = (qh & 1).to(torch.uint8)
+    ql = (ql & 15).reshape((n_blocks, -1))
+    qs = ql | qh << 4
+    return d * qs + m
+def dequantize_blocks_Q2_K(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    scales, qs, d, dmin = split_block_dims(blocks, QK_K // 16, QK_K // 4, 2)
+    d = d.view(torch.float16).to(dtype)
+    dmin = dmin.view(torch.float16).to(dtype)
+    dl = (d * (scales & 15)).reshape((n_blocks, QK_K // 16, 1))
+    ml = (dmin * (scales >> 4)).reshape((n_blocks, QK_K // 16, 1))
+    qs = qs.reshape((n_blocks, -1, 1, 32)) >> shifts([0, 2, 4, 6], (1, 1, 4, 1), d.device)
+    qs = (qs & 3).reshape((n_blocks, QK_K // 16, 16))
+    qs = dl * qs - ml
+    return qs.reshape((n_blocks, -1))
+def dequantize_blocks_Q3_K(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    hmask, qs, scales, d = split_block_dims(blocks, QK_K // 8, QK_K // 4, 12)
+    d = d.view(torch.float16).to(dtype)
+    lscales, hscales = scales[:, :8], scales[:, 8:]
+    lscales = lscales.reshape((n_blocks, 1, 8)) >> shifts([0, 4], (1, 2, 1), d.device)
+    lscales = lscales.reshape((n_blocks, 16))
+    hscales = hscales.reshape((n_blocks, 1, 4)) >> shifts([0, 2, 4, 6], (1, 4, 1), d.device)
+    hscales = hscales.reshape((n_blocks, 16))
+    scales = lscales & 15 | (hscales & 3) << 4
+    scales = scales.to(torch.int8) - 32
+    dl = (d * scales).reshape((n_blocks, 16, 1))
+    ql = qs.reshape((n_blocks, -1, 1, 32)) >> shifts([0, 2, 4, 6], (1, 1, 4, 1), d.device)
+    qh = hmask.reshape(n_blocks, -1, 1, 32) >> shifts(range(8), (1, 1, 8, 1), d.device)
+    ql = ql.reshape((n_blocks, 16, QK_K // 16)) & 3
+    qh = qh.reshape((n_blocks, 16, QK_K // 16)) & 1
+    qh = qh ^ 1 # the offset is zero when the bitmask is 1
+    q = ql.to(torch.int8) - (qh << 2).to(torch.int8)
+    return (dl * q).reshape((n_blocks, QK_K))
+def dequantize_blocks_Q4_K(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    d, dmin, scales, qs = split_block_dims(blocks, 2, 2, K_SCALE_SIZE)
+    d = d.view(torch.float16).to(dtype)
+    dmin = dmin.view(torch.float16).to(dtype)
+    sc, m = get_scale_min(scales)
+    d = (d * sc).reshape((n_blocks, -1, 1))
+    dm = (dmin * m).reshape((n_blocks, -1, 1))
+    qs = qs.reshape((n_blocks, -1, 1, 32)) >> shifts([0, 4], (1, 1, 2, 1), d.device)
+    qs = (qs & 15).reshape((n_blocks, -1, 32))
+    return (d * qs - dm).reshape((n_blocks, QK_K))
+def dequantize_blocks_Q5_K(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    d, dmin, scales, qh, qs = split_block_dims(blocks, 2, 2, K_SCALE_SIZE, QK_K // 8)
+    d = d.view(torch.float16).to(dtype)
+    dmin = dmin.view(torch.float16).to(dtype)
+    sc, m = get_scale_min(scales)
+    d = (d * sc).reshape((n_blocks, -1, 1))
+    dm = (dmin * m).reshape((n_blocks, -1, 1))
+    ql = qs.reshape((n_blocks, -1, 1, 32)) >> shifts([0, 4], (1, 1, 2, 1), d.device)
+    qh = qh.reshape((n_blocks, -1, 1, 32)) >> shifts(range(8), (1, 1, 8, 1), d.device)
+    ql = (ql & 15).reshape((n_blocks, -1, 32))
+    qh = (qh & 1).reshape((n_blocks, -1, 32))
+    q = ql | qh << 4
+    return (d * q - dm).reshape((n_blocks, QK_K))
+def dequantize_blocks_Q6_K(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    ql, qh, scales, d = split_block_dims(blocks, QK_K // 2, QK_K // 4, QK_K // 16)
+    scales = scales.view(torch.int8).to(dtype)
+    d = d.view(torch.float16).to(dtype)
+    d = (d * scales).reshape((n_blocks, QK_K // 16, 1))
+    ql = ql.reshape((n_blocks, -1, 1, 64)) >> shifts([0, 4], (1, 1, 2, 1), d.device)
+    ql = (ql & 15).reshape((n_blocks, -1, 32))
+    qh = qh.reshape((n_blocks, -1, 1, 32)) >> shifts([0, 2, 4, 6], (1, 1, 4, 1), d.device)
+    qh = (qh & 3).reshape((n_blocks, -1, 32))
+    q = (ql | qh << 4).to(torch.int8) - 32
+    q = q.reshape((n_blocks, QK_K // 16, -1))
+    return (d * q).reshape((n_blocks, QK_K))
+def dequantize_blocks_TQ1_0(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    qs, qh, d = split_block_dims(blocks, (QK_K - 4 * QK_K // 64) // 5, QK_K // 64)
+    d = d.view(torch.float16).to(dtype)
+    qs0, qs1 = qs[..., :32], qs[..., 32:]
+    # the products wrap around in uint8, like in the reference
+    qs0 = qs0.reshape((n_blocks, -1, 1, 32)) * shifts([1, 3, 9, 27, 81], (1, 1, 5, 1), d.device)
+    qs0 = qs0.reshape((n_blocks, -1))
+    qs1 = qs1.reshape((n_blocks, -1, 1, 16)) * shifts([1, 3, 9, 27, 81], (1, 1, 5, 1), d.device)
+    qs1 = qs1.reshape((n_blocks, -1))
+    qh = qh.reshape((n_blocks, -1, 1, 4)) * shifts([1, 3, 9, 27], (1, 1, 4, 1), d.device)
+    qh = qh.reshape((n_blocks, -1))
+    qs = torch.cat([qs0, qs1, qh], dim=-1)
+    qs = (qs.to(torch.int16) * 3 >> 8).to(torch.int8) - 1
+    return d * qs
+def dequantize_blocks_TQ2_0(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    qs, d = split_block_dims(blocks, QK_K // 4)
+    d = d.view(torch.float16).to(dtype)
+    qs = qs.reshape((n_blocks, -1, 1, 32)) >> shifts([0, 2, 4, 6], (1, 1, 4, 1), d.device)
+    qs = (qs & 3).reshape((n_blocks, -1)).to(torch.int8) - 1
+    return d * qs
+def dequantize_blocks_IQ2_XXS(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    d, qs = split_block_dims(blocks, 2)
+    d = d.view(torch.float16).to(dtype)
+    # 8 bytes per 32 values: 4 grid indices, then the signs and the scale in a uint32
+    qs = qs.reshape((n_blocks, -1, 8))
+    aux = to_uint32(qs[..., 4:])[..., 0]
+    db = d * (0.5 + (aux >> 28).to(dtype)) * 0.25
+    db = db.reshape((n_blocks, -1, 1, 1))
+    signs = aux.reshape((n_blocks, -1, 1)) >> shifts([0, 7, 14, 21], (1, 1, 4), d.device, torch.int64)
+    signs = load_ksigns(d.device, dtype)[signs & 127]
+    grid = load_grid(GGMLQuantizationType.IQ2_XXS, d.device, dtype)[qs[..., :4].long()]
+    return (db * grid * signs).reshape((n_blocks, -1))
+def dequantize_blocks_IQ2_XS(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    d, qs, scales = split_block_dims(blocks, 2, 2 * QK_K // 8)
+    d = d.view(torch.float16).to(dtype)
+    qs = to_uint16(qs)
+    scales = scales.reshape((n_blocks, -1, 1)) >> shifts([0, 4], (1, 1, 2), d.device)
+    scales = (scales & 15).reshape((n_blocks, -1))
+    db = d * (0.5 + scales.to(dtype)) * 0.25
+    db = db.reshape((n_blocks, -1, 1, 1))
+    signs = load_ksigns(d.device, dtype)[qs >> 9].reshape((n_blocks, -1, 2, 8))
+    grid = load_grid(GGMLQuantizationType.IQ2_XS, d.device, dtype)[qs & 511]
+    grid = grid.reshape((n_blocks, -1, 2, 8))
+    return (db * grid * signs).reshape((n_blocks, -1))
+def dequantize_blocks_IQ2_S(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    d, qs, signs, qh, scales = split_block_dims(blocks, 2, QK_K // 8, QK_K // 8, QK_K // 32)
+    d = d.view(torch.float16).to(dtype)
+    scales = scales.reshape((n_blocks, -1, 1)) >> shifts([0, 4], (1, 1, 2), d.device)
+    scales = (scales & 15).reshape((n_blocks, -1))
+    db = d * (0.5 + scales.to(dtype)) * 0.25
+    db = db.reshape((n_blocks, -1, 1, 1))
+    signs = unpack_signs(signs, dtype).reshape((n_blocks, -1, 2, 8))
+    qh = qh.reshape((n_blocks, -1, 1)) >> shifts([0, 2, 4, 6], (1, 1, 4), d.device)
+    qs = qs.long() | ((qh & 3).long() << 8).reshape((n_blocks, -1))
+    grid = load_grid(GGMLQuantizationType.IQ2_S, d.device, dtype)[qs]
+    grid = grid.reshape((n_blocks, -1, 2, 8))
+    return (db * grid * signs).reshape((n_blocks, -1))
+def dequantize_blocks_IQ3_XXS(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    d, qs, scales = split_block_dims(blocks, 2, QK_K // 4)
+    d = d.view(torch.float16).to(dtype)
+    scales = to_uint32(scales)
+    db = d * (0.5 + (scales >> 28).to(dtype)) * 0.5
+    db = db.reshape((n_blocks, -1, 1, 1))
+    signs = scales.reshape((n_blocks, -1, 1)) >> shifts([0, 7, 14, 21], (1, 1, 4), d.device, torch.int64)
+    signs = load_ksigns(d.device, dtype)[signs & 127]
+    grid = load_grid(GGMLQuantizationType.IQ3_XXS, d.device, dtype)[qs.long()]
+    grid = grid.reshape((n_blocks, -1, 4, 8))
+    return (db * grid * signs).reshape((n_blocks, -1))
+def dequantize_blocks_IQ3_S(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    d, qs, qh, signs, scales = split_block_dims(blocks, 2, QK_K // 4, QK_K // 32, QK_K // 8)
+    d = d.view(torch.float16).to(dtype)
+    scales = scales.reshape((n_blocks, -1, 1)) >> shifts([0, 4], (1, 1, 2), d.device)
+    scales = (scales & 15).reshape((n_blocks, -1))
+    db = d * (1 + 2 * scales)
+    db = db.reshape((n_blocks, -1, 1, 1))
+    signs = unpack_signs(signs, dtype).reshape((n_blocks, -1, 4, 8))
+    qh = qh.reshape((n_blocks, -1, 1)) >> shifts(range(8), (1, 1, 8), d.device)
+    qh = (qh & 1).long().reshape((n_blocks, -1))
+    qs = qs.long() | qh << 8
+    grid = load_grid(GGMLQuantizationType.IQ3_S, d.device, dtype)[qs]
+    grid = grid.reshape((n_blocks, -1, 4, 8))
+    return (db * grid * signs).reshape((n_blocks, -1))
+def dequantize_blocks_IQ1_S(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    d, qs, qh = split_block_dims(blocks, 2, QK_K // 8)
+    d = d.view(torch.float16).to(dtype)
+    qh = to_uint16(qh)
+    dl = d * (2 * (qh >> 12 & 7) + 1)
+    dl = dl.reshape((n_blocks, -1, 1, 1))
+    delta = nq.IQ1_S.delta * (1 - 2 * (qh >> 15)).to(dtype)
+    delta = delta.reshape((n_blocks, -1, 1, 1))
+    qh = qh.reshape((n_blocks, -1, 1)) >> shifts([0, 3, 6, 9], (1, 1, 4), d.device, torch.int32)
+    qs = qs.long() | ((qh & 7) << 8).reshape((n_blocks, -1))
+    grid = load_grid(GGMLQuantizationType.IQ1_S, d.device, dtype)[qs]
+    grid = grid.reshape((n_blocks, -1, 4, 8))
+    return (dl * (grid + delta)).reshape((n_blocks, -1))
+def dequantize_blocks_IQ1_M(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    qs, qh, scales = split_block_dims(blocks, QK_K // 8, QK_K // 16)
+    # the f16 scale is packed across the top nibbles of the 4 uint16 scales
+    scales = to_uint16(scales)
+    d = (scales & 0xF000) >> shifts([12, 8, 4, 0], (1, 4), scales.device, torch.int32)
+    d = d[..., 0] | d[..., 1] | d[..., 2] | d[..., 3]
+    d = d.to(torch.int16).view(torch.float16).to(dtype).reshape((n_blocks, 1))
+    scales = scales.reshape((n_blocks, -1, 1)) >> shifts([0, 3, 6, 9], (1, 1, 4), d.device, torch.int32)
+    scales = (scales & 7).reshape((n_blocks, -1))
+    dl = d * (2 * scales + 1)
+    dl = dl.reshape((n_blocks, -1, 2, 1, 1))
+    qh = qh.reshape((n_blocks, -1, 1)) >> shifts([0, 4], (1, 1, 2), d.device)
+    qs = qs.long() | ((qh & 7).long() << 8).reshape((n_blocks, -1))
+    delta = nq.IQ1_M.delta * (1 - 2 * (qh >> 3 & 1).to(torch.int8)).to(dtype)
+    delta = delta.reshape((n_blocks, -1, 2, 2, 1))
+    grid = load_grid(GGMLQuantizationType.IQ1_M, d.device, dtype)[qs]
+    grid = grid.reshape((n_blocks, -1, 2, 2, 8))
+    return (dl * (grid + delta)).reshape((n_blocks, -1))
+def dequantize_blocks_IQ4_NL(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    d, qs = split_block_dims(blocks, 2)
+    d = d.view(torch.float16).to(dtype)
+    qs = qs.reshape((n_blocks, -1, 1, block_size // 2)) >> shifts([0, 4], (1, 1, 2, 1), d.device)
+    qs = (qs & 15).reshape((n_blocks, -1)).long()
+    qs = load_kvalues(GGMLQuantizationType.IQ4_NL, d.device, dtype)[qs]
+    return d * qs
+def dequantize_blocks_IQ4_XS(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    d, scales_h, scales_l, qs = split_block_dims(blocks, 2, 2, QK_K // 64)
+    d = d.view(torch.float16).to(dtype)
+    scales_h = to_uint16(scales_h)
+    scales_l = scales_l.reshape((n_blocks, -1, 1)) >> shifts([0, 4], (1, 1, 2), d.device)
+    scales_h = scales_h.reshape((n_blocks, 1, -1)) >> shifts([2 * i for i in range(QK_K // 32)], (1, -1, 1), d.device, torch.int32)
+    scales_l = scales_l.reshape((n_blocks, -1)) & 15
+    scales_h = (scales_h.reshape((n_blocks, -1)) & 3).to(torch.uint8)
+    scales = (scales_l | scales_h << 4).to(torch.int8) - 32
+    dl = (d * scales).reshape((n_blocks, -1, 1))
+    qs = qs.reshape((n_blocks, -1, 1, 16)) >> shifts([0, 4], (1, 1, 2, 1), d.device)
+    qs = (qs & 15).reshape((n_blocks, -1, 32)).long()
+    qs = load_kvalues(GGMLQuantizationType.IQ4_NL, d.device, dtype)[qs]
+    return (dl * qs).reshape((n_blocks, -1))
+def dequantize_blocks_MXFP4(blocks, block_size, type_size, dtype=None):
+    n_blocks = blocks.shape[0]
+    e, qs = split_block_dims(blocks, 1)
+    d = e8m0_to_fp32_half(e).to(dtype)
+    qs = qs.reshape((n_blocks, 1, block_size // 2)) >> shifts([0, 4], (1, 2, 1), d.device)
+    qs = (qs & 15).reshape((n_blocks, block_size)).long()
+    qs = load_kvalues(GGMLQuantizationType.MXFP4, d.device, dtype)[qs]
+    return d * qs
+dequantize_functions = {
+    GGMLQuantizationType.BF16: dequantize_blocks_BF16,
+    GGMLQuantizationType.Q8_0: dequantize_blocks_Q8_0,
+    GGMLQuantizationType.Q4_0: dequantize_blocks_Q4_0,
+    GGMLQuantizationType.Q4_1: dequantize_blocks_Q4_1,
+    GGMLQuantizationType.Q5_0: dequantize_blocks_Q5_0,
+    GGMLQuantizationType.Q5_1: dequantize_blocks_Q5_1,
+    GGMLQuantizationType.Q2_K: dequantize_blocks_Q2_K,
+    GGMLQuantizationType.Q3_K: dequantize_blocks_Q3_K,
+    GGMLQuantizationType.Q4_K: dequantize_blocks_Q4_K,
+    GGMLQuantizationType.Q5_K: dequantize_blocks_Q5_K,
+    GGMLQuantizationType.Q6_K: dequantize_blocks_Q6_K,
+    GGMLQuantizationType.TQ1_0: dequantize_blocks_TQ1_0,
+    GGMLQuantizationType.TQ2_0: dequantize_blocks_TQ2_0,
+    GGMLQuantizationType.IQ2_XXS: dequantize_blocks_IQ2_XXS,
+    GGMLQuantizationType.IQ2_XS: dequantize_blocks_IQ2_XS,
+    GGMLQuantizationType.IQ2_S: dequantize_blocks_IQ2_S,
+    GGMLQuantizationType.IQ3_XXS: dequantize_blocks_IQ3_XXS,
+    GGMLQuantizationType.IQ3_S: dequantize_blocks_IQ3_S,
+    GGMLQuantizationType.IQ1_S: dequantize_blocks_IQ1_S,
+    GGMLQuantizationType.IQ1_M: dequantize_blocks_IQ1_M,
+    GGMLQuantizationType.IQ4_NL: dequantize_blocks_IQ4_NL,
+    GGMLQuantizationType.IQ4_XS: dequantize_blocks_IQ4_XS,
+    GGMLQuantizationType.MXFP4: dequantize_blocks_MXFP4,
+    }
+# build the constants of the kernels (and the compiled graphs in compiled mode) for device and the compute
+# dtypes ahead of the first forward pass; one all-zero block per type, which also gets the lazy init
+# of the device backend out of the way
+def warmup(device='cpu', dtypes=(torch.float32,), qtypes=None):
+    device = torch.device(device)
+    if device.type == 'cuda' and device.index is None:
+        device = torch.device('cuda', torch.cuda.current_device())
+    for qtype in qtypes or dequantize_functions:
+        block_size, type_size = GGML_QUANT_SIZES[qtype]
+        blocks = torch.zeros((1, type_size), dtype=torch.uint8, device=device)
+        for dtype in dtypes:
+            dequantize_functions[qtype](blocks, block_size, type_size, dtype)
+            if COMPILE:
+                get_compiled(qtype, dtype, device)(blocks, block_size, type_size, dtype)
+    return len(_constants)
+# optional torch.compile of the kernels (set_compile or GGUF_DEQUANT_COMPILE=1), which fuses each chain
+# of small ops into one loop; the graphs are cached per (qtype, compute dtype, device).
+# A compiled kernel is only kept when it gives the same bits as the eager one on random blocks and
+# isn't slower, so a missing compiler, an unsupported backend or a codegen bug just means eager.
+COMPILE = os.environ.get("GGUF_DEQUANT_COMPILE", "0") == "1"
+_compiled = {}
+def set_compile(enabled=True):
+    global COMPILE
+    COMPILE = enabled and hasattr(torch, 'compile')
+    return COMPILE
+def get_compiled(qtype, dtype, device):
+    key = (qtype, dtype, device)
+    kernel = _compiled.get(key)
+    if kernel is None:
+        kernel = _compiled[key] = pick_kernel(qtype, dtype, device)[0]
+    return kernel
+def time_kernel(kernel, blocks, block_size, type_size, dtype, n_runs=3):
+    # best of n_runs, in seconds
+    best = None
+    for _ in range(n_runs):
+        if blocks.device.type == 'cuda':
+            torch.cuda.synchronize(blocks.device)
+        t0 = time.perf_counter()
+        out = kernel(blocks, block_size, type_size, dtype)
+        if blocks.device.type == 'cuda':
+            torch.cuda.synchronize(blocks.device)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+def pick_kernel(qtype, dtype, device, n_blocks=4096):
+    # returns the kernel to use and the measures behind the choice
+    eager = dequantize_functions[qtype]
+    block_size, type_size = GGML_QUANT_SIZES[qtype]
+    report = {"type": qtype.name, "compiled": False, "exact": False, "compile_s": 0.0}
+    generator = torch.Generator().manual_seed(0)
+    blocks = torch.randint(0, 256, (n_blocks, type_size), dtype=torch.uint8, generator=generator).to(device)
+    # the constants are built eagerly first, so that the traced graph only reads the cache
+    eager(blocks[:1], block_size, type_size, dtype)
+    report["eager_s"], expected = time_kernel(eager, blocks, block_size, type_size, dtype)
+    report["compiled_s"] = report["eager_s"]
+    if not hasattr(torch, 'compile'):
+        return eager, report
+    try:
+        compiled = torch.compile(eager, dynamic=True)
+        t0 = time.perf_counter()
+        compiled(blocks, block_size, type_size, dtype)
+        report["compile_s"] = time.perf_counter() - t0
+        report["compiled_s"], got = time_kernel(compiled, blocks, block_size, type_size, dtype)
+    except Exception as e:
+        logger.warning(f'Compiling the {qtype.name} dequant kernel failed, staying eager: {e}')
+        return eager, report
+    # the random scales give nans too, whose payloads may differ
+    report["exact"] = bool(((got == expected) | (got.isnan() & expected.isnan())).all())
+    if not report["exact"]:
+        logger.warning(f'The compiled {qtype.name} dequant kernel is not bit-exact, staying eager')
+        return eager, report
+    report["compiled"] = report["compiled_s"] < report["eager_s"]
+    return (compiled if report["compiled"] else eager), report
+# eager against compiled throughput of every kernel (millions of values per second)
+def bench_compile(qtypes=None, n_blocks=16384, device='cpu', dtype=torch.float32):
+    device = torch.device(device)
+    results = []
+    for qtype in qtypes or dequantize_functions:
+        kernel, report = pick_kernel(qtype, dtype, device, n_blocks)
+        _compiled[(qtype, dtype, device)] = kernel
+        n_values = n_blocks * GGML_QUANT_SIZES[qtype][0]
+        report["eager_mvals"] = n_values / report["eager_s"] / 1e6
+        report["compiled_mvals"] = n_values / report["compiled_s"] / 1e6
+        report["speedup"] = report["eager_s"] / report["compiled_s"]
+        results.append(report)
+    return results
+# random blocks of qtype (quantized by the numpy reference, with a few raw bytes mixed in
+# so that every bit pattern of the scales shows up too)
+def random_blocks(qtype, n_blocks=256, seed=0):
+    import numpy as np
+    block_size, type_size = GGML_QUANT_SIZES[qtype]
+    rng = np.random.default_rng(seed)
+    data = rng.standard_normal((n_blocks, block_size), dtype=np.float32)
+    data *= rng.uniform(1e-3, 1e2, (n_blocks, 1)).astype(np.float32)
+    raw = rng.integers(0, 256, (n_blocks // 4, type_size), dtype=np.uint8)
+    try:
+        blocks = nq.quantize(data, qtype).reshape((n_blocks, type_size))
+    except NotImplementedError:
+        # no numpy quantizer for this type, random bytes only
+        return rng.integers(0, 256, (n_blocks, type_size), dtype=np.uint8)
+    return np.concatenate([blocks, raw])
+# bit-for-bit comparison of the kernels with the numpy reference, returns the mismatching types
+def validate(qtypes=None, n_blocks=256, device='cpu', seed=0):
+    import numpy as np
+    mismatches = []
+    for qtype in qtypes or dequantize_functions:
+        blocks = random_blocks(qtype, n_blocks, seed)
+        with np.errstate(invalid='ignore', over='ignore'):
+            expected = nq.dequantize(blocks, qtype)
+        data = torch.from_numpy(blocks).to(device)
+        got = dequantize(data, qtype, expected.shape, dtype=torch.float32).cpu().numpy()
+        # compare the bits (so -0.0 != 0.0), nan scales of the raw blocks may give other nan payloads
+        same = (got.view(np.uint32) == expected.view(np.uint32)) | (np.isnan(got) & np.isnan(expected))
+        if got.dtype != expected.dtype or not same.all():
+            mismatches.append(qtype)
+    return mismatches
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Check the torch dequantization kernels bit-for-bit against the numpy reference')
+    parser.add_argument('--device', default='cpu', help='torch device of the kernels')
+    parser.add_argument('--blocks', type=int, default=256, help='number of random blocks per type')
+    parser.add_argument('--types', default=None, help='comma separated types (default: all)')
+    parser.add_argument('--compile', action='store_true', help='check the compiled kernels (torch.compile)')
+    parser.add_argument('--bench', action='store_true', help='compare the eager and compiled throughput instead')
+    args = parser.parse_args(argv)
+    qtypes = [GGMLQuantizationType[name.strip().upper()] for name in args.types.split(',')] if args.types else None
+    if args.bench:
+        print(f"{'type':<8} {'eager Mv/s':>11} {'compiled Mv/s':>14} {'speedup':>8} {'compile s':>10}")
+        for r in bench_compile(qtypes, max(args.blocks, 16384), args.device):
+            note = ' (kept)' if r['compiled'] else ' (not bit-exact, eager)' if not r['exact'] else ' (slower, eager)'
+            print(f"{r['type']:<8} {r['eager_mvals']:>11.1f} {r['compiled_mvals']:>14.1f} {r['speedup']:>7.2f}x {r['compile_s']:>10.1f}{note}")
+        return 0
+    if args.compile and not set_compile(True):
+        raise SystemExit('torch.compile is not available')
+    mismatches = validate(qtypes, args.blocks, args.device)
+    for qtype in qtypes or dequantize_functions:
+        print(f"{qtype.name:<8} {'mismatch' if qtype in mismatches else 'ok'}")
+    return 1 if mismatches else 0
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -8,8 +8,7 @@ from fastapi import FastAPI, File, UploadFile, Form
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import io, os
-from gguf_connector.quant3 import convert_gguf_to_safetensors
-from gguf_connector.quant4 import add_metadata_to_safetensors
+from gguf_connector.cache import convert_gguf_to_safetensors_cached
 from gguf_connector.f4 import get_hf_cache_hub_path
 gguf_files = [file for file in os.listdir() if file.endswith('.gguf')]
 if gguf_files:
@@ -35,8 +34,7 @@ if gguf_files:
         else:
             use_bf16 = False
         print(f"Prepare to dequantize: {input_path}")
-        convert_gguf_to_safetensors(input_path, model_path, use_bf16)
-        add_metadata_to_safetensors(model_path, {'format': 'pt'})
+        convert_gguf_to_safetensors_cached(input_path, model_path, use_bf16, metadata={'format': 'pt'})
         MODEL_ID = "callgg/fastvlm-0.5b-bf16"
         IMAGE_TOKEN_INDEX = -200
         print("Loading model...")
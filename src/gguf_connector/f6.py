@@ -11,8 +11,7 @@ else:
     selected = "0.5b"
     print(f'connector choice: {selected}\n')
 
-from .quant3 import convert_gguf_to_safetensors
-from .quant4 import add_metadata_to_safetensors
+from .cache import convert_gguf_to_safetensors_cached
 gguf_files = [file for file in os.listdir() if file.endswith('.gguf')]
 
 if gguf_files:
@@ -37,8 +36,7 @@ if gguf_files:
         else:
             use_bf16 = False
         print(f"Prepare to dequantize: {selected_file_path}")
-        convert_gguf_to_safetensors(selected_file_path, model_path, use_bf16)
-        add_metadata_to_safetensors(model_path, {'format': 'pt'})
+        convert_gguf_to_safetensors_cached(selected_file_path, model_path, use_bf16, metadata={'format': 'pt'})
         if selected == '1.5b':
             launch_fastvlm15_app()
         else:
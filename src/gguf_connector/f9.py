@@ -2,8 +2,7 @@
 import torch, os # need torch to work; pip install torch
 from .f4 import launch_fastvlm9_app, get_hf_cache_hub_path
 
-from .quant3 import convert_gguf_to_safetensors
-from .quant4 import add_metadata_to_safetensors
+from .cache import convert_gguf_to_safetensors_cached
 gguf_files = [file for file in os.listdir() if file.endswith('.gguf')]
 if gguf_files:
     print("\nGGUF file(s) available. Select which one to use:")
@@ -28,8 +27,7 @@ if gguf_files:
         else:
             use_bf16 = False
         print(f"Prepare to dequantize: {selected_file_path}")
-        convert_gguf_to_safetensors(selected_file_path, model_path, use_bf16)
-        add_metadata_to_safetensors(model_path, {'format': 'pt'})
+        convert_gguf_to_safetensors_cached(selected_file_path, model_path, use_bf16, metadata={'format': 'pt'})
         launch_fastvlm9_app()
     except (ValueError, IndexError) as e:
         print(f"Invalid choice. Please enter a valid number. ({e})")
@@ -0,0 +1,144 @@
+
+import math, os
+import torch # need torch to work; pip install torch
+from safetensors import safe_open
+from tqdm import tqdm
+from .loader import DTYPE_NAMES, read_safetensors_header, file_order
+from .sfwriter import DEFAULT_CHUNK_BYTES, SafetensorsWriter
+
+# safetensors -> fp8 safetensors, on cpu or gpu: every weight (floating, 2 dims or more) is stored as
+# float8 with float32 scales in a companion tensor "<name>_scale", one per output channel (row of the
+# weight) or one per block_size x block_size block of its 2-D view (rows x everything else), so an
+# outlier only costs the precision of its own channel or block; weight = fp8.float() * scale (see
+# dequantize_fp8). Tensors are read by chunks of rows through safe_open and written straight into
+# place (see sfwriter), so neither the model nor its quantized copy is ever held in memory.
+FP8_DTYPES = {
+    'e4m3': torch.float8_e4m3fn,
+    'e5m2': torch.float8_e5m2,
+}
+SCALE_MODES = ('channel', 'block')
+DEFAULT_BLOCK_SIZE = 128
+QUANTIZATION_THRESHOLD = 1024  # tensors with fewer params are kept as they are
+SCALE_SUFFIX = '_scale'
+
+def default_device():
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+def is_quantizable(name, dtype, shape, keep=()):
+    return (dtype in (torch.float32, torch.float16, torch.bfloat16)
+        and len(shape) > 1
+        and math.prod(shape) >= QUANTIZATION_THRESHOLD
+        and not any(x in name for x in keep))
+# rows x columns the scales are taken over: dim 0 against all the others
+def view_2d(shape):
+    return shape[0], math.prod(shape[1:])
+def scale_shape(shape, mode='channel', block_size=DEFAULT_BLOCK_SIZE):
+    if mode == 'channel':
+        return (shape[0],) + (1,) * (len(shape) - 1)
+    rows, cols = view_2d(shape)
+    return (-(-rows // block_size), -(-cols // block_size))
+# fp8 values and float32 scales of a tensor (or of a chunk of its rows, a multiple of block_size of them
+# in block mode), computed in float32 on whatever device x is on
+def quantize_fp8(x, dtype=torch.float8_e4m3fn, mode='channel', block_size=DEFAULT_BLOCK_SIZE):
+    fp8_max = torch.finfo(dtype).max
+    shape = x.shape
+    rows, cols = view_2d(shape)
+    x = x.reshape(rows, cols).to(torch.float32)
+    if mode == 'channel':
+        scale = x.abs().amax(dim=1, keepdim=True) / fp8_max
+        scale[scale == 0] = 1.0
+        q = (x / scale).clamp(-fp8_max, fp8_max).to(dtype)
+        return q.reshape(shape), scale.reshape(scale_shape(shape, mode))
+    if mode != 'block':
+        raise ValueError(f"Unknown scale mode: {mode!r} (expected one of {', '.join(SCALE_MODES)})")
+    rb, cb = -(-rows // block_size), -(-cols // block_size)
+    # zero padding to whole blocks, it doesn't change any block's maximum
+    x = torch.nn.functional.pad(x, (0, cb * block_size - cols, 0, rb * block_size - rows))
+    blocks = x.reshape(rb, block_size, cb, block_size)
+    scale = blocks.abs().amax(dim=(1, 3)) / fp8_max
+    scale[scale == 0] = 1.0
+    q = (blocks / scale[:, None, :, None]).clamp(-fp8_max, fp8_max).to(dtype)
+    q = q.reshape(rb * block_size, cb * block_size)[:rows, :cols]
+    return q.reshape(shape), scale
+# mode and block_size as the file was written with (see scale_params); without a mode, a scale with one
+# value per row of q is taken as per-channel
+def dequantize_fp8(q, scale, dtype=torch.float32, block_size=DEFAULT_BLOCK_SIZE, mode=None):
+    x = q.to(torch.float32)
+    if mode is None:
+        per_row = scale.dim() == q.dim() and scale.shape[0] == q.shape[0] and all(n == 1 for n in scale.shape[1:])
+        mode = 'channel' if per_row else 'block'
+    if mode == 'channel':
+        return (x * scale.reshape(scale_shape(q.shape, mode))).to(dtype)
+    if mode != 'block':
+        raise ValueError(f"Unknown scale mode: {mode!r} (expected one of {', '.join(SCALE_MODES)})")
+    rows, cols = view_2d(q.shape)
+    full = scale.repeat_interleave(block_size, dim=0).repeat_interleave(block_size, dim=1)[:rows, :cols]
+    return (x.reshape(rows, cols) * full).reshape(q.shape).to(dtype)
+# (mode, block_size) of a file from its metadata, for dequantize_fp8 (mode None if it has no fp8_scale)
+def scale_params(metadata):
+    metadata = metadata or {}
+    return metadata.get('fp8_scale'), int(metadata.get('fp8_block_size', DEFAULT_BLOCK_SIZE))
+# <model>_fp8_e4m3fn.safetensors, the name q.py always gave its output
+def fp8_output_path(input_path, fmt='e4m3'):
+    return f"{os.path.splitext(input_path)[0]}_fp8_{str(FP8_DTYPES[fmt]).split('float8_')[-1]}.safetensors"
+def quantize_safetensors_to_fp8(input_path, output_path, fmt='e4m3', mode='channel', block_size=DEFAULT_BLOCK_SIZE, device=None, keep=(), chunk_bytes=DEFAULT_CHUNK_BYTES):
+    if fmt not in FP8_DTYPES:
+        raise ValueError(f"Unknown fp8 format: {fmt!r} (expected one of {', '.join(FP8_DTYPES)})")
+    if mode not in SCALE_MODES:
+        raise ValueError(f"Unknown scale mode: {mode!r} (expected one of {', '.join(SCALE_MODES)})")
+    dtype = FP8_DTYPES[fmt]
+    device = device or default_device()
+    header = read_safetensors_header(input_path)
+    metadata = dict(header.get('__metadata__') or {})
+    metadata.update(fp8_format=fmt, fp8_scale=mode)
+    if mode == 'block':
+        metadata['fp8_block_size'] = block_size
+    names = file_order(header)
+    entries, quantized = [], set()
+    with safe_open(input_path, framework="pt", device="cpu") as f:
+        for name in names:
+            # dtype and shape from the slice, without reading the tensor
+            sl = f.get_slice(name)
+            shape = tuple(sl.get_shape())
+            src_dtype = DTYPE_NAMES[sl.get_dtype()]
+            if is_quantizable(name, src_dtype, shape, keep):
+                entries += [(name, dtype, shape), (name + SCALE_SUFFIX, torch.float32, scale_shape(shape, mode, block_size))]
+                quantized.add(name)
+            else:
+                entries.append((name, src_dtype, shape))
+        print(f"Quantizing {len(quantized)} of {len(names)} tensors to fp8 {fmt} ({mode} scales) on {device}")
+        with SafetensorsWriter(output_path, entries, metadata) as writer:
+            for name in tqdm(names, desc="Quantizing tensors", unit="tensor"):
+                sl = f.get_slice(name)
+                shape = tuple(sl.get_shape())
+                if name not in quantized:
+                    writer.write(name, f.get_tensor(name))
+                    continue
+                rows, cols = view_2d(shape)
+                step = max(1, chunk_bytes // (cols * 4))
+                if mode == 'block':
+                    step = max(1, step // block_size) * block_size
+                scale_row_bytes = (1 if mode == 'channel' else -(-cols // block_size)) * 4
+                for start in range(0, rows, step):
+                    end = min(rows, start + step)
+                    q, scale = quantize_fp8(sl[start:end].to(device), dtype, mode, block_size)
+                    writer.write(name, q, start * cols * q.element_size())
+                    scale_start = start if mode == 'channel' else start // block_size
+                    writer.write(name + SCALE_SUFFIX, scale, scale_start * scale_row_bytes)
+    return output_path
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="quantize the weights of a safetensors model to fp8 with per-channel or per-block scales")
+    parser.add_argument('model', help="input .safetensors file")
+    parser.add_argument('-o', '--output', default=None, help="output .safetensors file (default <model>_fp8_e4m3fn.safetensors or _fp8_e5m2)")
+    parser.add_argument('--format', default='e4m3', choices=sorted(FP8_DTYPES), help="fp8 format (default e4m3)")
+    parser.add_argument('--scale', default='channel', choices=SCALE_MODES, help="one scale per output channel or per block (default channel)")
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE, help=f"rows and columns of a block (default {DEFAULT_BLOCK_SIZE})")
+    parser.add_argument('--device', default=None, help="cpu or cuda (default cuda when available)")
+    parser.add_argument('--keep', action='append', default=[], help="keep tensors whose name contains this as they are (repeatable)")
+    args = parser.parse_args(argv)
+    output = args.output or fp8_output_path(args.model, args.format)
+    quantize_safetensors_to_fp8(args.model, output, args.format, args.scale, args.block_size, args.device, args.keep)
+    print(f"Quantized safetensors saved to {output}.")
+    return 0
+if __name__ == "__main__":
+    raise SystemExit(main())
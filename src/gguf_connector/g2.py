@@ -63,7 +63,7 @@ def punc_norm(text: str) -> str:
         text += "."
     return text
 
-from .quant3 import convert_gguf_to_safetensors
+from .cache import convert_gguf_to_safetensors_cached
 gguf_files = [file for file in os.listdir() if file.endswith('.gguf')]
 
 if gguf_files:
@@ -101,9 +101,9 @@ if gguf_files:
                     clip_path = f"{model_folder}{os.path.splitext(s3_path)[0]}-f32.safetensors"
                 # dequantization process begins
                 print(f"Prepare to dequantize T3: {t3_path}")
-                convert_gguf_to_safetensors(t3_path, model_path, use_bf16)
+                convert_gguf_to_safetensors_cached(t3_path, model_path, use_bf16)
                 print(f"Prepare to dequantize S3: {s3_path}")
-                convert_gguf_to_safetensors(s3_path, clip_path, use_bf16)
+                convert_gguf_to_safetensors_cached(s3_path, clip_path, use_bf16)
             except (ValueError, IndexError) as e:
                 print(f"Invalid choice. Please enter a valid number. ({e})")
     except (ValueError, IndexError):
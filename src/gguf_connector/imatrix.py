@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import numpy as np
+from .reader import GGUFReader
+
+# Importance matrices for quantize(), keyed by tensor name.
+# Each entry holds the mean of the squared activations of every column,
+# with one row per matrix for stacked (3D) tensors like the experts of a MoE.
+
+def load_imatrix_gguf(path: str) -> dict[str, np.ndarray]:
+    # llama-imatrix stores the sums of the squared activations as "<name>.in_sum2"
+    # and the number of contributing tokens as "<name>.counts", one per matrix
+    reader = GGUFReader(path)
+    sums: dict[str, np.ndarray] = {}
+    counts: dict[str, np.ndarray] = {}
+    for tensor in reader.tensors:
+        if tensor.name.endswith(".in_sum2"):
+            sums[tensor.name[:-len(".in_sum2")]] = np.array(tensor.data, dtype=np.float32)
+        elif tensor.name.endswith(".counts"):
+            counts[tensor.name[:-len(".counts")]] = np.array(tensor.data, dtype=np.float32)
+    imatrix = {}
+    for name, in_sum2 in sums.items():
+        if name not in counts:
+            raise ValueError(f"Missing counts for imatrix entry {name!r} in {path}")
+        in_sum2 = in_sum2.reshape((-1, in_sum2.shape[-1]))
+        count = counts[name].reshape((-1, 1))
+        # matrices which were never used (e.g. experts that no token was routed to) get a uniform importance
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = np.where(count > 0, in_sum2 / count, 1)
+        imatrix[name] = values[0] if values.shape[0] == 1 else values
+    return imatrix
+
+def load_imatrix_npz(path: str) -> dict[str, np.ndarray]:
+    with np.load(path) as f:
+        return {name: f[name].astype(np.float32) for name in f.files}
+
+def load_imatrix(path: str) -> dict[str, np.ndarray]:
+    if str(path).lower().endswith(".npz"):
+        return load_imatrix_npz(path)
+    return load_imatrix_gguf(path)
+
+def save_imatrix_npz(imatrix: dict[str, np.ndarray], path: str) -> None:
+    np.savez(path, **{name: np.asarray(values, dtype=np.float32) for name, values in imatrix.items()})
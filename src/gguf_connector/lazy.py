@@ -8,6 +8,11 @@ from numpy.typing import DTypeLike
 
 logger = logging.getLogger(__name__)
 
+# methods which apply to each element on its own, chains of them can be evaluated by chunks (see LazyBase.to_eager)
+ELEMENTWISE_METHODS = frozenset(("astype", "clip", "round"))
+# special ops which don't keep the dtype or don't work element by element
+NOT_ELEMENTWISE_OPS = frozenset(("lt", "le", "eq", "ne", "ge", "gt", "matmul"))
+
 class LazyMeta(ABCMeta):
 
     def __new__(cls, name: str, bases: tuple[type, ...], namespace: dict[str, Any], **kwargs):
@@ -17,6 +22,7 @@ class LazyMeta(ABCMeta):
                 return type(self)._wrap_fn(
                     (lambda s, *args, **kwargs: getattr(s, name)(*args, **kwargs)),
                     use_self=self,
+                    elementwise=name in ELEMENTWISE_METHODS,
                 )
             elif isinstance(meta_attr, self._tensor_type):
                 # e.g. self.T with torch.Tensor should still be wrapped
@@ -31,12 +37,13 @@ class LazyMeta(ABCMeta):
         # need to make a builder for the wrapped wrapper to copy the name,
         # or else it fails with very cryptic error messages,
         # because somehow the same string would end up in every closures
-        def mk_wrap(op_name: str, *, meta_noop: bool = False):
+        def mk_wrap(op_name: str, *, meta_noop: bool = False, elementwise: bool = False):
             # need to wrap the wrapper to get self
             def wrapped_special_op(self, *args, **kwargs):
                 return type(self)._wrap_fn(
                     getattr(type(self)._tensor_type, op_name),
                     meta_noop=meta_noop,
+                    elementwise=elementwise,
                 )(self, *args, **kwargs)
             return wrapped_special_op
 
@@ -54,7 +61,7 @@ class LazyMeta(ABCMeta):
             attr_name = f"__{binary_op}__"
             # the result of these operators usually has the same shape and dtype as the input,
             # so evaluation on the meta tensor can be skipped.
-            namespace[attr_name] = mk_wrap(attr_name, meta_noop=True)
+            namespace[attr_name] = mk_wrap(attr_name, meta_noop=True, elementwise=binary_op not in NOT_ELEMENTWISE_OPS)
 
         for special_op in (
             "getitem", "setitem", "len",
@@ -72,14 +79,17 @@ class LazyBase(ABC, metaclass=LazyMeta):
     _args: tuple
     _kwargs: dict[str, Any]
     _func: Callable[[Any], Any] | None
+    # whether _func works element by element, with a result of the same shape as its first argument
+    _elementwise: bool
 
-    def __init__(self, *, meta: Any, data: Any | None = None, args: tuple = (), kwargs: dict[str, Any] | None = None, func: Callable[[Any], Any] | None = None):
+    def __init__(self, *, meta: Any, data: Any | None = None, args: tuple = (), kwargs: dict[str, Any] | None = None, func: Callable[[Any], Any] | None = None, elementwise: bool = False):
         super().__init__()
         self._meta = meta
         self._data = data
         self._args = args
         self._kwargs = kwargs if kwargs is not None else {}
         self._func = func
+        self._elementwise = elementwise
         assert self._func is not None or self._data is not None
 
     def __init_subclass__(cls) -> None:
@@ -103,7 +113,7 @@ class LazyBase(ABC, metaclass=LazyMeta):
             return o
 
     @classmethod
-    def _wrap_fn(cls, fn: Callable, *, use_self: LazyBase | None = None, meta_noop: bool | DTypeLike | tuple[DTypeLike, Callable[[tuple[int, ...]], tuple[int, ...]]] = False) -> Callable[[Any], Any]:
+    def _wrap_fn(cls, fn: Callable, *, use_self: LazyBase | None = None, meta_noop: bool | DTypeLike | tuple[DTypeLike, Callable[[tuple[int, ...]], tuple[int, ...]]] = False, elementwise: bool = False) -> Callable[[Any], Any]:
         def wrapped_fn(*args, **kwargs):
             if kwargs is None:
                 kwargs = {}
@@ -134,7 +144,7 @@ class LazyBase(ABC, metaclass=LazyMeta):
                         res = cls.meta_with_dtype_and_shape(meta_noop, res.shape)
 
             if isinstance(res, cls._tensor_type):
-                return cls(meta=cls.eager_to_meta(res), args=args, kwargs=kwargs, func=fn)
+                return cls(meta=cls.eager_to_meta(res), args=args, kwargs=kwargs, func=fn, elementwise=elementwise)
             elif isinstance(res, tuple) and all(isinstance(t, cls._tensor_type) for t in res):
                 # share the evaluation between lazy tuple elements
                 shared_args: list = [args, None]
@@ -153,22 +163,75 @@ class LazyBase(ABC, metaclass=LazyMeta):
                 return fn(*eager_args, **kwargs)
         return wrapped_fn
 
-    @classmethod
-    def to_eager(cls, t: Any) -> Any:
-        def simple_to_eager(_t: LazyBase) -> Any:
-            if _t._data is not None:
-                return _t._data
+    @staticmethod
+    def _lazy_args(o: Any) -> list[LazyBase]:
+        found: list[LazyBase] = []
+        LazyBase._recurse_apply(o, found.append)
+        return found
 
-            # NOTE: there's a recursion limit in Python (usually 1000)
+    # The unevaluated nodes of the chain of elementwise ops ending at root (same shape as root),
+    # in evaluation order, and the nodes the chain depends on.
+    @classmethod
+    def _fusion_plan(cls, root: LazyBase) -> tuple[list[LazyBase], list[LazyBase]]:
+        if not root._elementwise:
+            return [root], cls._lazy_args(root._args)
+        order: list[LazyBase] = []
+        deps: list[LazyBase] = []
+        seen: set[int] = set()
+        stack: list[tuple[LazyBase, bool]] = [(root, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                order.append(node)
+                continue
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            stack.append((node, True))
+            for arg in cls._lazy_args(node._args):
+                if arg._data is None and arg._elementwise and arg._meta.shape == root._meta.shape:
+                    stack.append((arg, False))
+                else:
+                    deps.append(arg)
+        return order, deps
 
-            assert _t._func is not None
-            _t._args = cls._recurse_apply(_t._args, simple_to_eager)
-            _t._data = _t._func(*_t._args, **_t._kwargs)
-            # sanity check
-            assert _t._data is not None
-            assert _t._data.dtype == _t._meta.dtype
-            assert _t._data.shape == _t._meta.shape
+    @classmethod
+    def _eval_node(cls, node: LazyBase) -> None:
+        assert node._func is not None
+        node._args = cls._recurse_apply(node._args, lambda t: t._data)
+        node._data = node._func(*node._args, **node._kwargs)
+        # sanity check
+        assert node._data is not None
+        assert node._data.dtype == node._meta.dtype
+        assert node._data.shape == node._meta.shape
+
+    # Evaluate the nodes of a fused chain (see _fusion_plan), whose dependencies are already evaluated.
+    # This is done node by node here, backends can do better (e.g. by chunks).
+    @classmethod
+    def _eval_fused(cls, order: list[LazyBase]) -> None:
+        for node in order:
+            cls._eval_node(node)
 
+    @classmethod
+    def to_eager(cls, t: Any) -> Any:
+        def simple_to_eager(_t: LazyBase) -> Any:
+            # post-order walk with an explicit stack, deep graphs would hit the recursion limit of Python otherwise
+            stack = [_t]
+            while stack:
+                node = stack[-1]
+                if node._data is not None:
+                    stack.pop()
+                    continue
+                order, deps = cls._fusion_plan(node)
+                pending = [dep for dep in deps if dep._data is None]
+                if pending:
+                    stack.extend(pending)
+                    continue
+                stack.pop()
+                if len(order) > 1:
+                    cls._eval_fused(order)
+                else:
+                    cls._eval_node(node)
             return _t._data
 
         # recurse into lists and/or tuples, keeping their structure
@@ -206,13 +269,93 @@ class LazyNumpyTensor(LazyBase):
         cheat = np.zeros(1, dtype)
         return np.lib.stride_tricks.as_strided(cheat, shape, (0 for _ in shape))
 
+    # safetensors dtypes which numpy can hold, the others (BF16, F8_*) are read as float32 (only possible from framework="pt")
+    _st_dtype_map: dict[str, DTypeLike] = {
+        "F64": np.float64,
+        "F32": np.float32,
+        "F16": np.float16,
+        "I64": np.int64,
+        "I32": np.int32,
+        "I16": np.int16,
+        "I8": np.int8,
+        "U8": np.uint8,
+        "BOOL": np.bool_,
+    }
+
+    # Lazy leaf over the data of a GGUFReader tensor: a view of the memmap, nothing is read until evaluated.
+    # Quantized tensors are uint8 with their byte shape, like ReaderTensor.data (dequantize with tensor.tensor_type).
+    @classmethod
+    def from_reader_tensor(cls, tensor: Any) -> LazyNumpyTensor:
+        return cls(meta=cls.eager_to_meta(tensor.data), data=tensor.data)
+
+    # Lazy leaf over a slice of a safetensors file (safe_open(...).get_slice(name)), read when evaluated.
+    @classmethod
+    def from_safetensors_slice(cls, st_slice: Any) -> LazyNumpyTensor:
+        dtype = cls._st_dtype_map.get(st_slice.get_dtype(), np.float32)
+        meta = cls.meta_with_dtype_and_shape(dtype, tuple(st_slice.get_shape()))
+        return cls(meta=meta, args=(st_slice, dtype), func=_read_safetensors_slice)
+
     def astype(self, dtype, *args, **kwargs):
         meta = type(self).meta_with_dtype_and_shape(dtype, self._meta.shape)
         full_args = (self, dtype,) + args
-        return type(self)(meta=meta, args=full_args, kwargs=kwargs, func=(lambda a, *args, **kwargs: a.astype(*args, **kwargs)))
+        return type(self)(meta=meta, args=full_args, kwargs=kwargs, func=(lambda a, *args, **kwargs: a.astype(*args, **kwargs)), elementwise=True)
+
+    # Chains of elementwise ops are evaluated by chunks of rows into the output buffer,
+    # so the intermediate results stay small (about this size) instead of each being a full-size array.
+    _chunk_nbytes: int = 1 << 20
+
+    @classmethod
+    def _eval_fused(cls, order: list[LazyBase]) -> None:
+        root = order[-1]
+        shape = root._meta.shape
+        if len(shape) == 0 or shape[0] <= 1:
+            return super()._eval_fused(order)
+        n_rows = shape[0]
+        out = np.empty(shape, dtype=root._meta.dtype)
+        chunk_rows = max(1, cls._chunk_nbytes // max(1, out.nbytes // n_rows))
+
+        for start in range(0, n_rows, chunk_rows):
+            end = min(start + chunk_rows, n_rows)
+            values: dict[int, np.ndarray] = {}
+
+            def chunk_of(o: Any) -> Any:
+                if isinstance(o, (list, tuple)):
+                    return type(o)(chunk_of(item) for item in o)
+                if isinstance(o, LazyBase):
+                    if id(o) in values:
+                        return values[id(o)]
+                    o = o._data
+                # operands broadcast along the rows are used whole
+                if isinstance(o, np.ndarray) and o.ndim == len(shape) and o.shape[0] == n_rows:
+                    return o[start:end]
+                return o
+
+            for node in order:
+                assert node._func is not None
+                values[id(node)] = node._func(*chunk_of(node._args), **node._kwargs)
+            res = values[id(root)]
+            # sanity check
+            assert res.dtype == out.dtype
+            assert res.shape == out[start:end].shape
+            out[start:end] = res
+
+        # the intermediate nodes stay unevaluated, only the result is kept
+        root._data = out
+        root._args = ()
+        root._kwargs = {}
 
     def tofile(self, *args, **kwargs):
         eager = LazyNumpyTensor.to_eager(self)
         return eager.tofile(*args, **kwargs)
 
     # TODO: __array_function__
+
+def _read_safetensors_slice(st_slice: Any, dtype: DTypeLike) -> np.ndarray:
+    data = st_slice[:]
+    if hasattr(data, "detach"):
+        # torch tensor (framework="pt")
+        if np.dtype(dtype) == np.float32:
+            import torch # optional (need torch to work; pip install torch)
+            data = data.to(torch.float32)
+        data = data.numpy()
+    return data
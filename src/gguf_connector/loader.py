@@ -0,0 +1,223 @@
+
+import json, pickle, struct, zipfile
+from collections import OrderedDict
+from collections.abc import Mapping
+import numpy as np
+import torch # need torch to work; pip install torch
+from safetensors import safe_open
+from tqdm import tqdm
+from .const import GGML_QUANT_SIZES, GGMLQuantizationType
+from .quant import quantize, QuantError
+from .planner import tensor_nbytes
+
+# lazy state dicts for the safetensors/pt -> gguf converters: nothing is read up front, each tensor is
+# read when it is looked up (in file order when iterated) and freed once the caller drops it, and the
+# prefix stripping only renames keys, so there is never a second, filtered copy of the model
+PREFIXES = ("model.diffusion_model.", "model.")
+# safetensors dtype names -> torch dtypes
+DTYPE_NAMES = {
+    'F64': torch.float64,
+    'F32': torch.float32,
+    'F16': torch.float16,
+    'BF16': torch.bfloat16,
+    'I64': torch.int64,
+    'I32': torch.int32,
+    'I16': torch.int16,
+    'I8': torch.int8,
+    'U8': torch.uint8,
+    'BOOL': torch.bool,
+    'F8_E4M3': getattr(torch, "float8_e4m3fn", None),
+    'F8_E5M2': getattr(torch, "float8_e5m2", None),
+}
+
+def read_safetensors_header(path):
+    with open(path, 'rb') as f:
+        (n,) = struct.unpack('<Q', f.read(8))
+        return json.loads(f.read(n))
+# tensor names by position of their data in the file, so iterating reads the file front to back
+def file_order(header):
+    names = [name for name in header if name != '__metadata__']
+    return sorted(names, key=lambda name: header[name]['data_offsets'][0])
+# the first prefix any key starts with (None if none does)
+def detect_prefix(keys, prefixes=PREFIXES):
+    keys = list(keys)
+    for pfx in prefixes:
+        if any(x.startswith(pfx) for x in keys):
+            return pfx
+    return None
+# {new name: source key}, same filter as the converters used: keys without the prefix are dropped
+def strip_prefix(keys, prefix):
+    names = {}
+    for k in keys:
+        if prefix and prefix not in k:
+            continue
+        names[k.replace(prefix, "") if prefix else k] = k
+    return names
+# a plan's types keyed by the names of a state dict: plans are keyed by the prefix stripped names (see
+# planner.py), converters which keep the prefix (quant1) look their keys up without it
+def match_plan(plan, keys, prefixes=PREFIXES):
+    keys = list(keys)
+    names = {k: n for n, k in strip_prefix(keys, detect_prefix(keys, prefixes)).items()}
+    matched = {}
+    for key in keys:
+        if key in plan:
+            matched[key] = plan[key]
+        elif names.get(key) in plan:
+            matched[key] = plan[names[key]]
+    if not matched:
+        print(f"[WARNING] The quantization plan matches none of the {len(keys)} tensors, the default types are used")
+    return matched
+class LazyStateDict(Mapping):
+    def __init__(self, names, get):
+        self.names = names
+        self.get_source = get
+    def __getitem__(self, key):
+        return self.get_source(self.names[key])
+    def __iter__(self):
+        return iter(self.names)
+    def __len__(self):
+        return len(self.names)
+    # membership and keys without reading any tensor (Mapping's default would)
+    def __contains__(self, key):
+        return key in self.names
+    def __repr__(self):
+        return f"{type(self).__name__}({len(self)} tensors)"
+    # (shape, dtype) of a tensor without reading it; torch checkpoints are memory mapped (or loaded already)
+    def tensor_info(self, key):
+        data = self[key]
+        return tuple(data.shape), data.dtype
+class SafetensorsStateDict(LazyStateDict):
+    def __init__(self, path, prefixes=PREFIXES):
+        self.path = path
+        self.header = read_safetensors_header(path)
+        self.file = safe_open(path, framework="pt", device="cpu")
+        order = file_order(self.header)
+        self.prefix = detect_prefix(order, prefixes)
+        super().__init__(strip_prefix(order, self.prefix), self.file.get_tensor)
+    def metadata(self):
+        return self.header.get('__metadata__')
+    # lazy slice handle (see lazy.LazyNumpyTensor.from_safetensors_slice)
+    def get_slice(self, key):
+        return self.file.get_slice(self.names[key])
+    def tensor_info(self, key):
+        entry = self.header[self.names[key]]
+        return tuple(entry['shape']), DTYPE_NAMES[entry['dtype']]
+# .pt/.ckpt/.bin/.pth: memory mapped where torch can (zip checkpoints), so tensors are paged in as read
+def load_torch_state_dict(path):
+    try:
+        return torch.load(path, map_location="cpu", weights_only=True, mmap=True)
+    except RuntimeError:
+        # legacy (non zip) checkpoints can't be mapped
+        return torch.load(path, map_location="cpu", weights_only=True)
+# key names of a .pt/.ckpt/.bin/.pth zip checkpoint, from its data.pkl alone: tensors and any other
+# class unpickle to placeholders (nothing is imported or read from the data records)
+class Placeholder:
+    def __init__(self, *args, **kwargs):
+        pass
+    def __setstate__(self, state):
+        pass
+class KeysUnpickler(pickle.Unpickler):
+    safe = {("collections", "OrderedDict"): OrderedDict, ("builtins", "dict"): dict, ("builtins", "set"): set, ("builtins", "list"): list}
+    def find_class(self, module, name):
+        return self.safe.get((module, name), Placeholder)
+    def persistent_load(self, pid):
+        return None
+def read_torch_keys(path):
+    if not zipfile.is_zipfile(path):
+        return None
+    with zipfile.ZipFile(path) as zf:
+        names = [n for n in zf.namelist() if n == "data.pkl" or n.endswith("/data.pkl")]
+        if not names:
+            return None
+        with zf.open(names[0]) as f:
+            return KeysUnpickler(f).load()
+# the (prefix stripped) tensor names a converter will see, read from the header only; legacy (non zip)
+# torch checkpoints have no separate pickle and are loaded
+def read_state_dict_keys(path, prefixes=PREFIXES, subkeys=("model", "module")):
+    if any(path.endswith(x) for x in [".ckpt", ".pt", ".bin", ".pth"]):
+        state_dict = read_torch_keys(path)
+        if state_dict is None:
+            return list(load_lazy_state_dict(path, prefixes, subkeys, min_keys=0))
+        for subkey in subkeys:
+            if subkey in state_dict:
+                state_dict = state_dict[subkey]
+                break
+        keys = [k for k in state_dict.keys() if isinstance(k, str)]
+    else:
+        keys = file_order(read_safetensors_header(path))
+    return list(strip_prefix(keys, detect_prefix(keys, prefixes)))
+def load_lazy_state_dict(path, prefixes=PREFIXES, subkeys=("model", "module"), min_keys=20):
+    if any(path.endswith(x) for x in [".ckpt", ".pt", ".bin", ".pth"]):
+        state_dict = load_torch_state_dict(path)
+        for subkey in subkeys:
+            if subkey in state_dict:
+                state_dict = state_dict[subkey]
+                break
+        if len(state_dict) < min_keys:
+            raise RuntimeError(f"pt subkey load failed: {state_dict.keys()}")
+        prefix = detect_prefix(state_dict.keys(), prefixes)
+        return LazyStateDict(strip_prefix(state_dict.keys(), prefix), state_dict.__getitem__)
+    return SafetensorsStateDict(path, prefixes)
+# torch tensor -> numpy for quantize(): numpy has no bfloat16 or float8, those go through float32/float16
+def tensor_to_numpy(data):
+    if data.dtype == torch.bfloat16:
+        return data.to(torch.float32).numpy()
+    elif data.dtype in [getattr(torch, "float8_e4m3fn", "_invalid"), getattr(torch, "float8_e5m2", "_invalid")]:
+        return data.to(torch.float16).numpy()
+    return data.numpy()
+# gguf types a tensor can be written as with its bits untouched
+PASSTHROUGH_QTYPES = {
+    torch.float32: GGMLQuantizationType.F32,
+    torch.float16: GGMLQuantizationType.F16,
+    torch.bfloat16: GGMLQuantizationType.BF16,
+}
+# the tensor's own bytes when it already is qtype (bf16 as uint8 with the byte shape, like quantize()
+# returns it), so BF16 -> BF16 skips the float32 round trip; None when a real conversion is needed
+def passthrough(data, qtype):
+    if PASSTHROUGH_QTYPES.get(data.dtype) != qtype or data.dim() == 0:
+        return None
+    data = data.contiguous()
+    if data.dtype == torch.bfloat16:
+        return data.view(torch.uint8).numpy()
+    return data.numpy()
+# torch tensor -> what the writer takes for qtype: its own bytes when they already are qtype, else quantized
+# (a qtype that can't use the imatrix of the tensor is quantized without it, the size is the same)
+def convert_tensor(data, qtype, imatrix=None):
+    raw = passthrough(data, qtype)
+    if raw is not None:
+        return raw
+    data = tensor_to_numpy(data)
+    if imatrix is not None:
+        try:
+            return quantize(data, qtype, imatrix)
+        except QuantError as e:
+            tqdm.write(f"quantizing without imatrix: {e}")
+    return quantize(data, qtype)
+# streamed conversions (as requant.py does): a first pass over the header shapes and dtypes picks the type
+# of every tensor and adds its info, so header, metadata and tensor infos are written before any tensor
+# is read; then each tensor is read, converted, written and dropped, one at a time
+def add_planned_tensor(writer, name, shape, qtype):
+    writer.add_tensor_info(name, shape, np.float32, tensor_nbytes(shape, qtype), raw_dtype=qtype)
+# qtype, or F16 when the rows don't split into its blocks (quantize() would refuse them)
+def fallback_qtype(shape, qtype):
+    if len(shape) > 0 and shape[-1] % GGML_QUANT_SIZES[qtype][0] != 0:
+        tqdm.write(f"falling back to F16: Can't quantize tensor with shape {shape} to {qtype.name}")
+        return GGMLQuantizationType.F16
+    return qtype
+# planned: [(key, shape, qtype)] in the order of the tensor infos, shape the one written (folded or
+# rearranged); convert(data, key, qtype) -> array, by default convert_tensor with the imatrix of the key
+def write_streamed(writer, path, state_dict, planned, imatrix=None, convert=None, progress=True):
+    writer.write_header_to_file(path=path)
+    writer.write_kv_data_to_file()
+    writer.write_ti_data_to_file()
+    for key, shape, qtype in tqdm(planned, desc="Writing", unit="tensor", disable=not progress):
+        data = state_dict[key]
+        if tuple(data.shape) != tuple(shape):
+            data = data.reshape(shape)
+        if convert is not None:
+            data = convert(data, key, qtype)
+        else:
+            data = convert_tensor(data, qtype, imatrix.get(key) if imatrix is not None else None)
+        writer.write_tensor_data(data)
+        del data
+    writer.close()
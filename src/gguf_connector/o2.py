@@ -32,7 +32,7 @@ else:
     device = torch.device("cpu")
 print(f"Using device: {device}")
 from gguf_connector.quant4 import convert_safetensors_to_pth
-from gguf_connector.quant3 import convert_gguf_to_safetensors
+from gguf_connector.cache import convert_gguf_to_safetensors_cached
 gguf_files = [file for file in os.listdir() if file.endswith('.gguf')]
 if gguf_files:
     print("GGUF file(s) available. Select which one for codec:")
@@ -69,10 +69,10 @@ if gguf_files:
                 m_output_path = f"{model_folder}model.pth"
                 # dequantization process begins
                 print(f"Prepare to dequantize CLIP: {input_path}")
-                convert_gguf_to_safetensors(input_path, out_path, use_bf16)
+                convert_gguf_to_safetensors_cached(input_path, out_path, use_bf16)
                 convert_safetensors_to_pth(out_path, output_path)
                 print(f"Prepare to dequantize MODEL: {m_path}")
-                convert_gguf_to_safetensors(m_path, m_out_path, use_bf16)
+                convert_gguf_to_safetensors_cached(m_path, m_out_path, use_bf16)
                 convert_safetensors_to_pth(m_out_path, m_output_path)
             except (ValueError, IndexError):
                 print("Invalid choice. Please enter a valid number.")
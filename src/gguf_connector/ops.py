@@ -0,0 +1,333 @@
+
+import itertools, os, threading, time
+from collections import OrderedDict
+import torch # need torch to work; pip install torch
+from .reader import GGMLQuantizationType, GGML_QUANT_SIZES, GGUFReader
+from .dequant import TORCH_COMPATIBLE_QTYPES, dequantize, is_quantized, native_dtype
+
+# Torch layers running straight from GGUF weights: the weights stay as the raw (quantized) bytes of the
+# memmap and get dequantized into the compute dtype on each forward, so a model takes its quantized size
+# in memory; an optional LRU cache keeps recently used dequantized weights under a byte budget.
+
+# raw bytes of a GGUF tensor (uint8 with the byte shape for the quantized types), plus its type and
+# logical shape (torch order); ops on it give plain tensors, only to/clone/detach keep the subclass
+class GGMLTensor(torch.Tensor):
+    __torch_function__ = torch._C._disabled_torch_function_impl
+    def __new__(cls, data, tensor_type=None, tensor_shape=None):
+        return torch.Tensor._make_subclass(cls, data, False)
+    def __init__(self, data, tensor_type=None, tensor_shape=None):
+        self.tensor_type = tensor_type
+        self.tensor_shape = torch.Size(tensor_shape if tensor_shape is not None else data.shape)
+    @classmethod
+    def from_reader_tensor(cls, tensor, shape=None):
+        # zero-copy over the memmap; open the reader copy-on-write (GGUFReader(path, 'c')), torch can't
+        # have a read-only tensor. shape overrides the stored one (reader.get_tensor_shape, for tensors
+        # stored reshaped)
+        return cls(torch.from_numpy(tensor.data), tensor.tensor_type, shape or tuple(reversed(tensor.shape.tolist())))
+    def wrap(self, data):
+        return GGMLTensor(data, self.tensor_type, self.tensor_shape)
+    def to(self, *args, **kwargs):
+        return self.wrap(self.as_subclass(torch.Tensor).to(*args, **kwargs))
+    def clone(self, *args, **kwargs):
+        return self.wrap(self.as_subclass(torch.Tensor).clone(*args, **kwargs))
+    def detach(self):
+        return self.wrap(self.as_subclass(torch.Tensor).detach())
+    def __deepcopy__(self, memo):
+        return self.clone()
+    def __reduce_ex__(self, protocol):
+        return (GGMLTensor, (self.as_subclass(torch.Tensor), self.tensor_type, tuple(self.tensor_shape)))
+    def __repr__(self):
+        name = self.tensor_type.name if self.tensor_type is not None else None
+        return f'GGMLTensor(type={name}, shape={tuple(self.tensor_shape)}, bytes={self.nbytes}, device={self.device})'
+# dequantized rows of a weight are made (and multiplied) by tiles of about this many bytes, which keeps
+# a tile in the L2 cache while the inputs stream through it, and bounds the transient memory (the kernels
+# themselves allocate a few times the tile in intermediates) to the tile instead of the weight
+DEFAULT_TILE_BYTES = 1 << 20
+def tile_rows(n_rows, n_cols, dtype, tile_bytes=DEFAULT_TILE_BYTES):
+    rows = max(1, tile_bytes // (n_cols * torch.empty((), dtype=dtype).element_size()))
+    # whole multiples of 16 rows (vector widths), unless the tile is smaller
+    return min(n_rows, rows if rows < 16 else rows // 16 * 16)
+# dequantized (or cast) weight in dtype, as a plain tensor; quantized weights are done tile by tile
+# into the output (tile_bytes=None for all at once)
+def dequantize_weight(weight, dtype=None, tile_bytes=DEFAULT_TILE_BYTES):
+    qtype = getattr(weight, 'tensor_type', None)
+    data = weight.as_subclass(torch.Tensor)
+    if qtype in TORCH_COMPATIBLE_QTYPES:
+        return data.reshape(getattr(weight, 'tensor_shape', data.shape)).to(dtype)
+    shape = weight.tensor_shape
+    if tile_bytes is None or len(shape) < 2:
+        return dequantize(data, qtype, shape, dtype=dtype).to(dtype)
+    dtype = dtype or native_dtype(qtype)
+    rows = data.reshape((-1, data.shape[-1]))
+    # rows as stored, which for a weight stored reshaped (reader.get_tensor_shape) aren't shape[-1] wide
+    block_size, type_size = GGML_QUANT_SIZES[qtype]
+    n_cols = rows.shape[1] // type_size * block_size
+    out = torch.empty((rows.shape[0], n_cols), dtype=dtype, device=data.device)
+    step = tile_rows(rows.shape[0], n_cols, dtype, tile_bytes)
+    for start in range(0, rows.shape[0], step):
+        tile = rows[start:start + step]
+        out[start:start + step] = dequantize(tile, qtype, (tile.shape[0], n_cols), dtype=dtype)
+    return out.reshape(shape)
+# x2 @ W.T with the rows of W built one tile at a time by tile(start, end); the tiles are multiplied into
+# place (into the transposed output, so each one writes contiguous rows), or, when x2 needs a gradient,
+# concatenated, since mm with out= can't be differentiated (autograd then keeps the tiles for backward)
+def tiled_matmul(x2, out_features, step, tile):
+    if torch.is_grad_enabled() and x2.requires_grad:
+        return torch.cat([torch.mm(tile(start, min(start + step, out_features)), x2.t()) for start in range(0, out_features, step)]).t()
+    out = torch.empty((out_features, x2.shape[0]), dtype=x2.dtype, device=x2.device)
+    for start in range(0, out_features, step):
+        end = min(start + step, out_features)
+        torch.mm(tile(start, end), x2.t(), out=out[start:end])
+    return out.t()
+# x @ weight.T (+ bias) for a quantized (out_features, in_features) weight, one tile of output features
+# at a time, so the full dequantized weight never exists (any block type works: rows are whole blocks)
+def quantized_linear(x, weight, bias=None, dtype=None, tile_bytes=DEFAULT_TILE_BYTES):
+    dtype = dtype or x.dtype
+    out_features, in_features = weight.tensor_shape
+    rows = weight.as_subclass(torch.Tensor).reshape((out_features, -1))
+    x2 = x.reshape((-1, in_features)).to(dtype)
+    step = tile_rows(out_features, in_features, dtype, tile_bytes)
+    def tile(start, end):
+        return dequantize(rows[start:end], weight.tensor_type, (end - start, in_features), dtype=dtype).to(dtype)
+    out = tiled_matmul(x2, out_features, step, tile)
+    if bias is not None:
+        out = out + bias.to(dtype)
+    return out.reshape((*x.shape[:-1], out_features))
+# LRU cache of dequantized weights, shared by the layers given it, with a budget in bytes
+class DequantCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    def get(self, key, build):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = build()
+        size = value.numel() * value.element_size()
+        if size > self.max_bytes:
+            return value
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = value
+                self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, old = self.entries.popitem(last=False)
+                self.nbytes -= old.numel() * old.element_size()
+        return value
+    def drop(self, owner):
+        # entries of one layer (its weights changed)
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == owner]:
+                old = self.entries.pop(key)
+                self.nbytes -= old.numel() * old.element_size()
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+    def __deepcopy__(self, memo):
+        # shared, like the layers given it share it
+        return self
+    def __getstate__(self):
+        return {'max_bytes': self.max_bytes}
+    def __setstate__(self, state):
+        self.__init__(state['max_bytes'])
+    def __repr__(self):
+        return f'DequantCache({len(self.entries)} weights, {self.nbytes / 1024**2:.1f}/{self.max_bytes / 1024**2:.1f} MiB, {self.hits} hits, {self.misses} misses)'
+_layer_ids = itertools.count()
+# common part of the layers: the weight (and bias) buffers, the compute dtype and the cache
+class GGUFLayer(torch.nn.Module):
+    def __init__(self, weight, bias=None, compute_dtype=None, cache=None, tile_bytes=DEFAULT_TILE_BYTES):
+        super().__init__()
+        self.register_buffer('weight', weight)
+        self.register_buffer('bias', bias)
+        self.compute_dtype = compute_dtype
+        self.cache = cache
+        self.tile_bytes = tile_bytes
+        self.layer_id = next(_layer_ids)
+    def _apply(self, fn, *args, **kwargs):
+        # the weights move (or change), the cached copies are stale
+        if self.cache is not None:
+            self.cache.drop(self.layer_id)
+        return super()._apply(fn, *args, **kwargs)
+    def get_weight(self, dtype):
+        if self.cache is None or not is_quantized(self.weight):
+            return dequantize_weight(self.weight, dtype, self.tile_bytes)
+        return self.cache.get((self.layer_id, dtype, self.weight.device), lambda: dequantize_weight(self.weight, dtype, self.tile_bytes))
+    def get_bias(self, dtype):
+        return None if self.bias is None else dequantize_weight(self.bias, dtype)
+class GGUFLinear(GGUFLayer):
+    def __init__(self, weight, bias=None, compute_dtype=None, cache=None, tile_bytes=DEFAULT_TILE_BYTES):
+        super().__init__(weight, bias, compute_dtype, cache, tile_bytes)
+        self.out_features, self.in_features = getattr(weight, 'tensor_shape', weight.shape)
+    def forward(self, x):
+        dtype = self.compute_dtype or x.dtype
+        # without a cache (or tile), the weight is only ever dequantized one tile at a time
+        if is_quantized(self.weight) and self.cache is None and self.tile_bytes is not None:
+            out = quantized_linear(x, self.weight, self.get_bias(dtype), dtype, self.tile_bytes)
+        else:
+            out = torch.nn.functional.linear(x.to(dtype), self.get_weight(dtype), self.get_bias(dtype))
+        return out.to(x.dtype)
+    def extra_repr(self):
+        qtype = getattr(self.weight, 'tensor_type', None)
+        return f'in_features={self.in_features}, out_features={self.out_features}, bias={self.bias is not None}, type={getattr(qtype, "name", None)}'
+class GGUFEmbedding(GGUFLayer):
+    def __init__(self, weight, padding_idx=None, compute_dtype=None, cache=None, tile_bytes=DEFAULT_TILE_BYTES):
+        super().__init__(weight, None, compute_dtype, cache, tile_bytes)
+        self.num_embeddings, self.embedding_dim = getattr(weight, 'tensor_shape', weight.shape)
+        self.padding_idx = padding_idx
+    def forward(self, ids):
+        dtype = self.compute_dtype or torch.get_default_dtype()
+        if not is_quantized(self.weight) or (self.cache is not None and (self.layer_id, dtype, self.weight.device) in self.cache.entries):
+            return torch.nn.functional.embedding(ids, self.get_weight(dtype), self.padding_idx)
+        # rows are whole blocks, so only the looked up rows get dequantized
+        rows = self.weight.as_subclass(torch.Tensor).reshape((self.num_embeddings, -1))[ids.reshape(-1)]
+        out = dequantize(rows, self.weight.tensor_type, (rows.shape[0], self.embedding_dim), dtype=dtype)
+        return out.to(dtype).reshape((*ids.shape, self.embedding_dim))
+    def extra_repr(self):
+        qtype = getattr(self.weight, 'tensor_type', None)
+        return f'{self.num_embeddings}, {self.embedding_dim}, type={getattr(qtype, "name", None)}'
+# Q8_0 (and Q4_0, unpacked) weights as contiguous int8 values with one fp16 scale per block of 32;
+# values * scales is exactly their dequantization, and the matmul reads 1 byte per weight plus the scales
+INT8_QTYPES = (GGMLQuantizationType.Q8_0, GGMLQuantizationType.Q4_0)
+def to_int8(weight):
+    if not isinstance(weight, GGMLTensor):
+        weight = GGMLTensor.from_reader_tensor(weight)
+    qtype = weight.tensor_type
+    if qtype not in INT8_QTYPES:
+        raise ValueError(f'Only {", ".join(q.name for q in INT8_QTYPES)} map to int8, not {qtype.name}')
+    shape = weight.tensor_shape
+    block_size, type_size = GGML_QUANT_SIZES[qtype]
+    blocks = weight.as_subclass(torch.Tensor).reshape((-1, type_size))
+    scales = blocks[:, :2].contiguous().view(torch.float16)
+    if qtype == GGMLQuantizationType.Q8_0:
+        values = blocks[:, 2:].contiguous().view(torch.int8)
+    else:
+        # low nibbles are the first half of the block
+        qs = blocks[:, 2:]
+        values = torch.cat([qs & 15, qs >> 4], dim=-1).to(torch.int8) - 8
+    return values.reshape(shape), scales.reshape((*shape[:-1], shape[-1] // block_size))
+# linear layer over int8 values and block scales (see to_int8), dequantized one tile of rows at a time
+class Int8Linear(torch.nn.Module):
+    block_size = 32
+    def __init__(self, values, scales, bias=None, compute_dtype=None, tile_bytes=DEFAULT_TILE_BYTES):
+        super().__init__()
+        self.register_buffer('values', values)
+        self.register_buffer('scales', scales)
+        self.register_buffer('bias', bias)
+        self.out_features, self.in_features = values.shape
+        self.compute_dtype = compute_dtype
+        self.tile_bytes = tile_bytes
+    @classmethod
+    def from_ggml(cls, weight, bias=None, compute_dtype=None, tile_bytes=DEFAULT_TILE_BYTES):
+        values, scales = to_int8(weight)
+        if bias is not None:
+            bias = dequantize_weight(bias, torch.float32)
+        return cls(values, scales, bias, compute_dtype, tile_bytes)
+    def dequantize_rows(self, start, end, dtype):
+        values = self.values[start:end].reshape((end - start, -1, self.block_size))
+        return (values.to(dtype) * self.scales[start:end].to(dtype).unsqueeze(-1)).reshape((-1, self.in_features))
+    def forward(self, x):
+        dtype = self.compute_dtype or x.dtype
+        x2 = x.reshape((-1, self.in_features)).to(dtype)
+        step = tile_rows(self.out_features, self.in_features, dtype, self.tile_bytes or self.values.numel())
+        out = tiled_matmul(x2, self.out_features, step, lambda start, end: self.dequantize_rows(start, end, dtype))
+        if self.bias is not None:
+            out = out + self.bias.to(dtype)
+        return out.reshape((*x.shape[:-1], self.out_features)).to(x.dtype)
+    def extra_repr(self):
+        return f'in_features={self.in_features}, out_features={self.out_features}, bias={self.bias is not None}'
+# swap the nn.Linear/nn.Embedding submodules of model whose weight is in tensors (name -> GGMLTensor,
+# e.g. from a GGUFReader with GGMLTensor.from_reader_tensor) for GGUF layers; returns the swapped names
+# (with int8, the Q8_0/Q4_0 linear weights become Int8Linear)
+def convert_module(model, tensors, compute_dtype=None, cache=None, prefix='', tile_bytes=DEFAULT_TILE_BYTES, int8=False):
+    swapped = []
+    for name, child in list(model.named_children()):
+        full_name = f'{prefix}{name}'
+        weight = tensors.get(f'{full_name}.weight')
+        if isinstance(child, torch.nn.Linear) and weight is not None:
+            bias = tensors.get(f'{full_name}.bias')
+            if bias is None and child.bias is not None:
+                bias = child.bias.detach()
+            if int8 and getattr(weight, 'tensor_type', None) in INT8_QTYPES:
+                setattr(model, name, Int8Linear.from_ggml(weight, bias, compute_dtype, tile_bytes))
+            else:
+                setattr(model, name, GGUFLinear(weight, bias, compute_dtype, cache, tile_bytes))
+            swapped.append(full_name)
+        elif isinstance(child, torch.nn.Embedding) and weight is not None:
+            setattr(model, name, GGUFEmbedding(weight, child.padding_idx, compute_dtype, cache, tile_bytes))
+            swapped.append(full_name)
+        else:
+            swapped += convert_module(child, tensors, compute_dtype, cache, f'{full_name}.', tile_bytes, int8)
+    return swapped
+# GGMLTensor of every tensor of a GGUF file (a path, or a reader opened with mode 'c'), over its
+# memmap, in the shape it was converted from
+def load_ggml_tensors(reader):
+    if isinstance(reader, (str, os.PathLike)):
+        reader = GGUFReader(reader, 'c')
+    return {tensor.name: GGMLTensor.from_reader_tensor(tensor, reader.get_tensor_shape(tensor)) for tensor in reader.tensors}
+# int8 layer against the float paths on a random weight: the int8 weight must dequantize to exactly what
+# the dequant kernel gives; times in ms per forward for each number of tokens
+def bench_int8(out_features=14336, in_features=4096, tokens=(1, 16, 64), qtypes=INT8_QTYPES, n_runs=3):
+    import numpy as np
+    from .dequant import dequantize_functions
+    from .quant import quantize
+    def timed(layer, x):
+        layer(x)
+        t0 = time.perf_counter()
+        for _ in range(n_runs):
+            layer(x)
+        return (time.perf_counter() - t0) / n_runs * 1000
+    rng = np.random.default_rng(0)
+    results = []
+    for qtype in qtypes:
+        # a few distinct rows repeated, quantizing the whole weight with numpy would take long
+        rows = quantize(rng.standard_normal((512, in_features), dtype=np.float32), qtype)
+        raw = torch.from_numpy(np.concatenate([rows] * -(-out_features // 512))[:out_features])
+        weight = GGMLTensor(raw, qtype, (out_features, in_features))
+        block_size, type_size = GGML_QUANT_SIZES[qtype]
+        int8_layer = Int8Linear.from_ggml(weight)
+        expected = dequantize_functions[qtype](raw.reshape((-1, type_size)), block_size, type_size, torch.float32)
+        exact = torch.equal(int8_layer.dequantize_rows(0, out_features, torch.float32), expected.reshape((out_features, in_features)))
+        float_layer = torch.nn.Linear(in_features, out_features, bias=False)
+        float_layer.weight.data = expected.reshape((out_features, in_features))
+        del expected
+        ggml_layer = GGUFLinear(weight)
+        for n_tokens in tokens:
+            x = torch.randn((n_tokens, in_features))
+            with torch.no_grad():
+                results.append({
+                    "type": qtype.name,
+                    "tokens": n_tokens,
+                    "float_ms": timed(float_layer, x),
+                    "tiled_ms": timed(ggml_layer, x),
+                    "int8_ms": timed(int8_layer, x),
+                    "max_diff": (int8_layer(x) - float_layer(x)).abs().max().item(),
+                    "exact": exact,
+                    "float_mib": out_features * in_features * 4 / 1024**2,
+                    "int8_mib": (int8_layer.values.nbytes + int8_layer.scales.nbytes) / 1024**2,
+                })
+        del float_layer
+    return results
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the int8 linear layer against the float32 and the tiled dequant paths')
+    parser.add_argument('--out-features', type=int, default=14336)
+    parser.add_argument('--in-features', type=int, default=4096)
+    parser.add_argument('--tokens', default='1,16,64', help='comma separated batch sizes')
+    args = parser.parse_args(argv)
+    tokens = [int(n) for n in args.tokens.split(',')]
+    print(f"{'type':<6} {'tokens':>6} {'float ms':>9} {'tiled ms':>9} {'int8 ms':>8} {'max diff':>9} {'weights MiB (float/int8)':>25}")
+    for r in bench_int8(args.out_features, args.in_features, tokens):
+        note = '' if r['exact'] else ' (int8 weight not exact)'
+        print(f"{r['type']:<6} {r['tokens']:>6} {r['float_ms']:>9.1f} {r['tiled_ms']:>9.1f} {r['int8_ms']:>8.1f} {r['max_diff']:>9.2e} {r['float_mib']:>12.1f}/{r['int8_mib']:.1f}{note}")
+    return 0
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import fnmatch, heapq, json, math, os
+from typing import Any, Mapping, Sequence
+import numpy as np
+from .const import GGML_QUANT_SIZES, GGMLQuantizationType, LlamaFileType
+from .quant import quantize, dequantize
+
+# Mixed-precision planning: pick a GGMLQuantizationType for every tensor of a state dict,
+# either from per-pattern rules or by spending a size budget where it lowers the error the most.
+# A plan is a plain {tensor name: type} dict, stored as {tensor name: type name} in json.
+
+QUANTIZATION_THRESHOLD = 1024  # tensors with fewer params are kept in F32
+DEFAULT_SAMPLE_ROWS = 64       # rows used to estimate the round-trip error of each type
+
+# kept in F32 when they are weights (also used by the converters)
+BLACKLIST = (
+    "time_embedding.",
+    "add_embedding.",
+    "time_in.",
+    "txt_in.",
+    "vector_in.",
+    "img_in.",
+    "guidance_in.",
+    "final_layer.",
+)
+
+# candidate types for the budget mode, from small to big
+DEFAULT_CANDIDATES = (
+    GGMLQuantizationType.Q2_K,
+    GGMLQuantizationType.Q3_K,
+    GGMLQuantizationType.Q4_K,
+    GGMLQuantizationType.Q5_K,
+    GGMLQuantizationType.Q6_K,
+    GGMLQuantizationType.Q8_0,
+    GGMLQuantizationType.F16,
+)
+
+def parse_qtype(qtype: GGMLQuantizationType | str) -> GGMLQuantizationType:
+    if isinstance(qtype, GGMLQuantizationType):
+        return qtype
+    try:
+        return GGMLQuantizationType[str(qtype).upper()]
+    except KeyError:
+        raise ValueError(f"Unknown quantization type: {qtype!r}") from None
+
+def bits_per_weight(qtype: GGMLQuantizationType) -> float:
+    block_size, type_size = GGML_QUANT_SIZES[qtype]
+    return type_size * 8 / block_size
+
+def can_quantize(shape: Sequence[int], qtype: GGMLQuantizationType) -> bool:
+    return len(shape) > 0 and shape[-1] % GGML_QUANT_SIZES[qtype][0] == 0
+
+def tensor_nbytes(shape: Sequence[int], qtype: GGMLQuantizationType) -> int:
+    block_size, type_size = GGML_QUANT_SIZES[qtype]
+    shape = tuple(shape) or (1,)  # scalars are one element
+    return math.prod(shape[:-1]) * (shape[-1] // block_size) * type_size
+
+def is_high_precision(key: str, shape: Sequence[int], keys_hiprec: Sequence[str] = ()) -> bool:
+    if len(shape) <= 1 or math.prod(shape) <= QUANTIZATION_THRESHOLD:
+        return True
+    if ".weight" in key and any(x in key for x in BLACKLIST):
+        return True
+    return any(x in key for x in keys_hiprec)
+
+def is_catch_all(pattern: str) -> bool:
+    # a bare wildcard ("*", "**") matches every tensor without naming any
+    return pattern.strip("*") == ""
+
+def tensor_shape(data: Any) -> tuple[int, ...]:
+    # numpy arrays, torch tensors, safetensors slices and GGUF reader tensors (whose shape is in ggml order)
+    if hasattr(data, "tensor_type"):
+        return tuple(reversed(data.shape.tolist()))
+    return tuple(data.get_shape()) if hasattr(data, "get_shape") else tuple(data.shape)
+
+def sample_rows(data: Any, n_rows: int = DEFAULT_SAMPLE_ROWS) -> np.ndarray:
+    shape = tensor_shape(data)
+    n_total = math.prod(shape[:-1])
+    idx = np.unique(np.linspace(0, n_total - 1, num=min(n_rows, n_total)).astype(np.int64))
+    if hasattr(data, "tensor_type"):
+        # GGUF reader tensor, only the sampled rows get read from the memmap and dequantized
+        raw = data.data
+        return dequantize(raw.reshape((-1, raw.shape[-1]))[idx], data.tensor_type).astype(np.float32, copy=False)
+    if hasattr(data, "get_shape"):
+        # safetensors slice, only the sampled rows get read
+        import torch # optional (need torch to work; pip install torch)
+        if len(shape) == 1:
+            rows = data[:].reshape((1, -1))
+        else:
+            rows = torch.cat([data[tuple(slice(int(p), int(p) + 1) for p in np.unravel_index(i, shape[:-1]))].reshape((1, -1)) for i in idx])
+    else:
+        rows = data.reshape((-1, shape[-1]))[idx]
+    if hasattr(rows, "detach"):
+        # torch tensors (possibly bf16 or fp8, which numpy can't hold)
+        import torch # optional (need torch to work; pip install torch)
+        rows = rows.detach().to(device="cpu", dtype=torch.float32).numpy()
+    return np.asarray(rows, dtype=np.float32)
+
+# Relative squared error of the round-trip through qtype, measured on sampled rows.
+# With an imatrix, the error of every column is weighted by its importance.
+def estimate_error(data: Any, qtype: GGMLQuantizationType, n_rows: int = DEFAULT_SAMPLE_ROWS, imatrix: np.ndarray | None = None) -> float:
+    if qtype == GGMLQuantizationType.F32:
+        return 0.0
+    if not can_quantize(tensor_shape(data), qtype):
+        return math.inf
+    rows = sample_rows(data, n_rows)
+    if imatrix is not None:
+        # one importance row for the whole sample
+        imatrix = np.asarray(imatrix, dtype=np.float32).reshape((-1, rows.shape[-1])).mean(axis=0)
+    deq = dequantize(quantize(rows, qtype, imatrix), qtype).astype(np.float32, copy=False)
+    w = imatrix if imatrix is not None else np.float32(1)
+    norm = float((w * rows * rows).sum())
+    err = float((w * (rows - deq) ** 2).sum())
+    return err / norm if norm > 0 else 0.0
+
+def plan_rules(
+    tensors: Mapping[str, Any],
+    rules: Sequence[tuple[str, GGMLQuantizationType | str]],
+    default: GGMLQuantizationType | str = GGMLQuantizationType.F16,
+    keys_hiprec: Sequence[str] = (),
+) -> dict[str, GGMLQuantizationType]:
+    # the first matching (fnmatch) pattern wins; unmatched tensors follow the usual F32 rules, then the default.
+    # The tensors kept in F32 by those rules (biases, norms, ...) are only matched by a pattern naming them,
+    # not by a catch-all like "*"
+    rules = [(pattern, parse_qtype(qtype)) for pattern, qtype in rules]
+    default = parse_qtype(default)
+    plan = {}
+    for name, data in tensors.items():
+        shape = tensor_shape(data)
+        hiprec = is_high_precision(name, shape, keys_hiprec)
+        qtype = next((qtype for pattern, qtype in rules if not (hiprec and is_catch_all(pattern)) and fnmatch.fnmatchcase(name, pattern)), None)
+        if qtype is None:
+            qtype = GGMLQuantizationType.F32 if hiprec else default
+        if not can_quantize(shape, qtype):
+            qtype = GGMLQuantizationType.F16
+        plan[name] = qtype
+    return plan
+
+def plan_budget(
+    tensors: Mapping[str, Any],
+    target_bpw: float | None = None,
+    target_size: int | None = None,
+    candidates: Sequence[GGMLQuantizationType | str] = DEFAULT_CANDIDATES,
+    imatrix: Mapping[str, np.ndarray] | None = None,
+    keys_hiprec: Sequence[str] = (),
+    n_rows: int = DEFAULT_SAMPLE_ROWS,
+) -> dict[str, GGMLQuantizationType]:
+    # Start every tensor at its smallest candidate type, then repeatedly take the upgrade
+    # with the biggest drop of (relative error * params) per added byte until the budget is spent.
+    if (target_bpw is None) == (target_size is None):
+        raise ValueError("Exactly one of target_bpw and target_size must be given")
+    candidates = sorted({parse_qtype(qtype) for qtype in candidates}, key=bits_per_weight)
+
+    plan = {}
+    options: dict[str, list[tuple[int, float, GGMLQuantizationType]]] = {}
+    total_bytes = 0
+    n_weights = 0
+    for name, data in tensors.items():
+        shape = tensor_shape(data)
+        n_weights += math.prod(shape)
+        if is_high_precision(name, shape, keys_hiprec):
+            plan[name] = GGMLQuantizationType.F32
+            total_bytes += tensor_nbytes(shape, plan[name])
+            continue
+        opts = []
+        for qtype in candidates:
+            if not can_quantize(shape, qtype):
+                continue
+            err = estimate_error(data, qtype, n_rows, imatrix.get(name) if imatrix is not None else None)
+            err *= math.prod(shape)
+            # a bigger type is only worth it if it lowers the error
+            if not opts or err < opts[-1][1]:
+                opts.append((tensor_nbytes(shape, qtype), err, qtype))
+        if not opts:
+            opts = [(tensor_nbytes(shape, GGMLQuantizationType.F16), 0.0, GGMLQuantizationType.F16)]
+        options[name] = opts
+        plan[name] = opts[0][2]
+        total_bytes += opts[0][0]
+
+    budget = int(target_size if target_size is not None else target_bpw * n_weights / 8)
+    if total_bytes > budget:
+        raise ValueError(f"Budget of {budget} bytes is below the smallest possible size ({total_bytes} bytes)")
+
+    current = {name: 0 for name in options}
+
+    def best_upgrade(name: str, room: int) -> tuple[float, int] | None:
+        i = current[name]
+        nbytes, err, _ = options[name][i]
+        best = None
+        for j in range(i + 1, len(options[name])):
+            added = options[name][j][0] - nbytes
+            if added > room:
+                break
+            gain = (err - options[name][j][1]) / max(added, 1)
+            if best is None or gain > best[0]:
+                best = (gain, j)
+        return best
+
+    heap = []
+    for name in options:
+        if (upgrade := best_upgrade(name, budget - total_bytes)) is not None:
+            heapq.heappush(heap, (-upgrade[0], name, upgrade[1]))
+    while heap:
+        _, name, j = heapq.heappop(heap)
+        added = options[name][j][0] - options[name][current[name]][0]
+        if added <= budget - total_bytes:
+            current[name] = j
+            total_bytes += added
+        # the room only shrinks, so a new best upgrade has to be searched either way
+        if (upgrade := best_upgrade(name, budget - total_bytes)) is not None:
+            heapq.heappush(heap, (-upgrade[0], name, upgrade[1]))
+
+    for name, i in current.items():
+        plan[name] = options[name][i][2]
+    return plan
+
+def plan_size(tensors: Mapping[str, Any], plan: Mapping[str, GGMLQuantizationType]) -> tuple[int, float]:
+    # returns (bytes, bits per weight) of the tensor data
+    total_bytes = sum(tensor_nbytes(tensor_shape(data), plan[name]) for name, data in tensors.items())
+    n_weights = sum(math.prod(tensor_shape(data)) for data in tensors.values())
+    return total_bytes, (total_bytes * 8 / n_weights if n_weights else 0.0)
+
+def file_type_of(qtype: GGMLQuantizationType) -> LlamaFileType | None:
+    if qtype == GGMLQuantizationType.F32:
+        return LlamaFileType.ALL_F32
+    # the K-quants only have the mixes (e.g. MOSTLY_Q4_K_M)
+    return getattr(LlamaFileType, f"MOSTLY_{qtype.name}", None) or getattr(LlamaFileType, f"MOSTLY_{qtype.name}_M", None)
+
+def plan_file_type(planned: Sequence[tuple[str, Sequence[int], GGMLQuantizationType]]) -> LlamaFileType:
+    # file type of a mixed output, from the type holding most of the weights of [(key, shape, qtype)]
+    n_weights: dict[GGMLQuantizationType, int] = {}
+    for _, shape, qtype in planned:
+        n_weights[qtype] = n_weights.get(qtype, 0) + math.prod(shape)
+    if not n_weights:
+        return LlamaFileType.GUESSED
+    return file_type_of(max(n_weights, key=n_weights.get)) or LlamaFileType.GUESSED
+
+def save_plan(plan: Mapping[str, GGMLQuantizationType], path: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({name: qtype.name for name, qtype in plan.items()}, f, indent=2)
+
+def load_plan(path: str) -> dict[str, GGMLQuantizationType]:
+    with open(path, "r", encoding="utf-8") as f:
+        return {name: parse_qtype(qtype) for name, qtype in json.load(f).items()}
+
+def main(argv: Sequence[str] | None = None) -> int:
+    import argparse
+    from .loader import SafetensorsStateDict
+    parser = argparse.ArgumentParser(description="Plan the quantization type of every tensor of a safetensors model")
+    parser.add_argument("model", help="input .safetensors file")
+    parser.add_argument("-o", "--output", help="output plan (json), defaults to <model>.plan.json which the converters pick up")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--bpw", type=float, help="target average bits per weight")
+    group.add_argument("--size", type=float, help="target size of the tensor data in GiB")
+    group.add_argument("--rule", action="append", metavar="PATTERN=TYPE", help="per-pattern type, first match wins (repeatable)")
+    parser.add_argument("--default", default="F16", help="type of unmatched tensors in rule mode")
+    parser.add_argument("--candidates", default=",".join(qtype.name for qtype in DEFAULT_CANDIDATES), help="comma separated types for the budget mode")
+    parser.add_argument("--imatrix", help="importance matrix (.gguf or .npz)")
+    parser.add_argument("--rows", type=int, default=DEFAULT_SAMPLE_ROWS, help="rows sampled per tensor for the error estimates")
+    args = parser.parse_args(argv)
+
+    # keyed by the names the converters use (prefix stripped, see loader.py), only the sampled rows get read
+    state_dict = SafetensorsStateDict(args.model)
+    tensors = {key: state_dict.get_slice(key) for key in state_dict}
+    if args.rule:
+        rules = [tuple(rule.split("=", 1)) for rule in args.rule]
+        plan = plan_rules(tensors, rules, default=args.default)
+    else:
+        imatrix = None
+        if args.imatrix:
+            from .imatrix import load_imatrix
+            imatrix = load_imatrix(args.imatrix)
+        plan = plan_budget(
+            tensors,
+            target_bpw=args.bpw,
+            target_size=int(args.size * 1024**3) if args.size is not None else None,
+            candidates=args.candidates.split(","),
+            imatrix=imatrix,
+            n_rows=args.rows,
+        )
+    total_bytes, bpw = plan_size(tensors, plan)
+    output = args.output or f"{os.path.splitext(args.model)[0]}.plan.json"
+    save_plan(plan, output)
+    counts: dict[str, int] = {}
+    for qtype in plan.values():
+        counts[qtype.name] = counts.get(qtype.name, 0) + 1
+    print(f"Plan saved to {output}: {total_bytes / 1024**3:.2f} GiB, {bpw:.2f} bpw, " + ", ".join(f"{n} x {name}" for name, n in sorted(counts.items())))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,22 +1,4 @@
-
-import torch # optional (if you want this conversion tool; pip install torch)
-from safetensors.torch import load_file, save_file
-from tqdm import tqdm
-
-def quantize_to_fp8(tensor):
-    if tensor.dtype != torch.bfloat16:
-        raise ValueError("Input tensor must be in BF16 format.")
-    # Ensure tensor is in FP16 before quantization
-    tensor = tensor.to(torch.float16)
-    # FP8 range for E4M3FN (exponent=4 bits, mantissa=3 bits)
-    fp8_max = 240.0  # Max value for FP8 E4M3FN
-    fp8_min = -fp8_max  # Min value for FP8 E4M3FN
-    # Clamp tensor values to the FP8 range
-    clamped_tensor = tensor.clamp(min=fp8_min, max=fp8_max)
-    # Scale tensor to match FP8 precision (simulate quantization)
-    scale = fp8_max / torch.max(torch.abs(clamped_tensor))
-    quantized_tensor = torch.round(clamped_tensor * scale) / scale
-    return quantized_tensor.to(torch.float8_e4m3fn)
+from .fp8 import quantize_safetensors_to_fp8, fp8_output_path, default_device
 
 import os
 safetensors_files = [file for file in os.listdir() if file.endswith('.safetensors')]
@@ -31,16 +13,14 @@ if safetensors_files:
         selected_file=safetensors_files[choice_index]
         print(f"Model file: {selected_file} is selected!")
         input_file = selected_file
-        output_file = f"{os.path.splitext(input_file)[0]}_fp8_e4m3fn.safetensors"
-        data = load_file(input_file)
-        quantized_data = {}
+        ask=input("Quantize to e5m2 instead of e4m3 (Y/n)? ")
+        fmt = 'e5m2' if ask.lower() == 'y' else 'e4m3'
+        ask2=input("Use per-block (128x128) scales instead of per-channel (Y/n)? ")
+        mode = 'block' if ask2.lower() == 'y' else 'channel'
+        output_file = fp8_output_path(input_file, fmt)
         print("Starting quantization process...")
-        for key, tensor in tqdm(data.items(), desc="Quantizing tensors", unit="tensor"):
-            # Move tensor to GPU
-            tensor = tensor.to(dtype=torch.bfloat16, device="cuda")
-            quantized_tensor = quantize_to_fp8(tensor)
-            quantized_data[key] = quantized_tensor.cpu()
-        save_file(quantized_data, output_file)
+        # streamed tensor by tensor on the gpu when there is one, on the cpu otherwise (see fp8.py)
+        quantize_safetensors_to_fp8(input_file, output_file, fmt, mode, device=default_device())
         print(f"Quantized safetensors saved to {output_file}.")
     except (ValueError, IndexError):
         print("Invalid choice. Please enter a valid number.")
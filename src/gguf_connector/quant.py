@@ -2,6 +2,8 @@ from __future__ import annotations
 from abc import ABC, abstractmethod
 from typing import Any, Callable, Sequence
 from math import log2, ceil
+from concurrent.futures import ThreadPoolExecutor
+import os, time
 from numpy.typing import DTypeLike
 import numpy as np
 
@@ -21,7 +23,7 @@ def quant_shape_from_byte_shape(shape: Sequence[int], quant_type: GGMLQuantizati
     return (*shape[:-1], shape[-1] // type_size * block_size)
 
 # This is faster than np.vectorize and np.apply_along_axis because it works on more than one row at a time
-def _apply_over_grouped_rows(func: Callable[[np.ndarray], np.ndarray], arr: np.ndarray, otype: DTypeLike, oshape: tuple[int, ...]) -> np.ndarray:
+def _apply_over_grouped_rows(func: Callable[[np.ndarray], np.ndarray], arr: np.ndarray, otype: DTypeLike, oshape: tuple[int, ...], n_threads: int = 1) -> np.ndarray:
     rows = arr.reshape((-1, arr.shape[-1]))
     osize = 1
     for dim in oshape:
@@ -29,7 +31,19 @@ def _apply_over_grouped_rows(func: Callable[[np.ndarray], np.ndarray], arr: np.n
     out = np.empty(shape=osize, dtype=otype)
     # compute over groups of 16 rows (arbitrary, but seems good for performance)
     n_groups = (rows.shape[0] // 16) or 1
-    np.concatenate([func(group).ravel() for group in np.array_split(rows, n_groups)], axis=0, out=out)
+    if n_threads > 1 and n_groups > 1:
+        # numpy releases the GIL in its vectorized loops, so threads are enough to use more cores
+        out_rows = out.reshape((rows.shape[0], -1))
+        bounds = np.cumsum([0] + [len(group) for group in np.array_split(rows, n_groups)])
+
+        def run(i: int) -> None:
+            start, end = bounds[i], bounds[i + 1]
+            out_rows[start:end] = func(rows[start:end]).reshape((end - start, -1))
+
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            list(executor.map(run, range(n_groups)))
+    else:
+        np.concatenate([func(group).ravel() for group in np.array_split(rows, n_groups)], axis=0, out=out)
     return out.reshape(oshape)
 
 # round away from zero
@@ -40,17 +54,106 @@ def np_roundf(n: np.ndarray) -> np.ndarray:
     b = floored + np.floor(2 * (a - floored))
     return np.sign(n) * b
 
+# Weights of the values for the scale search when an importance matrix is given,
+# same as the quantize_row_*_impl functions in ggml-quants.c
+def _imatrix_weights(blocks: np.ndarray, quant_weights: np.ndarray, sigma2: np.ndarray) -> np.ndarray:
+    return quant_weights.reshape(blocks.shape) * np.sqrt(sigma2 + blocks * blocks)
+
+# Pick the scale of each group of values (along the last axis) for symmetric quants in [-nmax, nmax).
+# A few scales around the one mapping the biggest value to -nmax are tried (like make_qx_quants in ggml-quants.c).
+def _make_qx_quants(x: np.ndarray, weights: np.ndarray, nmax: int, ntry: int = 9) -> np.ndarray:
+    imax = abs(x).argmax(axis=-1, keepdims=True)
+    max = np.take_along_axis(x, imax, axis=-1)
+
+    # fallback for groups where every weight is zero
+    best_score = np.zeros(max.shape, dtype=np.float32)
+    best_scale = max / np.float32(-nmax)
+    for itry in range(-ntry, ntry + 1):
+        with np.errstate(divide="ignore"):
+            iscale = np.where(max == 0, 0, -(nmax + np.float32(0.1) * itry) / max)
+        L = np_roundf(x * iscale).clip(-nmax, nmax - 1)
+        sumlx = (weights * x * L).sum(axis=-1, keepdims=True)
+        suml2 = (weights * L * L).sum(axis=-1, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            score = np.where(suml2 > 0, sumlx * sumlx / suml2, 0)
+            scale = np.where(suml2 > 0, sumlx / suml2, 0)
+        better = score > best_score
+        best_score = np.where(better, score, best_score)
+        best_scale = np.where(better, scale, best_scale)
+
+    return best_scale.astype(np.float32)
+
+# Pick the scale and min of each group of values (along the last axis) for quants in [0, nmax], such that x ~= scale * L - min.
+# Each try solves the weighted least squares for scale and min (like make_qkx2_quants in ggml-quants.c).
+def _make_qkx_quants(x: np.ndarray, weights: np.ndarray, nmax: int, rmin: float = -1, rdelta: float = 0.1, nstep: int = 20) -> tuple[np.ndarray, np.ndarray]:
+    xmin = x.min(axis=-1, keepdims=True).clip(max=0)
+    xmax = x.max(axis=-1, keepdims=True)
+    sum_w = weights.sum(axis=-1, keepdims=True)
+    sum_x = (weights * x).sum(axis=-1, keepdims=True)
+
+    # start from the plain min-max range
+    with np.errstate(divide="ignore"):
+        iscale = np.where(xmax == xmin, 0, nmax / (xmax - xmin))
+    best_scale = np.where(xmax == xmin, 0, (xmax - xmin) / nmax)
+    best_min = xmin
+    L = np_roundf(iscale * (x - xmin)).clip(0, nmax)
+    best_err = (weights * (best_scale * L + best_min - x) ** 2).sum(axis=-1, keepdims=True)
+
+    for step in range(nstep + 1):
+        with np.errstate(divide="ignore"):
+            iscale = np.where(xmax == xmin, 0, (rmin + rdelta * step + nmax) / (xmax - xmin))
+        L = np_roundf(iscale * (x - xmin)).clip(0, nmax)
+        sum_l = (weights * L).sum(axis=-1, keepdims=True)
+        sum_l2 = (weights * L * L).sum(axis=-1, keepdims=True)
+        sum_xl = (weights * L * x).sum(axis=-1, keepdims=True)
+        D = sum_w * sum_l2 - sum_l * sum_l
+        with np.errstate(divide="ignore", invalid="ignore"):
+            this_scale = np.where(D > 0, (sum_w * sum_xl - sum_x * sum_l) / D, 0)
+            this_min = np.where(D > 0, (sum_l2 * sum_x - sum_l * sum_xl) / D, 0)
+            # the min can't be positive, solve for the scale alone in that case
+            this_scale = np.where(this_min > 0, np.where(sum_l2 > 0, sum_xl / sum_l2, 0), this_scale)
+        this_min = this_min.clip(max=0)
+        err = (weights * (this_scale * L + this_min - x) ** 2).sum(axis=-1, keepdims=True)
+        better = (D > 0) & (err < best_err)
+        best_err = np.where(better, err, best_err)
+        best_scale = np.where(better, this_scale, best_scale)
+        best_min = np.where(better, this_min, best_min)
+
+    return best_scale.astype(np.float32), -best_min.astype(np.float32)
+
+# (n_fields, 256) table of the bit fields of every byte value, least significant field first
+def _unpack_table(bits: int) -> np.ndarray:
+    b = np.arange(256, dtype=np.uint8).reshape((1, 256))
+    shifts = (np.arange(8 // bits, dtype=np.uint8) * np.uint8(bits)).reshape((-1, 1))
+    return (b >> shifts) & np.uint8((1 << bits) - 1)
+
+# Gather-based unpacking: out[..., k, w] = scale * lut[k, qs[..., w]],
+# so field k of every byte of a row ends up at [..., k, :] like in the packed types.
+def _lut_dequantize(lut: np.ndarray, qs: np.ndarray, scale: np.ndarray | None = None) -> np.ndarray:
+    out = np.empty((*qs.shape[:-1], lut.shape[0], qs.shape[-1]), dtype=np.float32)
+    out_t = np.moveaxis(out, -2, 0)
+    vals = np.take(lut, qs, axis=1)
+    if scale is None:
+        out_t[...] = vals
+    else:
+        np.multiply(np.moveaxis(np.broadcast_to(scale, out.shape), -2, 0), vals, out=out_t)
+    return out
+
 class QuantError(Exception): ...
 
 _type_traits: dict[GGMLQuantizationType, type[__Quant]] = {}
 
-def quantize(data: np.ndarray, qtype: GGMLQuantizationType) -> np.ndarray:
+# The optional imatrix holds the importance of each column (the mean of the squared activations),
+# either one row for the whole tensor or one row per matrix of a 3D tensor (e.g. the experts of a MoE).
+# With exact=False, the types which have a faster float32 path use it, at the cost of bit-reproducibility.
+# n_threads overrides the worker threads of the type (callers running their own pool pass 1).
+def quantize(data: np.ndarray, qtype: GGMLQuantizationType, imatrix: np.ndarray | None = None, exact: bool = True, n_threads: int | None = None) -> np.ndarray:
     if qtype == GGMLQuantizationType.F32:
         return data.astype(np.float32, copy=False)
     elif qtype == GGMLQuantizationType.F16:
         return data.astype(np.float16, copy=False)
     elif (q := _type_traits.get(qtype)) is not None:
-        return q.quantize(data)
+        return q.quantize(data, imatrix, exact, n_threads)
     else:
         raise NotImplementedError(f"Quantization for {qtype.name} is not yet implemented")
 
@@ -64,6 +167,13 @@ def dequantize(data: np.ndarray, qtype: GGMLQuantizationType) -> np.ndarray:
     else:
         raise NotImplementedError(f"Dequantization for {qtype.name} is not yet implemented")
 
+# whether quantize() can produce qtype; some types only have a dequantizer
+def can_quantize_to(qtype: GGMLQuantizationType) -> bool:
+    if qtype in (GGMLQuantizationType.F32, GGMLQuantizationType.F16):
+        return True
+    q = _type_traits.get(qtype)
+    return q is not None and not getattr(q.quantize_blocks, "__isabstractmethod__", False)
+
 class __Quant(ABC):
     qtype: GGMLQuantizationType
     block_size: int
@@ -73,11 +183,30 @@ class __Quant(ABC):
     grid_shape: tuple[int, int] = (0, 0)
     grid_map: tuple[int | float, ...] = ()
     grid_hex: bytes | None = None
+    # for each point of the full lattice spanned by grid_map, the indices of the nearest grid points
+    grid_neighbours: np.ndarray[Any, np.dtype[np.int32]] | None = None
+    n_neighbours: int = 16
+
+    # worker threads used by quantize(), only worth it for types with an expensive search
+    n_threads: int = 1
+
+    # whether quantize_blocks takes the importance of the values (quant_weights)
+    uses_imatrix: bool = False
+
+    # whether quantize_blocks has a faster float32 mode (exact=False) which can differ from the reference rounding
+    has_fast_path: bool = False
+
+    # whether there is a gather-based dequantize_blocks_lut, using 256-entry unpacking table(s) built on first use by get_lut
+    has_lut_path: bool = False
+    lut: Any = None
+    # whether dequantize_blocks_lut is used instead of dequantize_blocks (measured at import, see _pick_dequantize_paths)
+    use_lut: bool = False
 
     def __init__(self):
         return TypeError("Quant conversion classes can't have instances")
 
-    def __init_subclass__(cls, qtype: GGMLQuantizationType) -> None:
+    # registry is the dict of the types a quantize/dequantize module knows (quant5 adds its own on top of these)
+    def __init_subclass__(cls, qtype: GGMLQuantizationType, registry: dict[GGMLQuantizationType, type[__Quant]] | None = None) -> None:
         cls.qtype = qtype
         cls.block_size, cls.type_size = GGML_QUANT_SIZES[qtype]
         cls.__quantize_lazy = LazyNumpyTensor._wrap_fn(
@@ -88,8 +217,23 @@ class __Quant(ABC):
             cls.__dequantize_array,
             meta_noop=(np.float32, cls.__shape_from_bytes)
         )
-        assert qtype not in _type_traits
-        _type_traits[qtype] = cls
+        registry = _type_traits if registry is None else registry
+        assert qtype not in registry
+        registry[qtype] = cls
+
+    @classmethod
+    def build_lut(cls) -> Any:
+        raise NotImplementedError
+
+    @classmethod
+    def get_lut(cls) -> Any:
+        if cls.lut is None:
+            cls.lut = cls.build_lut()
+        return cls.lut
+
+    @classmethod
+    def dequantize_blocks_lut(cls, blocks: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
 
     @classmethod
     def init_grid(cls):
@@ -112,6 +256,81 @@ class __Quant(ABC):
         grid = np.take_along_axis(grid_map, grid, axis=-1)
         cls.grid = grid.reshape((1, 1, *cls.grid_shape))
 
+    @classmethod
+    def init_grid_neighbours(cls):
+        if cls.grid_neighbours is not None:
+            return
+        cls.init_grid()
+        assert cls.grid is not None
+
+        n_levels = len(cls.grid_map)
+        n_elems = cls.grid_shape[1]
+        levels = np.array(cls.grid_map, dtype=np.float32)
+        grid = cls.grid.reshape(cls.grid_shape)
+
+        # every point of the lattice, with the same element order as the lattice index used in search_grid
+        lattice = np.arange(n_levels ** n_elems, dtype=np.int32).reshape((-1, 1)) // (n_levels ** np.arange(n_elems, dtype=np.int32))
+        lattice = levels[lattice % n_levels]
+
+        neighbours = []
+        # chunked to keep the distance matrix small for the bigger lattices
+        for chunk in np.array_split(lattice, (len(lattice) // 1024) or 1):
+            dist = ((chunk.reshape((-1, 1, n_elems)) - grid.reshape((1, -1, n_elems))) ** 2).sum(axis=-1)
+            nearest = np.argpartition(dist, cls.n_neighbours, axis=-1)[:, :cls.n_neighbours]
+            neighbours.append(nearest.astype(np.int32))
+        cls.grid_neighbours = np.concatenate(neighbours, axis=0)
+
+    # Find the best grid point for each group of (non-negative) values, in units of the inverse scale `id`.
+    # The values are first rounded to the lattice, then only the precomputed neighbours of that lattice point are tried.
+    @classmethod
+    def search_grid(cls, groups: np.ndarray, weights: np.ndarray, id: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        assert cls.grid is not None and cls.grid_neighbours is not None
+        n_levels = len(cls.grid_map)
+        n_elems = cls.grid_shape[1]
+        levels = np.array(cls.grid_map, dtype=np.float32)
+        grid = cls.grid.reshape(cls.grid_shape)
+
+        t = groups * id
+        # nearest lattice level for each element
+        lvl = np.searchsorted((levels[:-1] + levels[1:]) / 2, t, side="right").astype(np.int32)
+        u = (lvl * (n_levels ** np.arange(n_elems, dtype=np.int32))).sum(axis=-1)
+
+        candidates = cls.grid_neighbours[u]
+        err = (weights[..., None, :] * (grid[candidates] - t[..., None, :]) ** 2).sum(axis=-1)
+        best = np.take_along_axis(candidates, err.argmin(axis=-1)[..., None], axis=-1)[..., 0]
+
+        return best, grid[best]
+
+    # Pick one scale per sub-block for the grid types which store the sign of every value separately.
+    # Returns the scales such that blocks ~= scale * grid_value * sign.
+    @classmethod
+    def quantize_signed_grid_scales(cls, blocks: np.ndarray, weights: np.ndarray, sub_block_size: int) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+        n_elems = cls.grid_shape[1]
+        shape = (n_blocks, -1, sub_block_size // n_elems, n_elems)
+
+        groups = abs(blocks).reshape(shape)
+        weights = weights.reshape(shape)
+        amax = groups.max(axis=(-1, -2), keepdims=True)
+
+        best_score = np.full(amax.shape[:2], -1, dtype=np.float32)
+        best_scale = np.zeros(amax.shape[:2], dtype=np.float32)
+        # try a few scales around the one mapping the biggest value to the biggest level
+        for f in np.linspace(0.8, 1.2, 9, dtype=np.float32):
+            with np.errstate(divide="ignore"):
+                id = np.where(amax == 0, 0, f * max(cls.grid_map) / amax)
+            _, q = cls.search_grid(groups, weights, id)
+            sumqx = (weights * q * groups).sum(axis=(-1, -2))
+            sumq2 = (weights * q * q).sum(axis=(-1, -2))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                score = np.where(sumq2 > 0, sumqx * sumqx / sumq2, 0)
+                scale = np.where(sumq2 > 0, sumqx / sumq2, 0)
+            better = score > best_score
+            best_score = np.where(better, score, best_score)
+            best_scale = np.where(better, scale, best_scale)
+
+        return best_scale
+
     @classmethod
     @abstractmethod
     def quantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
@@ -123,12 +342,19 @@ class __Quant(ABC):
         raise NotImplementedError
 
     @classmethod
-    def quantize_rows(cls, rows: np.ndarray) -> np.ndarray:
+    def quantize_rows(cls, rows: np.ndarray, quant_weights: np.ndarray | None = None, exact: bool = True) -> np.ndarray:
         rows = rows.astype(np.float32, copy=False)
         shape = rows.shape
         n_blocks = rows.size // cls.block_size
         blocks = rows.reshape((n_blocks, cls.block_size))
-        blocks = cls.quantize_blocks(blocks)
+        kwargs: dict[str, Any] = {}
+        if quant_weights is not None and cls.uses_imatrix:
+            # the same column importance for every row
+            quant_weights = np.broadcast_to(quant_weights.reshape((1, -1)), (rows.size // shape[-1], shape[-1]))
+            kwargs["quant_weights"] = quant_weights.reshape((n_blocks, cls.block_size))
+        if not exact and cls.has_fast_path:
+            kwargs["exact"] = False
+        blocks = cls.quantize_blocks(blocks, **kwargs)
         assert blocks.dtype == np.uint8
         assert blocks.shape[-1] == cls.type_size
         return blocks.reshape(cls.__shape_to_bytes(shape))
@@ -139,7 +365,10 @@ class __Quant(ABC):
         shape = rows.shape
         n_blocks = rows.size // cls.type_size
         blocks = rows.reshape((n_blocks, cls.type_size))
-        blocks = cls.dequantize_blocks(blocks)
+        if cls.use_lut:
+            blocks = cls.dequantize_blocks_lut(blocks)
+        else:
+            blocks = cls.dequantize_blocks(blocks)
         assert blocks.dtype == np.float32
         assert blocks.shape[-1] == cls.block_size
         return blocks.reshape(cls.__shape_from_bytes(shape))
@@ -153,8 +382,13 @@ class __Quant(ABC):
         return quant_shape_from_byte_shape(shape, cls.qtype)
 
     @classmethod
-    def __quantize_array(cls, array: np.ndarray) -> np.ndarray:
-        return _apply_over_grouped_rows(cls.quantize_rows, arr=array, otype=np.uint8, oshape=cls.__shape_to_bytes(array.shape))
+    def __quantize_array(cls, array: np.ndarray, imatrix: np.ndarray | None = None, exact: bool = True, n_threads: int | None = None) -> np.ndarray:
+        cls.init_grid()
+        if imatrix is not None and imatrix.ndim > 1 and imatrix.shape[0] > 1:
+            # one importance row per matrix
+            return np.stack([cls.__quantize_array(a, w, exact, n_threads) for a, w in zip(array, imatrix)])
+        quant_weights = imatrix.reshape(-1).astype(np.float32, copy=False) if imatrix is not None else None
+        return _apply_over_grouped_rows(lambda rows: cls.quantize_rows(rows, quant_weights, exact), arr=array, otype=np.uint8, oshape=cls.__shape_to_bytes(array.shape), n_threads=cls.n_threads if n_threads is None else n_threads)
 
     @classmethod
     def __dequantize_array(cls, array: np.ndarray) -> np.ndarray:
@@ -162,7 +396,7 @@ class __Quant(ABC):
         return _apply_over_grouped_rows(cls.dequantize_rows, arr=array, otype=np.float32, oshape=cls.__shape_from_bytes(array.shape))
 
     @classmethod
-    def __quantize_lazy(cls, lazy_tensor: LazyNumpyTensor, /) -> Any:
+    def __quantize_lazy(cls, lazy_tensor: LazyNumpyTensor, imatrix: np.ndarray | None = None, exact: bool = True, n_threads: int | None = None, /) -> Any:
         pass
 
     @classmethod
@@ -174,13 +408,17 @@ class __Quant(ABC):
         return tensor.shape[-1] % cls.block_size == 0
 
     @classmethod
-    def quantize(cls, tensor: np.ndarray | LazyNumpyTensor) -> np.ndarray:
+    def quantize(cls, tensor: np.ndarray | LazyNumpyTensor, imatrix: np.ndarray | None = None, exact: bool = True, n_threads: int | None = None) -> np.ndarray:
         if not cls.can_quantize(tensor):
             raise QuantError(f"Can't quantize tensor with shape {tensor.shape} to {cls.qtype.name}")
+        if imatrix is not None:
+            imatrix = np.asarray(imatrix, dtype=np.float32)
+            if imatrix.shape[-1] != tensor.shape[-1] or (imatrix.ndim > 1 and imatrix.shape[0] > 1 and (len(tensor.shape) != 3 or imatrix.shape[0] != tensor.shape[0])):
+                raise QuantError(f"Can't use imatrix with shape {imatrix.shape} for tensor with shape {tensor.shape}")
         if isinstance(tensor, LazyNumpyTensor):
-            return cls.__quantize_lazy(tensor)
+            return cls.__quantize_lazy(tensor, imatrix, exact, n_threads)
         else:
-            return cls.__quantize_array(tensor)
+            return cls.__quantize_array(tensor, imatrix, exact, n_threads)
 
     @classmethod
     def dequantize(cls, tensor: np.ndarray | LazyNumpyTensor) -> np.ndarray:
@@ -205,8 +443,11 @@ class BF16(__Quant, qtype=GGMLQuantizationType.BF16):
         return (blocks.view(np.int16).astype(np.int32) << 16).view(np.float32)
 
 class Q4_0(__Quant, qtype=GGMLQuantizationType.Q4_0):
+    has_fast_path = True
+    has_lut_path = True
+
     @classmethod
-    def quantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
+    def quantize_blocks(cls, blocks: np.ndarray, exact: bool = True) -> np.ndarray:
         n_blocks = blocks.shape[0]
 
         imax = abs(blocks).argmax(axis=-1, keepdims=True)
@@ -215,8 +456,15 @@ class Q4_0(__Quant, qtype=GGMLQuantizationType.Q4_0):
         d = max / -8
         with np.errstate(divide="ignore"):
             id = np.where(d == 0, 0, 1 / d)
-        # FIXME: Q4_0's reference rounding is cursed and depends on FMA
-        qs = np.trunc((np.float64(blocks) * np.float64(id)) + np.float64(8.5), dtype=np.float32).astype(np.uint8).clip(0, 15)
+        if exact:
+            # FIXME: Q4_0's reference rounding is cursed and depends on FMA
+            qs = np.trunc((np.float64(blocks) * np.float64(id)) + np.float64(8.5), dtype=np.float32).astype(np.uint8).clip(0, 15)
+        else:
+            # float32 all the way; differs from the reference when the product rounds across an integer boundary
+            qs = blocks * id
+            qs += np.float32(8.5)
+            # always positive here, so the cast truncates like np.trunc
+            qs = np.minimum(qs.astype(np.uint8), np.uint8(15))
 
         qs = qs.reshape((n_blocks, 2, cls.block_size // 2))
         qs = qs[..., 0, :] | (qs[..., 1, :] << np.uint8(4))
@@ -238,7 +486,23 @@ class Q4_0(__Quant, qtype=GGMLQuantizationType.Q4_0):
 
         return (d * qs.astype(np.float32))
 
+    @classmethod
+    def build_lut(cls) -> np.ndarray:
+        return _unpack_table(4).astype(np.float32) - np.float32(8)
+
+    @classmethod
+    def dequantize_blocks_lut(cls, blocks: np.ndarray) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        d, qs = np.hsplit(blocks, [2])
+
+        d = d.view(np.float16).astype(np.float32)
+
+        return _lut_dequantize(cls.get_lut(), qs, d.reshape((n_blocks, 1, 1))).reshape((n_blocks, -1))
+
 class Q4_1(__Quant, qtype=GGMLQuantizationType.Q4_1):
+    has_lut_path = True
+
     @classmethod
     def quantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -274,9 +538,31 @@ class Q4_1(__Quant, qtype=GGMLQuantizationType.Q4_1):
 
         return (d * qs) + m
 
+    @classmethod
+    def build_lut(cls) -> np.ndarray:
+        return _unpack_table(4).astype(np.float32)
+
+    @classmethod
+    def dequantize_blocks_lut(cls, blocks: np.ndarray) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        d, rest = np.hsplit(blocks, [2])
+        m, qs = np.hsplit(rest, [2])
+
+        d = d.view(np.float16).astype(np.float32)
+        m = m.view(np.float16).astype(np.float32)
+
+        qs = _lut_dequantize(cls.get_lut(), qs, d.reshape((n_blocks, 1, 1)))
+        qs += m.reshape((n_blocks, 1, 1))
+
+        return qs.reshape((n_blocks, -1))
+
 class Q5_0(__Quant, qtype=GGMLQuantizationType.Q5_0):
+    has_fast_path = True
+    has_lut_path = True
+
     @classmethod
-    def quantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
+    def quantize_blocks(cls, blocks: np.ndarray, exact: bool = True) -> np.ndarray:
         n_blocks = blocks.shape[0]
 
         imax = abs(blocks).argmax(axis=-1, keepdims=True)
@@ -285,8 +571,14 @@ class Q5_0(__Quant, qtype=GGMLQuantizationType.Q5_0):
         d = max / -16
         with np.errstate(divide="ignore"):
             id = np.where(d == 0, 0, 1 / d)
-        # FIXME: Q5_0's reference rounding is cursed and depends on FMA
-        q = np.trunc((np.float64(blocks) * np.float64(id)) + np.float64(16.5), dtype=np.float32).astype(np.uint8).clip(0, 31)
+        if exact:
+            # FIXME: Q5_0's reference rounding is cursed and depends on FMA
+            q = np.trunc((np.float64(blocks) * np.float64(id)) + np.float64(16.5), dtype=np.float32).astype(np.uint8).clip(0, 31)
+        else:
+            # float32 all the way, see Q4_0
+            q = blocks * id
+            q += np.float32(16.5)
+            q = np.minimum(q.astype(np.uint8), np.uint8(31))
 
         qs = q.reshape((n_blocks, 2, cls.block_size // 2))
         qs = (qs[..., 0, :] & np.uint8(0x0F)) | (qs[..., 1, :] << np.uint8(4))
@@ -316,7 +608,30 @@ class Q5_0(__Quant, qtype=GGMLQuantizationType.Q5_0):
 
         return (d * qs.astype(np.float32))
 
+    @classmethod
+    def build_lut(cls) -> tuple[np.ndarray, np.ndarray]:
+        # (low nibbles, high bits already shifted to 16), the bits are indexed by byte
+        return _unpack_table(4).astype(np.float32), _unpack_table(1).T.astype(np.float32) * np.float32(16)
+
+    @classmethod
+    def dequantize_blocks_lut(cls, blocks: np.ndarray) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+        ql_lut, qh_lut = cls.get_lut()
+
+        d, rest = np.hsplit(blocks, [2])
+        qh, qs = np.hsplit(rest, [4])
+
+        d = d.view(np.float16).astype(np.float32)
+
+        q = _lut_dequantize(ql_lut, qs).reshape((n_blocks, -1))
+        q += qh_lut[qh].reshape((n_blocks, -1))
+        q -= np.float32(16)
+
+        return (d * q)
+
 class Q5_1(__Quant, qtype=GGMLQuantizationType.Q5_1):
+    has_lut_path = True
+
     @classmethod
     def quantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -360,6 +675,27 @@ class Q5_1(__Quant, qtype=GGMLQuantizationType.Q5_1):
 
         return (d * qs) + m
 
+    @classmethod
+    def build_lut(cls) -> tuple[np.ndarray, np.ndarray]:
+        return Q5_0.get_lut()
+
+    @classmethod
+    def dequantize_blocks_lut(cls, blocks: np.ndarray) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+        ql_lut, qh_lut = cls.get_lut()
+
+        d, rest = np.hsplit(blocks, [2])
+        m, rest = np.hsplit(rest, [2])
+        qh, qs = np.hsplit(rest, [4])
+
+        d = d.view(np.float16).astype(np.float32)
+        m = m.view(np.float16).astype(np.float32)
+
+        q = _lut_dequantize(ql_lut, qs).reshape((n_blocks, -1))
+        q += qh_lut[qh].reshape((n_blocks, -1))
+
+        return (d * q) + m
+
 class Q8_0(__Quant, qtype=GGMLQuantizationType.Q8_0):
     @classmethod
     # Implementation of Q8_0 with bit-exact same results as reference implementation in ggml-quants.c
@@ -386,6 +722,43 @@ class Q8_0(__Quant, qtype=GGMLQuantizationType.Q8_0):
         return (x * d)
 
 class Q2_K(__Quant, qtype=GGMLQuantizationType.Q2_K):
+    uses_imatrix = True
+
+    @classmethod
+    def quantize_blocks(cls, blocks: np.ndarray, quant_weights: np.ndarray | None = None) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        blocks = blocks.reshape((n_blocks, QK_K // 16, 16))
+        if quant_weights is None:
+            weights = abs(blocks)
+        else:
+            sigma2 = (blocks * blocks).mean(axis=(-1, -2), keepdims=True)
+            weights = _imatrix_weights(blocks, quant_weights, sigma2)
+
+        # (n_blocks, 16, 1)
+        scale, mn = _make_qkx_quants(blocks, weights, 3, rmin=-0.5, rdelta=0.1, nstep=15)
+
+        # the scales and mins are stored with 4 bits each
+        d = (scale.max(axis=-2) / 15).astype(np.float16)
+        dmin = (mn.max(axis=-2) / 15).astype(np.float16)
+        df = d.astype(np.float32).reshape((n_blocks, 1, 1))
+        dminf = dmin.astype(np.float32).reshape((n_blocks, 1, 1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ls = np.where(df == 0, 0, np_roundf(scale / df)).clip(0, 15).astype(np.uint8)
+            lm = np.where(dminf == 0, 0, np_roundf(mn / dminf)).clip(0, 15).astype(np.uint8)
+
+        dl = df * ls
+        ml = dminf * lm
+        with np.errstate(divide="ignore", invalid="ignore"):
+            L = np.where(dl == 0, 0, np_roundf((blocks + ml) / dl)).clip(0, 3).astype(np.uint8)
+
+        qs = L.reshape((n_blocks, 2, 4, 32)) << np.array([0, 2, 4, 6], dtype=np.uint8).reshape((1, 1, 4, 1))
+        qs = np.bitwise_or.reduce(qs, axis=-2).reshape((n_blocks, QK_K // 4))
+
+        scales = (ls | (lm << np.uint8(4))).reshape((n_blocks, QK_K // 16))
+
+        return np.concatenate([scales, qs, d.view(np.uint8), dmin.view(np.uint8)], axis=-1)
+
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -412,6 +785,48 @@ class Q2_K(__Quant, qtype=GGMLQuantizationType.Q2_K):
         return qs.reshape((n_blocks, -1))
 
 class Q3_K(__Quant, qtype=GGMLQuantizationType.Q3_K):
+    uses_imatrix = True
+
+    @classmethod
+    def quantize_blocks(cls, blocks: np.ndarray, quant_weights: np.ndarray | None = None) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        blocks = blocks.reshape((n_blocks, QK_K // 16, 16))
+        if quant_weights is None:
+            weights = blocks * blocks
+        else:
+            sigma2 = 2 * (blocks * blocks).mean(axis=(-1, -2), keepdims=True)
+            weights = _imatrix_weights(blocks, quant_weights, sigma2)
+
+        # (n_blocks, 16, 1)
+        scale = _make_qx_quants(blocks, weights, 4)
+
+        # the scales are stored as signed 6-bit values, the biggest one maps to -32
+        imax = abs(scale).argmax(axis=-2, keepdims=True)
+        max_scale = np.take_along_axis(scale, imax, axis=-2)
+        d = (max_scale / -32).reshape((n_blocks, 1)).astype(np.float16)
+        df = d.astype(np.float32).reshape((n_blocks, 1, 1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ls = np.where(df == 0, 0, np_roundf(scale / df)).clip(-32, 31)
+
+        dl = df * ls
+        with np.errstate(divide="ignore", invalid="ignore"):
+            L = np.where(dl == 0, 0, np_roundf(blocks / dl)).clip(-4, 3)
+        L = (L + 4).astype(np.uint8)
+
+        hmask = (L >> np.uint8(2)).reshape((n_blocks, 8, 32)) << np.array([i for i in range(8)], dtype=np.uint8).reshape((1, 8, 1))
+        hmask = np.bitwise_or.reduce(hmask, axis=-2)
+        qs = (L & np.uint8(3)).reshape((n_blocks, 2, 4, 32)) << np.array([0, 2, 4, 6], dtype=np.uint8).reshape((1, 1, 4, 1))
+        qs = np.bitwise_or.reduce(qs, axis=-2).reshape((n_blocks, QK_K // 4))
+
+        # packed in the pattern described in dequantize_blocks
+        ls = (ls.astype(np.int8) + np.int8(32)).astype(np.uint8).reshape((n_blocks, 16))
+        lscales = (ls[:, :8] & np.uint8(0x0F)) | ((ls[:, 8:] & np.uint8(0x0F)) << np.uint8(4))
+        hscales = ((ls >> np.uint8(4)) & np.uint8(0x03)).reshape((n_blocks, 4, 4)) << np.array([0, 2, 4, 6], dtype=np.uint8).reshape((1, 4, 1))
+        hscales = np.bitwise_or.reduce(hscales, axis=-2)
+
+        return np.concatenate([hmask, qs, lscales, hscales, d.view(np.uint8)], axis=-1)
+
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -456,6 +871,8 @@ class Q3_K(__Quant, qtype=GGMLQuantizationType.Q3_K):
 
 class Q4_K(__Quant, qtype=GGMLQuantizationType.Q4_K):
     K_SCALE_SIZE = 12
+    uses_imatrix = True
+    has_lut_path = True
 
     @staticmethod
     def get_scale_min(scales: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
@@ -482,6 +899,57 @@ class Q4_K(__Quant, qtype=GGMLQuantizationType.Q4_K):
 
         return (sc.reshape((n_blocks, 8)), min.reshape((n_blocks, 8)))
 
+    # inverse of get_scale_min
+    @staticmethod
+    def pack_scale_min(sc: np.ndarray, min: np.ndarray) -> np.ndarray:
+        d = sc[:, :4] | ((sc[:, 4:] >> np.uint8(4)) << np.uint8(6))
+        m = min[:, :4] | ((min[:, 4:] >> np.uint8(4)) << np.uint8(6))
+        m_d = (sc[:, 4:] & np.uint8(0x0F)) | ((min[:, 4:] & np.uint8(0x0F)) << np.uint8(4))
+
+        return np.concatenate([d, m, m_d], axis=-1)
+
+    # Scales and mins of the sub-blocks of 32 values, stored with 6 bits each.
+    # Returns (d, dmin, sc, min, L) where the values are ~= d * sc * L - dmin * min.
+    @staticmethod
+    def quantize_scale_min(blocks: np.ndarray, quant_weights: np.ndarray | None, nmax: int) -> tuple[np.ndarray, ...]:
+        n_blocks = blocks.shape[0]
+
+        blocks = blocks.reshape((n_blocks, QK_K // 32, 32))
+        sigma2 = 2 * (blocks * blocks).mean(axis=(-1, -2), keepdims=True)
+        if quant_weights is None:
+            weights = np.sqrt(sigma2) + abs(blocks)
+        else:
+            weights = _imatrix_weights(blocks, quant_weights, sigma2)
+
+        # (n_blocks, 8, 1)
+        scale, mn = _make_qkx_quants(blocks, weights, nmax)
+
+        d = (scale.max(axis=-2) / 63).astype(np.float16)
+        dmin = (mn.max(axis=-2) / 63).astype(np.float16)
+        df = d.astype(np.float32).reshape((n_blocks, 1, 1))
+        dminf = dmin.astype(np.float32).reshape((n_blocks, 1, 1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sc = np.where(df == 0, 0, np_roundf(scale / df)).clip(0, 63).astype(np.uint8)
+            min = np.where(dminf == 0, 0, np_roundf(mn / dminf)).clip(0, 63).astype(np.uint8)
+
+        dl = df * sc
+        ml = dminf * min
+        with np.errstate(divide="ignore", invalid="ignore"):
+            L = np.where(dl == 0, 0, np_roundf((blocks + ml) / dl)).clip(0, nmax).astype(np.uint8)
+
+        return d, dmin, sc.reshape((n_blocks, -1)), min.reshape((n_blocks, -1)), L
+
+    @classmethod
+    def quantize_blocks(cls, blocks: np.ndarray, quant_weights: np.ndarray | None = None) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        d, dmin, sc, min, L = Q4_K.quantize_scale_min(blocks, quant_weights, 15)
+
+        qs = L.reshape((n_blocks, -1, 2, 32))
+        qs = (qs[..., 0, :] | (qs[..., 1, :] << np.uint8(4))).reshape((n_blocks, QK_K // 2))
+
+        return np.concatenate([d.view(np.uint8), dmin.view(np.uint8), Q4_K.pack_scale_min(sc, min), qs], axis=-1)
+
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -503,7 +971,47 @@ class Q4_K(__Quant, qtype=GGMLQuantizationType.Q4_K):
 
         return (d * qs - dm).reshape((n_blocks, QK_K))
 
+    @classmethod
+    def build_lut(cls) -> np.ndarray:
+        return _unpack_table(4).astype(np.float32)
+
+    @classmethod
+    def dequantize_blocks_lut(cls, blocks: np.ndarray) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        d, rest = np.hsplit(blocks, [2])
+        dmin, rest = np.hsplit(rest, [2])
+        scales, qs = np.hsplit(rest, [cls.K_SCALE_SIZE])
+
+        d = d.view(np.float16).astype(np.float32)
+        dmin = dmin.view(np.float16).astype(np.float32)
+
+        sc, m = Q4_K.get_scale_min(scales)
+
+        d = (d * sc.astype(np.float32)).reshape((n_blocks, -1, 2, 1))
+        dm = (dmin * m.astype(np.float32)).reshape((n_blocks, -1, 2, 1))
+
+        qs = _lut_dequantize(cls.get_lut(), qs.reshape((n_blocks, -1, 32)), d)
+        qs -= dm
+
+        return qs.reshape((n_blocks, QK_K))
+
 class Q5_K(__Quant, qtype=GGMLQuantizationType.Q5_K):
+    uses_imatrix = True
+
+    @classmethod
+    def quantize_blocks(cls, blocks: np.ndarray, quant_weights: np.ndarray | None = None) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        d, dmin, sc, min, L = Q4_K.quantize_scale_min(blocks, quant_weights, 31)
+
+        qh = (L >> np.uint8(4)).reshape((n_blocks, 8, 32)) << np.array([i for i in range(8)], dtype=np.uint8).reshape((1, 8, 1))
+        qh = np.bitwise_or.reduce(qh, axis=-2)
+        qs = (L & np.uint8(0x0F)).reshape((n_blocks, -1, 2, 32))
+        qs = (qs[..., 0, :] | (qs[..., 1, :] << np.uint8(4))).reshape((n_blocks, QK_K // 2))
+
+        return np.concatenate([d.view(np.uint8), dmin.view(np.uint8), Q4_K.pack_scale_min(sc, min), qh, qs], axis=-1)
+
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -530,6 +1038,44 @@ class Q5_K(__Quant, qtype=GGMLQuantizationType.Q5_K):
         return (d * q - dm).reshape((n_blocks, QK_K))
 
 class Q6_K(__Quant, qtype=GGMLQuantizationType.Q6_K):
+    uses_imatrix = True
+
+    @classmethod
+    def quantize_blocks(cls, blocks: np.ndarray, quant_weights: np.ndarray | None = None) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        blocks = blocks.reshape((n_blocks, QK_K // 16, 16))
+        if quant_weights is None:
+            weights = blocks * blocks
+        else:
+            sigma2 = (blocks * blocks).mean(axis=(-1, -2), keepdims=True)
+            weights = _imatrix_weights(blocks, quant_weights, sigma2)
+
+        # (n_blocks, 16, 1)
+        scale = _make_qx_quants(blocks, weights, 32)
+
+        # the scales are stored as int8, the biggest one maps to -128
+        imax = abs(scale).argmax(axis=-2, keepdims=True)
+        max_scale = np.take_along_axis(scale, imax, axis=-2)
+        d = (max_scale / -128).reshape((n_blocks, 1)).astype(np.float16)
+        df = d.astype(np.float32).reshape((n_blocks, 1, 1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ls = np.where(df == 0, 0, np_roundf(scale / df)).clip(-128, 127)
+
+        dl = df * ls
+        with np.errstate(divide="ignore", invalid="ignore"):
+            L = np.where(dl == 0, 0, np_roundf(blocks / dl)).clip(-32, 31)
+        L = (L + 32).astype(np.uint8).reshape((n_blocks, 2, 128))
+
+        ql = (L & np.uint8(0x0F)).reshape((n_blocks, 2, 2, 64))
+        ql = (ql[..., 0, :] | (ql[..., 1, :] << np.uint8(4))).reshape((n_blocks, QK_K // 2))
+        qh = (L >> np.uint8(4)).reshape((n_blocks, 2, 4, 32)) << np.array([0, 2, 4, 6], dtype=np.uint8).reshape((1, 1, 4, 1))
+        qh = np.bitwise_or.reduce(qh, axis=-2).reshape((n_blocks, QK_K // 4))
+
+        scales = ls.astype(np.int8).reshape((n_blocks, QK_K // 16)).view(np.uint8)
+
+        return np.concatenate([ql, qh, scales, d.view(np.uint8)], axis=-1)
+
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -552,6 +1098,8 @@ class Q6_K(__Quant, qtype=GGMLQuantizationType.Q6_K):
         return (d * q).reshape((n_blocks, QK_K))
 
 class TQ1_0(__Quant, qtype=GGMLQuantizationType.TQ1_0):
+    has_lut_path = True
+
     @classmethod
     def quantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -598,7 +1146,31 @@ class TQ1_0(__Quant, qtype=GGMLQuantizationType.TQ1_0):
 
         return (d * qs.astype(np.float32))
 
+    @classmethod
+    def build_lut(cls) -> np.ndarray:
+        # the 5 base-3 digits of every byte, same as in dequantize_blocks
+        b = np.arange(256, dtype=np.uint8).reshape((1, 256)) * np.array([1, 3, 9, 27, 81], dtype=np.uint8).reshape((-1, 1))
+        return (((b.astype(np.uint16) * 3) >> 8).astype(np.int8) - np.int8(1)).astype(np.float32)
+
+    @classmethod
+    def dequantize_blocks_lut(cls, blocks: np.ndarray) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+        lut = cls.get_lut()
+
+        qs, rest = np.hsplit(blocks, [(QK_K - 4 * QK_K // 64) // 5])
+        qh, d = np.hsplit(rest, [QK_K // 64])
+
+        d = d.view(np.float16).astype(np.float32).reshape((n_blocks, 1, 1))
+
+        qs0 = _lut_dequantize(lut, qs[..., :32], d).reshape((n_blocks, -1))
+        qs1 = _lut_dequantize(lut, qs[..., 32:], d).reshape((n_blocks, -1))
+        qh = _lut_dequantize(lut[:4], qh, d).reshape((n_blocks, -1))
+
+        return np.concatenate([qs0, qs1, qh], axis=-1)
+
 class TQ2_0(__Quant, qtype=GGMLQuantizationType.TQ2_0):
+    has_lut_path = True
+
     @classmethod
     def quantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -630,6 +1202,20 @@ class TQ2_0(__Quant, qtype=GGMLQuantizationType.TQ2_0):
 
         return (d * qs.astype(np.float32))
 
+    @classmethod
+    def build_lut(cls) -> np.ndarray:
+        return _unpack_table(2).astype(np.float32) - np.float32(1)
+
+    @classmethod
+    def dequantize_blocks_lut(cls, blocks: np.ndarray) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        qs, d = np.hsplit(blocks, [QK_K // 4])
+
+        d = d.view(np.float16).astype(np.float32)
+
+        return _lut_dequantize(cls.get_lut(), qs.reshape((n_blocks, -1, 32)), d.reshape((n_blocks, 1, 1, 1))).reshape((n_blocks, -1))
+
 class IQ2_XXS(__Quant, qtype=GGMLQuantizationType.IQ2_XXS):
     ksigns: bytes = (
         b"\x00\x81\x82\x03\x84\x05\x06\x87\x88\x09\x0a\x8b\x0c\x8d\x8e\x0f"
@@ -866,6 +1452,48 @@ class IQ2_S(__Quant, qtype=GGMLQuantizationType.IQ2_S):
 
         return (db * grid * signs).reshape((n_blocks, -1))
 
+    n_threads = os.cpu_count() or 1
+    uses_imatrix = True
+
+    @classmethod
+    def quantize_blocks(cls, blocks: np.ndarray, quant_weights: np.ndarray | None = None) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+        cls.init_grid_neighbours()
+
+        if quant_weights is None:
+            weights = blocks * blocks
+        else:
+            sigma2 = 2 * (blocks * blocks).mean(axis=-1, keepdims=True)
+            weights = _imatrix_weights(blocks, quant_weights, sigma2)
+
+        # (n_blocks, 16), one scale for each 16 values
+        scales = cls.quantize_signed_grid_scales(blocks, weights, 16)
+
+        # the stored scale is d * (0.5 + sc) * 0.25, with a 4-bit sc
+        d = (scales.max(axis=-1, keepdims=True) / np.float32(15.5 * 0.25)).astype(np.float16)
+        df = d.astype(np.float32)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sc = np.where(df == 0, 0, np_roundf(scales / (df * np.float32(0.25)) - np.float32(0.5)))
+        sc = sc.clip(0, 15).astype(np.uint8)
+
+        db = (df * (np.float32(0.5) + sc) * np.float32(0.25)).reshape((n_blocks, -1, 1, 1))
+        with np.errstate(divide="ignore"):
+            id = np.where(db == 0, 0, 1 / db)
+        groups = abs(blocks).reshape((n_blocks, -1, 2, 8))
+        qs, _ = cls.search_grid(groups, weights.reshape(groups.shape), id)
+        qs = qs.reshape((n_blocks, -1))
+
+        qh = ((qs >> 8) & 0x03).astype(np.uint8).reshape((n_blocks, -1, 4)) << np.array([0, 2, 4, 6], dtype=np.uint8).reshape((1, 1, 4))
+        qh = qh[..., 0] | qh[..., 1] | qh[..., 2] | qh[..., 3]
+        qs = (qs & 0xFF).astype(np.uint8)
+
+        signs = np.packbits((blocks < 0).reshape((n_blocks, -1, 8)), axis=-1, bitorder="little").reshape((n_blocks, -1))
+
+        sc = sc.reshape((n_blocks, -1, 2))
+        sc = sc[..., 0] | (sc[..., 1] << np.uint8(4))
+
+        return np.concatenate([d.view(np.uint8), qs, signs, qh, sc], axis=-1)
+
 class IQ3_XXS(__Quant, qtype=GGMLQuantizationType.IQ3_XXS):
     grid_shape = (256, 4)
     grid_map = (0x04, 0x0c, 0x14, 0x1c, 0x24, 0x2c, 0x34, 0x3e)
@@ -987,6 +1615,47 @@ class IQ3_S(__Quant, qtype=GGMLQuantizationType.IQ3_S):
 
         return (db * grid * signs).reshape((n_blocks, -1))
 
+    n_threads = os.cpu_count() or 1
+    uses_imatrix = True
+
+    @classmethod
+    def quantize_blocks(cls, blocks: np.ndarray, quant_weights: np.ndarray | None = None) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+        cls.init_grid_neighbours()
+
+        if quant_weights is None:
+            weights = blocks * blocks
+        else:
+            sigma2 = 2 * (blocks * blocks).mean(axis=-1, keepdims=True)
+            weights = _imatrix_weights(blocks, quant_weights, sigma2)
+
+        # (n_blocks, 8), one scale for each 32 values
+        scales = cls.quantize_signed_grid_scales(blocks, weights, 32)
+
+        # the stored scale is d * (1 + 2 * sc), with a 4-bit sc
+        d = (scales.max(axis=-1, keepdims=True) / np.float32(31)).astype(np.float16)
+        df = d.astype(np.float32)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sc = np.where(df == 0, 0, np_roundf((scales / df - 1) / 2))
+        sc = sc.clip(0, 15).astype(np.uint8)
+
+        db = (df * (1 + 2 * sc.astype(np.float32))).reshape((n_blocks, -1, 1, 1))
+        with np.errstate(divide="ignore"):
+            id = np.where(db == 0, 0, 1 / db)
+        groups = abs(blocks).reshape((n_blocks, -1, 8, 4))
+        qs, _ = cls.search_grid(groups, weights.reshape(groups.shape), id)
+        qs = qs.reshape((n_blocks, -1))
+
+        qh = np.packbits(((qs >> 8) & 0x01).astype(np.uint8).reshape((n_blocks, -1, 8)), axis=-1, bitorder="little").reshape((n_blocks, -1))
+        qs = (qs & 0xFF).astype(np.uint8)
+
+        signs = np.packbits((blocks < 0).reshape((n_blocks, -1, 8)), axis=-1, bitorder="little").reshape((n_blocks, -1))
+
+        sc = sc.reshape((n_blocks, -1, 2))
+        sc = sc[..., 0] | (sc[..., 1] << np.uint8(4))
+
+        return np.concatenate([d.view(np.uint8), qs, qh, signs, sc], axis=-1)
+
 class IQ1_S(__Quant, qtype=GGMLQuantizationType.IQ1_S):
     # iq1s_grid, with each byte packed into 2 bits
     # -1, 0, 1 <=> 0, 1, 2
@@ -1189,6 +1858,62 @@ class IQ1_M(__Quant, qtype=GGMLQuantizationType.IQ1_M):
 
 class IQ4_NL(__Quant, qtype=GGMLQuantizationType.IQ4_NL):
     kvalues = (-127, -104, -83, -65, -49, -35, -22, -10, 1, 13, 25, 38, 53, 69, 89, 113)
+    has_lut_path = True
+
+    # index of the nearest kvalue, ties going up (same as best_index_int8 in ggml-quants.c)
+    @classmethod
+    def best_index(cls, x: np.ndarray) -> np.ndarray:
+        kvalues = np.array(cls.kvalues, dtype=np.float32)
+        return np.searchsorted((kvalues[:-1] + kvalues[1:]) / 2, x, side="right").astype(np.uint8)
+
+    # Search the scale of each group of 32 values, like quantize_row_iq4_nl_impl in ggml-quants.c
+    @classmethod
+    def quantize_scales(cls, blocks: np.ndarray, weights: np.ndarray, ntry: int = 7) -> np.ndarray:
+        kvalues = np.array(cls.kvalues, dtype=np.float32)
+
+        imax = abs(blocks).argmax(axis=-1, keepdims=True)
+        max = np.take_along_axis(blocks, imax, axis=-1)
+
+        best_score = np.full(max.shape, -1, dtype=np.float32)
+        best_scale = np.zeros(max.shape, dtype=np.float32)
+        for itry in range(-ntry - 1, ntry + 1):
+            with np.errstate(divide="ignore"):
+                # the first try is the scale mapping the biggest value to the first kvalue
+                id = np.where(max == 0, 0, (kvalues[0] + (0 if itry == -ntry - 1 else itry)) / max)
+            q = kvalues[cls.best_index(blocks * id)]
+            sumqx = (weights * q * blocks).sum(axis=-1, keepdims=True)
+            sumq2 = (weights * q * q).sum(axis=-1, keepdims=True)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                score = np.where(sumq2 > 0, sumqx * sumqx / sumq2, 0)
+                scale = np.where(sumq2 > 0, sumqx / sumq2, 0)
+            better = score > best_score
+            best_score = np.where(better, score, best_score)
+            best_scale = np.where(better, scale, best_scale)
+
+        return best_scale
+
+    uses_imatrix = True
+
+    @classmethod
+    def quantize_blocks(cls, blocks: np.ndarray, quant_weights: np.ndarray | None = None) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        if quant_weights is None:
+            weights = blocks * blocks
+        else:
+            sigma2 = 2 * (blocks * blocks).mean(axis=-1, keepdims=True)
+            weights = _imatrix_weights(blocks, quant_weights, sigma2)
+
+        d = cls.quantize_scales(blocks, weights).astype(np.float16)
+
+        with np.errstate(divide="ignore"):
+            id = np.where(d == 0, 0, 1 / d.astype(np.float32))
+        qs = cls.best_index(blocks * id)
+
+        qs = qs.reshape((n_blocks, 2, cls.block_size // 2))
+        qs = qs[..., 0, :] | (qs[..., 1, :] << np.uint8(4))
+
+        return np.concatenate([d.view(np.uint8), qs], axis=-1)
 
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
@@ -1207,7 +1932,24 @@ class IQ4_NL(__Quant, qtype=GGMLQuantizationType.IQ4_NL):
 
         return (d * qs)
 
+    # the kvalues of both nibbles of every byte
+    @classmethod
+    def build_lut(cls) -> np.ndarray:
+        return np.array(cls.kvalues, dtype=np.float32)[_unpack_table(4)]
+
+    @classmethod
+    def dequantize_blocks_lut(cls, blocks: np.ndarray) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        d, qs = np.hsplit(blocks, [2])
+
+        d = d.view(np.float16).astype(np.float32)
+
+        return _lut_dequantize(cls.get_lut(), qs, d.reshape((n_blocks, 1, 1))).reshape((n_blocks, -1))
+
 class IQ4_XS(__Quant, qtype=GGMLQuantizationType.IQ4_XS):
+    has_lut_path = True
+
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -1234,3 +1976,96 @@ class IQ4_XS(__Quant, qtype=GGMLQuantizationType.IQ4_XS):
         qs = np.take_along_axis(kvalues, qs, axis=-1).astype(np.float32).reshape((n_blocks, -1, 32))
 
         return (dl * qs).reshape((n_blocks, -1))
+
+    uses_imatrix = True
+
+    @classmethod
+    def quantize_blocks(cls, blocks: np.ndarray, quant_weights: np.ndarray | None = None) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        blocks = blocks.reshape((n_blocks, -1, 32))
+        if quant_weights is None:
+            weights = blocks * blocks
+        else:
+            sigma2 = 2 * (blocks * blocks).mean(axis=(-1, -2), keepdims=True)
+            weights = _imatrix_weights(blocks, quant_weights, sigma2)
+
+        # (n_blocks, 8, 1)
+        scales = IQ4_NL.quantize_scales(blocks, weights)
+
+        # the sub-block scales are stored as d * l, with a 6-bit signed l
+        imax = abs(scales).argmax(axis=-2, keepdims=True)
+        max_scale = np.take_along_axis(scales, imax, axis=-2)
+        d = (max_scale / -32).reshape((n_blocks, 1)).astype(np.float16)
+        df = d.astype(np.float32).reshape((n_blocks, 1, 1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ls = np.where(df == 0, 0, np_roundf(scales / df))
+        ls = ls.clip(-32, 31)
+
+        dl = df * ls
+        with np.errstate(divide="ignore"):
+            id = np.where(dl == 0, 0, 1 / dl)
+        qs = IQ4_NL.best_index(blocks * id)
+
+        qs = qs.reshape((n_blocks, -1, 2, 16))
+        qs = (qs[..., 0, :] | (qs[..., 1, :] << np.uint8(4))).reshape((n_blocks, -1))
+
+        ls = (ls.astype(np.int8) + np.int8(32)).astype(np.uint8).reshape((n_blocks, -1))
+        scales_l = ls.reshape((n_blocks, -1, 2)) & np.uint8(0x0F)
+        scales_l = scales_l[..., 0] | (scales_l[..., 1] << np.uint8(4))
+        scales_h = (ls >> np.uint8(4)).astype(np.uint16) << np.array([2 * i for i in range(QK_K // 32)], dtype=np.uint16).reshape((1, -1))
+        scales_h = np.bitwise_or.reduce(scales_h, axis=-1, keepdims=True)
+
+        return np.concatenate([d.view(np.uint8), scales_h.view(np.uint8), scales_l, qs], axis=-1)
+
+    @classmethod
+    def dequantize_blocks_lut(cls, blocks: np.ndarray) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        d, rest = np.hsplit(blocks, [2])
+        scales_h, rest = np.hsplit(rest, [2])
+        scales_l, qs = np.hsplit(rest, [QK_K // 64])
+
+        d = d.view(np.float16).astype(np.float32)
+        scales_h = scales_h.view(np.uint16)
+
+        scales_l = scales_l.reshape((n_blocks, -1, 1)) >> np.array([0, 4], dtype=np.uint8).reshape((1, 1, 2))
+        scales_h = scales_h.reshape((n_blocks, 1, -1)) >> np.array([2 * i for i in range(QK_K // 32)], dtype=np.uint16).reshape((1, -1, 1))
+        scales_l = scales_l.reshape((n_blocks, -1)) & np.uint8(0x0F)
+        scales_h = scales_h.reshape((n_blocks, -1)).astype(np.uint8) & np.uint8(0x03)
+
+        scales = (scales_l | (scales_h << np.uint8(4))).astype(np.int8) - np.int8(32)
+        dl = (d * scales.astype(np.float32)).reshape((n_blocks, -1, 1, 1))
+
+        return _lut_dequantize(IQ4_NL.get_lut(), qs.reshape((n_blocks, -1, 16)), dl).reshape((n_blocks, -1))
+
+# Measure the shift-and-mask and the LUT dequantization of every type having both, and keep the faster one.
+# Set GGUF_DEQUANT_LUT=0 or 1 to force one path instead.
+def _pick_dequantize_paths(n_values: int = 1 << 16, n_runs: int = 3) -> None:
+    force = os.environ.get("GGUF_DEQUANT_LUT", "auto").lower()
+    rng = np.random.default_rng(0)
+    for cls in _type_traits.values():
+        if not cls.has_lut_path:
+            continue
+        if force in ("0", "1"):
+            cls.use_lut = force == "1"
+            continue
+        # a few real blocks (quantizing is slower than dequantizing), repeated
+        data = rng.standard_normal((max(1, n_values // 8 // cls.block_size), cls.block_size), dtype=np.float32)
+        blocks = cls.quantize_blocks(data)
+        # the LUT path is only an option when it gives the same result
+        if not np.array_equal(cls.dequantize_blocks(blocks), cls.dequantize_blocks_lut(blocks)):
+            cls.use_lut = False
+            continue
+        blocks = np.tile(blocks, (8, 1))
+        timings = []
+        for fn in (cls.dequantize_blocks, cls.dequantize_blocks_lut):
+            best = float("inf")
+            for _ in range(n_runs):
+                start = time.perf_counter()
+                fn(blocks)
+                best = min(best, time.perf_counter() - start)
+            timings.append(best)
+        cls.use_lut = timings[1] < timings[0]
+
+_pick_dequantize_paths()
@@ -1,11 +1,10 @@
 
 import torch # optional (need torch to work; pip install torch)
-import numpy as np
 from tqdm import tqdm
-from typing import Tuple
-from safetensors.torch import save_file
-from .reader import GGUFReader
+from typing import Dict, Optional, Tuple, Union
+from .reader import GGUFReader, GGMLQuantizationType
 from .quant import dequantize
+from .sfwriter import ConversionStats, stream_gguf_to_safetensors
 
 def load_gguf_and_extract_metadata(gguf_path: str) -> Tuple[GGUFReader, list]:
     reader = GGUFReader(gguf_path)
@@ -22,25 +21,53 @@ def load_gguf_and_extract_metadata(gguf_path: str) -> Tuple[GGUFReader, list]:
         tensors_metadata.append(tensor_metadata)
     return reader, tensors_metadata
 
-def convert_gguf_to_safetensors(gguf_path: str, output_path: str, use_bf16: bool) -> None:
-    reader, tensors_metadata = load_gguf_and_extract_metadata(gguf_path)
-    print(f"Extracted {len(tensors_metadata)} tensors from GGUF file")
-    tensors_dict: dict[str, torch.Tensor] = {}
-    for i, tensor_info in enumerate(tqdm(tensors_metadata, desc="Dequantizing tensors", unit="tensor")):
-        tensor_name = tensor_info['name']
-        tensor_data = reader.get_tensor(i)
-        weights = dequantize(tensor_data.data, tensor_data.tensor_type).copy()
-        try:
-            if use_bf16:
-                weights_tensor = torch.from_numpy(weights).to(dtype=torch.float32)
-                weights_tensor = weights_tensor.to(torch.bfloat16)
-            else:
-                weights_tensor = torch.from_numpy(weights).to(dtype=torch.float32)
-            weights_hf = weights_tensor
-        except Exception as e:
-            print(f"Error during dequantization for tensor '{tensor_name}': {e}")
-            weights_tensor = torch.from_numpy(weights.astype(np.float32)).to(torch.float16)
-            weights_hf = weights_tensor
-        tensors_dict[tensor_name] = weights_hf
-    metadata = {key: str(reader.get_field(key)) for key in reader.fields}
-    save_file(tensors_dict, output_path, metadata=metadata)
+def convert_gguf_to_safetensors(gguf_path: str, output_path: str, use_bf16: bool, max_shard_bytes: Optional[int] = None, workers: Optional[int] = None, report: bool = False, metadata: Optional[Dict[str, str]] = None) -> None:
+    # streamed into place tensor by tensor (see sfwriter), so the float model never has to fit in RAM;
+    # tensors are dequantized by a pool of workers, report prints where the time went per quant type;
+    # metadata is merged into the header as the file is written
+    dtype = torch.bfloat16 if use_bf16 else torch.float32
+    stats = ConversionStats()
+    stream_gguf_to_safetensors(gguf_path, output_path, dtype, dequantize, max_shard_bytes, workers=workers, stats=stats, metadata=metadata)
+    if report:
+        stats.report()
+
+# types which torch reads as they are, straight from the memmap
+TORCH_DTYPES = {
+    GGMLQuantizationType.F32: torch.float32,
+    GGMLQuantizationType.F16: torch.float16,
+    GGMLQuantizationType.BF16: torch.bfloat16,
+    GGMLQuantizationType.F64: torch.float64,
+    GGMLQuantizationType.I8: torch.int8,
+    GGMLQuantizationType.I16: torch.int16,
+    GGMLQuantizationType.I32: torch.int32,
+    GGMLQuantizationType.I64: torch.int64,
+}
+
+def frombuffer(reader: GGUFReader, offset: int, dtype: torch.dtype, count: int) -> torch.Tensor:
+    # zero-copy view of the memmap; open the reader copy-on-write ('c'), a write through a view of a
+    # read-only mapping crashes the interpreter
+    return torch.frombuffer(reader.data, dtype=dtype, count=count, offset=offset)
+
+def load_gguf_state_dict(gguf_path: str, dtype: Optional[torch.dtype] = None, device: Union[str, torch.device] = "cpu", keep_quantized: bool = False) -> Dict[str, torch.Tensor]:
+    # state dict of a GGUF file, without the safetensors round trip of convert_gguf_to_safetensors:
+    # F32/F16/BF16 (and integer) tensors are views of the memmap when they stay as they are (dtype None
+    # or the same, on cpu; copy-on-write, so in-place updates only copy the pages they touch, the file
+    # is never written), the quantized ones are dequantized by the torch kernels into dtype (float32
+    # by default) on device, or kept as GGMLTensor (raw bytes, see ops) with keep_quantized
+    from .ops import GGMLTensor, dequantize_weight
+    reader = GGUFReader(gguf_path, 'c')
+    device = torch.device(device)
+    state_dict: Dict[str, torch.Tensor] = {}
+    for tensor in tqdm(reader.tensors, desc="Loading tensors", unit="tensor"):
+        shape = reader.get_tensor_shape(tensor)
+        torch_dtype = TORCH_DTYPES.get(tensor.tensor_type)
+        if torch_dtype is not None:
+            weights = frombuffer(reader, tensor.data_offset, torch_dtype, int(tensor.n_elements)).reshape(shape)
+            if dtype is not None and weights.is_floating_point():
+                weights = weights.to(dtype)
+            state_dict[tensor.name] = weights.to(device)
+            continue
+        raw = frombuffer(reader, tensor.data_offset, torch.uint8, int(tensor.n_bytes)).reshape(tensor.data.shape)
+        weights = GGMLTensor(raw, tensor.tensor_type, shape).to(device)
+        state_dict[tensor.name] = weights if keep_quantized else dequantize_weight(weights, dtype or torch.float32)
+    return state_dict
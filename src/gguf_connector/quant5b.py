@@ -19,8 +19,10 @@ def get_scale_min(scales):
     sc = torch.cat([d & 63, m_d & 15 | d >> 2 & 48], dim=-1)
     min = torch.cat([m & 63, m_d >> 4 | m >> 2 & 48], dim=-1)
     return sc.reshape((n_blocks, 8)), min.reshape((n_blocks, 8))
-# grid mapping logic (for iq3_s, iq3_xxs, etc.)
+# grid mapping logic (for iq3_s, iq3_xxs, etc.); decoded once per grid and device (read-only)
 from math import ceil, log2
+from functools import lru_cache
+@lru_cache(maxsize=None)
 def load_grid_tensor(grid_shape, grid_hex, grid_map, device):
     bits_per_elem = ceil(log2(len(grid_map)))
     elems_per_byte = 8 // bits_per_elem
@@ -38,5 +40,5 @@ def load_grid_tensor(grid_shape, grid_hex, grid_map, device):
 # convert e8m0 to fp32-half (for mxfp4)
 def e8m0_to_fp32_half(x):
     x = x.to(torch.int32)
-    bits = torch.where(x < 2, torch.int32(0x00200000) << x, (x - 1) << torch.int32(23))
+    bits = torch.where(x < 2, 0x00200000 << x, (x - 1) << 23)
     return bits.view(torch.float32)
@@ -19,6 +19,7 @@ from .const import (
     GGMLQuantizationType,
     GGUFValueType,
     GGUFEndian,
+    Keys,
 )
 
 logger = logging.getLogger(__name__)
@@ -160,6 +161,18 @@ class GGUFReader:
     def get_field(self, key: str) -> Union[ReaderField, None]:
         return self.fields.get(key, None)
 
+    # Fetch the original (torch order) shape of a tensor that was stored reshaped, None if it wasn't.
+    def get_orig_shape(self, name: str) -> Union[tuple[int, ...], None]:
+        field = self.get_field(Keys.Comfy.ORIG_SHAPE.format(name=name))
+        if field is None:
+            return None
+        return tuple(int(field.parts[idx][0]) for idx in field.data)
+
+    # Fetch the shape (torch order) a tensor is used with, e.g. 5-D for one stored folded to 4-D.
+    def get_tensor_shape(self, tensor: ReaderTensor) -> tuple[int, ...]:
+        shape = self.get_orig_shape(tensor.name)
+        return shape if shape is not None else tuple(reversed(tensor.shape.tolist()))
+
     # Fetch a tensor from the list by index.
     def get_tensor(self, idx: int) -> ReaderTensor:
         return self.tensors[idx]
@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import logging, os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Mapping, Sequence
+import numpy as np
+from .const import GGML_QUANT_SIZES, GGMLQuantizationType, GGUFValueType, Keys
+from .reader import GGUFReader, ReaderTensor
+from .writer import GGUFWriter
+from .quant import QuantError, _type_traits, quantize, dequantize
+from .planner import file_type_of, parse_qtype, plan_rules, plan_budget, plan_size, tensor_shape, tensor_nbytes, load_plan, save_plan
+
+logger = logging.getLogger(__name__)
+
+# GGUF -> GGUF requantization, straight from the memmap of the input.
+# Tensors are converted one at a time, by chunks of rows spread over threads, so the peak memory
+# is about one output tensor plus a float chunk per thread, and no intermediate file gets written.
+
+DEFAULT_CHUNK_ROWS = 1024
+
+# written by GGUFWriter itself, or describing the input file rather than the model
+SKIPPED_KEYS = (
+    Keys.General.ARCHITECTURE,
+    Keys.General.FILE_TYPE,
+    Keys.Split.LLM_KV_SPLIT_NO,
+    Keys.Split.LLM_KV_SPLIT_COUNT,
+    Keys.Split.LLM_KV_SPLIT_TENSORS_COUNT,
+)
+
+def can_dequantize(qtype: GGMLQuantizationType) -> bool:
+    return qtype in (GGMLQuantizationType.F32, GGMLQuantizationType.F16) or qtype in _type_traits
+
+def get_arch(reader: GGUFReader) -> str:
+    field = reader.get_field(Keys.General.ARCHITECTURE)
+    if field is None:
+        raise ValueError("Missing general.architecture in the input file")
+    return field.contents()
+
+def copy_kv_metadata(reader: GGUFReader, writer: GGUFWriter, skip_keys: Sequence[str] = SKIPPED_KEYS) -> None:
+    for field in reader.fields.values():
+        # the virtual GGUF.* fields are the header of the input
+        if field.name.startswith("GGUF.") or field.name in skip_keys:
+            continue
+        vtype = field.types[0]
+        sub_type = None
+        if vtype == GGUFValueType.ARRAY:
+            # the raw item type (parts: key length, key, value type, item type, length, items...),
+            # field.types has no item type for empty arrays
+            sub_type = GGUFValueType(int(field.parts[3][0]))
+            if sub_type == GGUFValueType.ARRAY:
+                logger.warning(f"Skipping {field.name}: nested arrays are not supported")
+                continue
+        writer.add_key_value(field.name, field.contents(), vtype, sub_type=sub_type)
+    writer.data_alignment = reader.alignment
+
+def requantize_tensor(
+    tensor: ReaderTensor,
+    qtype: GGMLQuantizationType,
+    imatrix: np.ndarray | None = None,
+    exact: bool = True,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    n_threads: int | None = None,
+) -> np.ndarray:
+    shape = tensor_shape(tensor)
+    raw = tensor.data.reshape((-1, tensor.data.shape[-1]))
+    n_rows, n_cols = raw.shape[0], shape[-1]
+    if qtype == GGMLQuantizationType.F32:
+        out = np.empty((n_rows, n_cols), dtype=np.float32)
+    elif qtype == GGMLQuantizationType.F16:
+        out = np.empty((n_rows, n_cols), dtype=np.float16)
+    else:
+        block_size, type_size = GGML_QUANT_SIZES[qtype]
+        out = np.empty((n_rows, n_cols // block_size * type_size), dtype=np.uint8)
+
+    # with one imatrix row per matrix (3D tensors), the chunks must not span two matrices
+    n_matrices = 1
+    if imatrix is not None and imatrix.ndim == 2 and imatrix.shape[0] > 1:
+        if len(shape) != 3 or imatrix.shape != (shape[0], n_cols):
+            raise QuantError(f"Can't use imatrix with shape {imatrix.shape} for tensor with shape {shape}")
+        n_matrices = shape[0]
+    rows_per_matrix = n_rows // n_matrices
+    chunks = [
+        (start, min(start + chunk_rows, end), m)
+        for m, end in ((m, (m + 1) * rows_per_matrix) for m in range(n_matrices))
+        for start in range(m * rows_per_matrix, end, chunk_rows)
+    ]
+
+    def run(chunk: tuple[int, int, int]) -> None:
+        start, end, m = chunk
+        weights = imatrix[m] if n_matrices > 1 else imatrix
+        # the chunks are the parallelism, the grid types would start a pool of their own per chunk
+        out[start:end] = quantize(dequantize(raw[start:end], tensor.tensor_type), qtype, weights, exact, n_threads=1)
+
+    with ThreadPoolExecutor(max_workers=n_threads or os.cpu_count() or 1) as executor:
+        list(executor.map(run, chunks))
+    return out.reshape((*shape[:-1], out.shape[-1]))
+
+def plan_requantization(
+    reader: GGUFReader,
+    qtype: GGMLQuantizationType | str = GGMLQuantizationType.Q4_0,
+    rules: Sequence[tuple[str, GGMLQuantizationType | str]] = (),
+    plan: Mapping[str, GGMLQuantizationType] | None = None,
+    **budget: Any,
+) -> dict[str, GGMLQuantizationType]:
+    # a given plan, a size budget (target_bpw/target_size, see plan_budget) or per-pattern rules with qtype as default
+    tensors = {tensor.name: tensor for tensor in reader.tensors if can_dequantize(tensor.tensor_type)}
+    if plan is not None:
+        planned = {name: parse_qtype(plan[name]) for name in tensors if name in plan}
+    elif budget:
+        planned = plan_budget(tensors, **budget)
+    else:
+        planned = plan_rules(tensors, rules, default=qtype)
+    # tensors which can't go through numpy (or aren't planned) are copied as they are
+    return {tensor.name: planned.get(tensor.name, tensor.tensor_type) for tensor in reader.tensors}
+
+def requantize(
+    input_path: str,
+    output_path: str,
+    plan: Mapping[str, GGMLQuantizationType],
+    imatrix: Mapping[str, np.ndarray] | None = None,
+    exact: bool = True,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    n_threads: int | None = None,
+    file_type: GGMLQuantizationType | None = None,
+    progress: bool = True,
+) -> tuple[int, int]:
+    reader = GGUFReader(input_path)
+    writer = GGUFWriter(path=None, arch=get_arch(reader))
+    copy_kv_metadata(reader, writer)
+    if file_type is not None and (ftype := file_type_of(file_type)) is not None:
+        writer.add_file_type(ftype)
+    elif (field := reader.get_field(Keys.General.FILE_TYPE)) is not None:
+        writer.add_file_type(field.contents())
+
+    for tensor in reader.tensors:
+        qtype = plan.get(tensor.name, tensor.tensor_type)
+        shape = tensor_shape(tensor)
+        writer.add_tensor_info(tensor.name, shape, np.float32, tensor_nbytes(shape, qtype), raw_dtype=qtype)
+
+    writer.write_header_to_file(path=output_path)
+    writer.write_kv_data_to_file()
+    writer.write_ti_data_to_file()
+
+    bar = None
+    if progress:
+        from tqdm import tqdm
+        bar = tqdm(total=len(reader.tensors), desc="Requantizing", unit="tensor")
+    in_bytes = out_bytes = 0
+    for tensor in reader.tensors:
+        qtype = plan.get(tensor.name, tensor.tensor_type)
+        if qtype == tensor.tensor_type:
+            # same type, the bytes are copied from the memmap as they are (bit-exact)
+            data = tensor.data
+        else:
+            weights = imatrix.get(tensor.name) if imatrix is not None else None
+            data = requantize_tensor(tensor, qtype, weights, exact, chunk_rows, n_threads)
+        writer.write_tensor_data(data)
+        in_bytes += tensor.n_bytes
+        out_bytes += data.nbytes
+        del data
+        if bar is not None:
+            bar.set_postfix_str(f"{tensor.name} {tensor.tensor_type.name}->{qtype.name}")
+            bar.update(1)
+    if bar is not None:
+        bar.close()
+    writer.close()
+    return in_bytes, out_bytes
+
+def main(argv: Sequence[str] | None = None) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(description="Requantize a GGUF file to other types without an intermediate safetensors file")
+    parser.add_argument("model", help="input .gguf file")
+    parser.add_argument("-o", "--output", help="output .gguf file, defaults to <model>-<type>.gguf")
+    parser.add_argument("-t", "--type", default="Q4_0", help="type of the quantizable tensors (default for --rule)")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--plan", help="per-tensor types (json, see planner)")
+    group.add_argument("--bpw", type=float, help="target average bits per weight (budget mode of the planner)")
+    group.add_argument("--size", type=float, help="target size of the tensor data in GiB (budget mode of the planner)")
+    parser.add_argument("--rule", action="append", default=[], metavar="PATTERN=TYPE", help="per-pattern type, first match wins (repeatable)")
+    parser.add_argument("--save-plan", help="also save the resulting plan (json)")
+    parser.add_argument("--imatrix", help="importance matrix (.gguf or .npz)")
+    parser.add_argument("--fast", action="store_true", help="use the float32 fast path of the types which have one (not bit-exact)")
+    parser.add_argument("--threads", type=int, default=None, help="worker threads per tensor (default: all cores)")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="rows converted at once by each thread")
+    args = parser.parse_args(argv)
+
+    qtype = parse_qtype(args.type)
+    imatrix = None
+    if args.imatrix:
+        from .imatrix import load_imatrix
+        imatrix = load_imatrix(args.imatrix)
+    reader = GGUFReader(args.model)
+    budget: dict[str, Any] = {}
+    if args.bpw is not None or args.size is not None:
+        budget = dict(target_bpw=args.bpw, target_size=int(args.size * 1024**3) if args.size is not None else None, imatrix=imatrix)
+    plan = plan_requantization(
+        reader,
+        qtype,
+        rules=[tuple(rule.split("=", 1)) for rule in args.rule],
+        plan=load_plan(args.plan) if args.plan else None,
+        **budget,
+    )
+    total_bytes, bpw = plan_size({tensor.name: tensor for tensor in reader.tensors}, plan)
+    del reader
+    if args.save_plan:
+        save_plan(plan, args.save_plan)
+    output = args.output or f"{os.path.splitext(args.model)[0]}-{qtype.name.lower()}.gguf"
+    if os.path.abspath(output) == os.path.abspath(args.model):
+        raise SystemExit("The output would overwrite the input")
+    print(f"Writing {output}: {total_bytes / 1024**3:.2f} GiB, {bpw:.2f} bpw")
+    in_bytes, out_bytes = requantize(args.model, output, plan, imatrix, exact=not args.fast, chunk_rows=args.chunk_rows, n_threads=args.threads, file_type=qtype)
+    print(f"Done: {in_bytes / 1024**3:.2f} GiB -> {out_bytes / 1024**3:.2f} GiB")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -18,7 +18,7 @@ print(f"Using device: {device}")
 
 import os
 from .tph import get_hf_cache_hub_path
-from .quant3 import convert_gguf_to_safetensors
+from .cache import convert_gguf_to_safetensors_cached
 gguf_files = [file for file in os.listdir() if file.endswith('.gguf')]
 
 if gguf_files:
@@ -38,7 +38,7 @@ if gguf_files:
         else:
             use_bf16 = False
         print(f"Prepare to dequantize: {selected_file_path}")
-        convert_gguf_to_safetensors(selected_file_path, model_path, use_bf16)
+        convert_gguf_to_safetensors_cached(selected_file_path, model_path, use_bf16)
     except (ValueError, IndexError) as e:
         print(f"Invalid choice. Please enter a valid number. ({e})")
 else:
@@ -0,0 +1,247 @@
+
+import json, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch # need torch to work; pip install torch
+from tqdm import tqdm
+from .reader import GGUFReader
+
+# streaming safetensors writer: the header (names, dtypes, shapes, offsets) is laid out up front from
+# a tensor table, then every tensor (or row range of it) is written straight into its final place, so
+# a conversion never holds more than one chunk of output in memory; with max_shard_bytes the output
+# is split into model-0000i-of-0000n.safetensors files plus a model.safetensors.index.json. Each file
+# is written under a .tmp name and renamed when complete, so a failed or killed conversion never
+# leaves a truncated file at the output path
+SAFETENSORS_DTYPES = {
+    torch.float64: 'F64',
+    torch.float32: 'F32',
+    torch.float16: 'F16',
+    torch.bfloat16: 'BF16',
+    torch.int64: 'I64',
+    torch.int32: 'I32',
+    torch.int16: 'I16',
+    torch.int8: 'I8',
+    torch.uint8: 'U8',
+    torch.bool: 'BOOL',
+}
+for name, key in (('float8_e4m3fn', 'F8_E4M3'), ('float8_e5m2', 'F8_E5M2')):
+    if hasattr(torch, name):
+        SAFETENSORS_DTYPES[getattr(torch, name)] = key
+# the order of the safetensors Dtype enum; save_file lays tensors out by it (highest first), then by name
+DTYPE_ORDER = ['BOOL', 'U8', 'I8', 'F8_E5M2', 'F8_E4M3', 'I16', 'U16', 'F16', 'BF16', 'I32', 'U32', 'F32', 'F64', 'I64', 'U64']
+DEFAULT_CHUNK_BYTES = 64 << 20
+# parallel conversion: worker threads (numpy releases the GIL in the dequant kernels) and the bytes of
+# work in flight at once, both overridable from the environment
+DEFAULT_WORKERS = int(os.environ.get('GGUF_CONVERT_WORKERS', os.cpu_count() or 1))
+DEFAULT_MEMORY_BUDGET = int(os.environ.get('GGUF_CONVERT_MEMORY', 1 << 30))
+ALIGNMENT = 8
+
+def tensor_nbytes(dtype, shape):
+    return int(np.prod(shape, dtype=np.int64)) * torch.empty((), dtype=dtype).element_size()
+# greedy split in table order; a tensor larger than max_shard_bytes gets a shard of its own
+def plan_shards(entries, max_shard_bytes=None):
+    shards, current, size = [], [], 0
+    for entry in entries:
+        nbytes = tensor_nbytes(entry[1], entry[2])
+        if current and max_shard_bytes is not None and size + nbytes > max_shard_bytes:
+            shards.append(current)
+            current, size = [], 0
+        current.append(entry)
+        size += nbytes
+    if current or not shards:
+        shards.append(current)
+    return shards
+def shard_paths(output_path, n_shards):
+    if n_shards == 1:
+        return [output_path]
+    stem = output_path[:-len('.safetensors')] if output_path.endswith('.safetensors') else output_path
+    return [f"{stem}-{i:05d}-of-{n_shards:05d}.safetensors" for i in range(1, n_shards + 1)]
+def index_path(output_path):
+    return f"{output_path}.index.json"
+# header bytes (length prefix included) and {name: (begin, end)} relative to the start of the data;
+# tensors in the order save_file puts them (so a file is the same as save_file's, metadata aside, which
+# save_file writes in hash map order and here is sorted by key)
+def build_header(entries, metadata=None):
+    header, offsets, offset = {}, {}, 0
+    if metadata:
+        header['__metadata__'] = {str(k): str(v) for k, v in sorted(metadata.items())}
+    for name, dtype, shape in sorted(entries, key=lambda entry: (-DTYPE_ORDER.index(SAFETENSORS_DTYPES[entry[1]]), entry[0])):
+        end = offset + tensor_nbytes(dtype, shape)
+        header[name] = {'dtype': SAFETENSORS_DTYPES[dtype], 'shape': [int(d) for d in shape], 'data_offsets': [offset, end]}
+        offsets[name] = (offset, end)
+        offset = end
+    raw = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    raw += b' ' * (-len(raw) % ALIGNMENT)
+    return len(raw).to_bytes(8, 'little') + raw, offsets
+class SafetensorsWriter:
+    # entries: [(name, torch dtype, shape)] in the order they are laid out
+    def __init__(self, output_path, entries, metadata=None, max_shard_bytes=None):
+        self.output_path = output_path
+        shards = plan_shards(entries, max_shard_bytes)
+        self.paths = shard_paths(output_path, len(shards))
+        self.files, self.places, self.weight_map = [], {}, {}
+        self.lock = threading.Lock()
+        self.total_size = 0
+        try:
+            for path, shard in zip(self.paths, shards):
+                header, offsets = build_header(shard, metadata)
+                data_size = max((end for _, end in offsets.values()), default=0)
+                f = open(f"{path}.tmp", 'wb+')
+                self.files.append(f)
+                f.write(header)
+                f.truncate(len(header) + data_size)
+                for name, dtype, shape in shard:
+                    begin, end = offsets[name]
+                    self.places[name] = (f, len(header) + begin, end - begin, dtype)
+                    self.weight_map[name] = os.path.basename(path)
+                self.total_size += data_size
+        except BaseException:
+            self.abort()
+            raise
+    # write tensor (already in the declared dtype) at byte start within the named tensor; tensors can
+    # arrive in any order and in pieces (rows of a matrix, say), from any thread
+    def write(self, name, tensor, start=0):
+        f, offset, nbytes, dtype = self.places[name]
+        if tensor.dtype != dtype:
+            raise TypeError(f"{name}: expected {dtype}, got {tensor.dtype}")
+        data = tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy()
+        if start + data.nbytes > nbytes:
+            raise ValueError(f"{name}: writing {data.nbytes} bytes at {start} overflows {nbytes}")
+        with self.lock:
+            f.seek(offset + start)
+            f.write(data)
+    # the files are complete: move them into place (the index last, so it never names a missing shard)
+    def close(self):
+        files, self.files = self.files, []
+        for f in files:
+            f.close()
+            os.replace(f.name, f.name[:-len('.tmp')])
+        if files and len(self.paths) > 1:
+            index = {'metadata': {'total_size': self.total_size}, 'weight_map': self.weight_map}
+            tmp = f"{index_path(self.output_path)}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(index, f, indent=2)
+            os.replace(tmp, index_path(self.output_path))
+        return self.paths
+    # a failed conversion: drop the partial files, leaving whatever was at the output paths
+    def abort(self):
+        files, self.files = self.files, []
+        for f in files:
+            f.close()
+            os.remove(f.name)
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+def row_chunks(n_rows, row_bytes, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    step = max(1, chunk_bytes // max(1, row_bytes))
+    for start in range(0, n_rows, step):
+        yield start, min(n_rows, start + step)
+# bytes of work in flight; a job bigger than the whole budget still runs, alone
+class MemoryBudget:
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.cond = threading.Condition()
+    def acquire(self, nbytes):
+        with self.cond:
+            while self.used and self.used + nbytes > self.limit:
+                self.cond.wait()
+            self.used += nbytes
+    def release(self, nbytes):
+        with self.cond:
+            self.used -= nbytes
+            self.cond.notify_all()
+# time spent per tensor (summed over its chunks, so worker time rather than wall time) and by quant type
+class ConversionStats:
+    def __init__(self):
+        self.tensors = {}
+        self.lock = threading.Lock()
+        self.wall = 0.0
+    def add(self, name, qtype, n_elements, n_bytes, seconds):
+        with self.lock:
+            entry = self.tensors.setdefault(name, {'qtype': qtype.name, 'n_elements': int(n_elements), 'n_bytes': int(n_bytes), 'seconds': 0.0})
+            entry['seconds'] += seconds
+    def by_qtype(self):
+        totals = {}
+        for entry in self.tensors.values():
+            total = totals.setdefault(entry['qtype'], {'tensors': 0, 'n_elements': 0, 'n_bytes': 0, 'seconds': 0.0})
+            total['tensors'] += 1
+            for key in ('n_elements', 'n_bytes', 'seconds'):
+                total[key] += entry[key]
+        return totals
+    def report(self, top=10):
+        totals = self.by_qtype()
+        busy = sum(total['seconds'] for total in totals.values()) or 1e-9
+        print(f"{'type':<8} {'tensors':>7} {'seconds':>9} {'share':>6} {'MB/s in':>9} {'Melem/s':>9}")
+        for qtype, total in sorted(totals.items(), key=lambda item: -item[1]['seconds']):
+            seconds = max(total['seconds'], 1e-9)
+            print(f"{qtype:<8} {total['tensors']:>7} {total['seconds']:>9.3f} {total['seconds'] / busy:>6.1%} {total['n_bytes'] / seconds / 1e6:>9.1f} {total['n_elements'] / seconds / 1e6:>9.1f}")
+        print("slowest tensors:")
+        for name, entry in sorted(self.tensors.items(), key=lambda item: -item[1]['seconds'])[:top]:
+            seconds = max(entry['seconds'], 1e-9)
+            print(f"  {name} ({entry['qtype']}): {entry['seconds']:.3f} s, {entry['n_elements'] / seconds / 1e6:.1f} Melem/s")
+        print(f"worker time {busy:.3f} s, wall time {self.wall:.3f} s")
+def convert_rows(writer, stats, tensor, name, dtype, dequantize, start, end, row_bytes):
+    t0 = time.perf_counter()
+    rows = tensor.data.reshape((-1, tensor.data.shape[-1]))[start:end]
+    # F32 tensors come back as views of the memmap, which is copy-on-write for torch
+    weights = torch.from_numpy(dequantize(rows, tensor.tensor_type))
+    writer.write(name, weights.to(dtype), start * row_bytes)
+    stats.add(name, tensor.tensor_type, tensor.n_elements, tensor.n_bytes, time.perf_counter() - t0)
+# dequantize every tensor of a gguf into dtype and stream it out, a chunk of rows at a time (rows are
+# whole blocks, so any quant type splits cleanly); dequantize is the numpy one (quant or quant5).
+# With workers > 1 the chunks go to a thread pool; each one has its own place in the output, so the
+# file is the same as a serial run whatever order they finish in. memory_budget caps the dequantized
+# bytes (float32 intermediates) in flight; stats (a ConversionStats) collects per tensor timings
+def stream_gguf_to_safetensors(gguf_path, output_path, dtype, dequantize, max_shard_bytes=None, chunk_bytes=DEFAULT_CHUNK_BYTES, desc='Dequantizing tensors', workers=None, memory_budget=None, stats=None, metadata=None):
+    reader = GGUFReader(gguf_path, 'c')
+    print(f"Extracted {len(reader.tensors)} tensors from GGUF file")
+    entries = [(t.name, dtype, reader.get_tensor_shape(t)) for t in reader.tensors]
+    # the GGUF fields, plus any extra metadata (e.g. {'format': 'pt'}) written straight into the header
+    metadata = {**{key: str(reader.get_field(key)) for key in reader.fields}, **(metadata or {})}
+    workers = workers or DEFAULT_WORKERS
+    stats = stats if stats is not None else ConversionStats()
+    jobs = []
+    for tensor, (name, _, _) in zip(reader.tensors, entries):
+        # rows as stored (ggml dim 0), which for a tensor stored reshaped isn't the last dim of its entry
+        n_rows = tensor.data.size // tensor.data.shape[-1]
+        row_elements = int(tensor.shape[0])
+        row_bytes = tensor_nbytes(dtype, (row_elements,))
+        # float32 dequantized rows plus their cast to dtype
+        row_cost = row_elements * 4 + row_bytes
+        jobs += [(tensor, name, start, end, row_bytes, (end - start) * row_cost) for start, end in row_chunks(n_rows, row_bytes, chunk_bytes)]
+    t0 = time.perf_counter()
+    with SafetensorsWriter(output_path, entries, metadata, max_shard_bytes) as writer:
+        progress = tqdm(total=len(reader.tensors), desc=desc, unit='tensor')
+        remaining = {}
+        for job in jobs:
+            remaining[job[1]] = remaining.get(job[1], 0) + 1
+        progress_lock = threading.Lock()
+        def done(job):
+            with progress_lock:
+                remaining[job[1]] -= 1
+                if not remaining[job[1]]:
+                    progress.update(1)
+        if workers == 1:
+            for job in jobs:
+                convert_rows(writer, stats, job[0], job[1], dtype, dequantize, *job[2:5])
+                done(job)
+        else:
+            budget = MemoryBudget(memory_budget or DEFAULT_MEMORY_BUDGET)
+            futures = []
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for job in jobs:
+                    cost = job[5]
+                    budget.acquire(cost)
+                    future = pool.submit(convert_rows, writer, stats, job[0], job[1], dtype, dequantize, *job[2:5])
+                    future.add_done_callback(lambda f, cost=cost, job=job: (budget.release(cost), done(job)))
+                    futures.append(future)
+            for future in futures:
+                future.result()
+        progress.close()
+    stats.wall = time.perf_counter() - t0
+    return writer.paths
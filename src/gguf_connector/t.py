@@ -1,167 +1,48 @@
 
 import torch # optional (if you want this conversion tool; pip install torch)
 from .writer import GGUFWriter, GGMLQuantizationType
-from .quant import quantize, QuantError
 from .const import GGML_QUANT_VERSION, LlamaFileType
-from safetensors.torch import load_file
+from .loader import load_lazy_state_dict, add_planned_tensor, fallback_qtype, match_plan, write_streamed
+from .archs import detect_arch_from_file
+from .planner import BLACKLIST, plan_file_type
 from tqdm import tqdm
 
 QUANTIZATION_THRESHOLD = 1024
 REARRANGE_THRESHOLD = 512
 MAX_TENSOR_NAME_LENGTH = 127
 
-class ModelTemplate:
-    arch = "invalid"
-    shape_fix = False
-    keys_detect = []
-    keys_banned = []
-# ############################################################################
-class ModelSDXL(ModelTemplate):
-    arch = "sdxl"
-    shape_fix = True
-    keys_detect = [
-        ("down_blocks.0.downsamplers.0.conv.weight", "add_embedding.linear_1.weight",),
-        (
-            "input_blocks.3.0.op.weight", "input_blocks.6.0.op.weight",
-            "output_blocks.2.2.conv.weight", "output_blocks.5.2.conv.weight",
-        ), # Non-diffusers
-        ("label_emb.0.0.weight",),
-    ]
-class ModelSD1(ModelTemplate):
-    arch = "sd1"
-    shape_fix = True #False
-    keys_detect = [
-        ("down_blocks.0.downsamplers.0.conv.weight",),
-        (
-            "input_blocks.3.0.op.weight", "input_blocks.6.0.op.weight", "input_blocks.9.0.op.weight",
-            "output_blocks.2.1.conv.weight", "output_blocks.5.2.conv.weight", "output_blocks.8.2.conv.weight"
-        ), # Non-diffusers
-    ]
-class ModelSD3(ModelTemplate):
-    arch = "sd3"
-    keys_detect = [
-        ("transformer_blocks.0.attn.add_q_proj.weight",),
-        ("joint_blocks.0.x_block.attn.qkv.weight",),
-    ]
-    keys_banned = ["transformer_blocks.0.attn.add_q_proj.weight",]
-# ############################################################################
-class ModelFlux(ModelTemplate):
-    arch = "flux"
-    keys_detect = [
-        ("transformer_blocks.0.attn.norm_added_k.weight",),
-        ("double_blocks.0.img_attn.proj.weight",),
-    ]
-    keys_banned = ["transformer_blocks.0.attn.norm_added_k.weight",]
-
-class ModelAura(ModelTemplate):
-    arch = "aura"
-    keys_detect = [
-        ("double_layers.3.modX.1.weight",),
-        ("joint_transformer_blocks.3.ff_context.out_projection.weight",),
-    ]
-    keys_banned = ["joint_transformer_blocks.3.ff_context.out_projection.weight",]
-    
-class ModelHYVID(ModelTemplate):
-    arch = "hyvid"
-    keys_detect = [("txt_in.individual_token_refiner.blocks.0.norm1.weight",),]
-    
-class ModelCosmos(ModelTemplate):
-    arch = "cosmos"
-    keys_detect = [("blocks.block0.blocks.0.block.attn.to_q.0.weight",),]
-    
-class ModelPixArt(ModelTemplate):
-    arch = "pixart"
-    keys_detect = [("transformer_blocks.27.scale_shift_table",),]
-    
-class ModelMochi(ModelTemplate):
-    arch = "mochi"
-    keys_detect = [("t5_yproj.weight",),]
-    
-class ModelLumina(ModelTemplate):
-    arch = "lumina"
-    keys_detect = [("cap_embedder.0.weight",),]
-
-class ModelLTXV(ModelTemplate):
-    arch = "ltxv"
-    keys_detect = [
-        (
-            "adaln_single.emb.timestep_embedder.linear_2.weight",
-            "transformer_blocks.27.scale_shift_table",
-            "caption_projection.linear_2.weight",
-        )
-    ]
-
-arch_list = [ModelSDXL, ModelSD1, ModelSD3, ModelAura, ModelFlux, ModelHYVID, ModelCosmos, ModelPixArt, ModelMochi, ModelLumina, ModelLTXV]
-
-def is_model_arch(model, state_dict):
-    matched = False
-    invalid = False
-    for match_list in model.keys_detect:
-        if all(key in state_dict for key in match_list):
-            matched = True
-            invalid = any(key in state_dict for key in model.keys_banned)
-            break
-    assert not invalid, "Model architecture not allowed for conversion! (i.e. reference VS diffusers format)"
-    return matched
-
-def detect_arch(state_dict):
-    model_arch = None
-    for arch in arch_list:
-        if is_model_arch(arch, state_dict):
-            model_arch = arch
-            break
-    assert model_arch is not None, "Unknown model architecture!"
-    return model_arch
-
 def load_state_dict(path):
-    if any(path.endswith(x) for x in [".ckpt", ".pt", ".bin", ".pth"]):
-        state_dict = torch.load(path, map_location="cpu", weights_only=True)
-        state_dict = state_dict.get("model", state_dict)
-    else:
-        state_dict = load_file(path)
-    prefix = None
-    for pfx in ["model.diffusion_model.", "model."]:
-        if any([x.startswith(pfx) for x in state_dict.keys()]):
-            prefix = pfx
-            break
-    sd = {}
-    for k, v in state_dict.items():
-        if prefix and prefix not in k:
-            continue
-        if prefix:
-            k = k.replace(prefix, "")
-        sd[k] = v
-    return sd
+    # tensors are read one at a time as they are converted, the prefix is stripped from the names only (see loader.py)
+    return load_lazy_state_dict(path, subkeys=("model",), min_keys=0)
 
 def load_model(path):
+    # detected from the key names in the file header, before any tensor is read (see archs.py)
+    model_arch = detect_arch_from_file(path, subkeys=("model",))
     state_dict = load_state_dict(path)
-    model_arch = detect_arch(state_dict)
     print(f"* Architecture detected from input: {model_arch.arch}")
     writer = GGUFWriter(path=None, arch=model_arch.arch)
     return (writer, state_dict, model_arch)
 
-def handle_tensors(args, writer, state_dict, model_arch):
+def handle_tensors(args, writer, state_dict, model_arch, plan=None):
+    # header only: the type and written shape of every tensor go in the tensor infos, the data is read and
+    # converted afterwards, one tensor at a time (see loader.write_streamed); returns [(key, shape, qtype)]
     name_lengths = tuple(sorted(
         ((key, len(key)) for key in state_dict.keys()),
         key=lambda item: item[1],
         reverse=True,
     ))
     if not name_lengths:
-        return
+        return []
     max_name_len = name_lengths[0][1]
     if max_name_len > MAX_TENSOR_NAME_LENGTH:
         bad_list = ", ".join(f"{key!r} ({namelen})" for key, namelen in name_lengths if namelen > MAX_TENSOR_NAME_LENGTH)
         raise ValueError(f"Can only handle tensor names up to {MAX_TENSOR_NAME_LENGTH} characters. Tensors exceeding the limit: {bad_list}")
-    for key, data in tqdm(state_dict.items()):
-        old_dtype = data.dtype
-        if data.dtype == torch.bfloat16:
-            data = data.to(torch.float32).numpy()
-        elif data.dtype in [getattr(torch, "float8_e4m3fn", "_invalid"), getattr(torch, "float8_e5m2", "_invalid")]:
-            data = data.to(torch.float16).numpy()
-        else:
-            data = data.numpy()
-        n_dims = len(data.shape)
-        data_shape = data.shape
+    if plan is not None:
+        plan = match_plan(plan, state_dict.keys())
+    planned = []
+    for key in state_dict.keys():
+        data_shape, old_dtype = state_dict.tensor_info(key)
+        n_dims = len(data_shape)
         data_qtype = getattr(
             GGMLQuantizationType,
             "BF16" if old_dtype == torch.bfloat16 else "F16"
@@ -171,49 +52,39 @@ def handle_tensors(args, writer, state_dict, model_arch):
         for dim_size in data_shape:
             n_params *= dim_size
 
-        blacklist = {
-            "time_embedding.",
-            "add_embedding.",
-            "time_in.",
-            "txt_in.",
-            "vector_in.",
-            "img_in.",
-            "guidance_in.",
-            "final_layer.",
-        }
-
-        if old_dtype in (torch.float32, torch.bfloat16):
+        if plan is not None and key in plan:
+            # planned type (see planner.py)
+            data_qtype = plan[key]
+
+        elif old_dtype in (torch.float32, torch.bfloat16):
             if n_dims == 1:
                 data_qtype = GGMLQuantizationType.F32
 
             elif n_params <= QUANTIZATION_THRESHOLD:
                 data_qtype = GGMLQuantizationType.F32
 
-            elif ".weight" in key and any(x in key for x in blacklist):
+            elif ".weight" in key and any(x in key for x in BLACKLIST):
                 data_qtype = GGMLQuantizationType.F32
 
+        shape = data_shape
         if (model_arch.shape_fix
             and n_dims > 1
             and n_params >= REARRANGE_THRESHOLD
             and (n_params / 256).is_integer()
-            and not (data.shape[-1] / 256).is_integer()
+            and not (data_shape[-1] / 256).is_integer()
         ):
-            # orig_shape = data.shape
-            data = data.reshape(n_params // 256, 256)
-            # writer.add_array(f"comfy.gguf.orig_shape.{key}", tuple(int(dim) for dim in orig_shape))
+            shape = (n_params // 256, 256)
+            # writer.add_array(f"comfy.gguf.orig_shape.{key}", tuple(int(dim) for dim in data_shape))
 
-        try:
-            data = quantize(data, data_qtype)
-        except (AttributeError, QuantError) as e:
-            tqdm.write(f"falling back to F16: {e}")
-            data_qtype = GGMLQuantizationType.F16
-            data = quantize(data, data_qtype)
+        data_qtype = fallback_qtype(shape, data_qtype)
 
         new_name = key
-        shape_str = f"{{{', '.join(str(n) for n in reversed(data.shape))}}}"
+        shape_str = f"{{{', '.join(str(n) for n in reversed(shape))}}}"
         tqdm.write(f"{f'%-{max_name_len + 4}s' % f'{new_name}'} {old_dtype} --> {data_qtype.name}, shape = {shape_str}")
 
-        writer.add_tensor(new_name, data, raw_dtype=data_qtype)
+        add_planned_tensor(writer, new_name, shape, data_qtype)
+        planned.append((key, shape, data_qtype))
+    return planned
 
 import os
 safetensors_files = [file for file in os.listdir() if file.endswith('.safetensors')]
@@ -229,9 +100,19 @@ if safetensors_files:
         print(f"Model file: {selected_file} is selected!")
         path=selected_file
 
+        # a quantization plan next to the model (see planner.py) is picked up automatically
+        plan = None
+        plan_path = f"{os.path.splitext(path)[0]}.plan.json"
+        if os.path.isfile(plan_path):
+            from .planner import load_plan
+            plan = load_plan(plan_path)
+            print(f"Quantization plan: {plan_path} is loaded!")
+
         writer, state_dict, model_arch = load_model(path)
         writer.add_quantization_version(GGML_QUANT_VERSION)
-        if next(iter(state_dict.values())).dtype == torch.bfloat16:
+        if plan is not None:
+            out_path = f"{os.path.splitext(path)[0]}-mixed.gguf"
+        elif state_dict.tensor_info(next(iter(state_dict)))[1] == torch.bfloat16:
             out_path = f"{os.path.splitext(path)[0]}-bf16.gguf"
             writer.add_file_type(LlamaFileType.MOSTLY_BF16)
         else:
@@ -239,11 +120,10 @@ if safetensors_files:
             writer.add_file_type(LlamaFileType.MOSTLY_F16)
         if os.path.isfile(out_path):
             input("Output exists enter to continue or ctrl+c to abort!")
-        handle_tensors(path, writer, state_dict, model_arch)
-        writer.write_header_to_file(path=out_path)
-        writer.write_kv_data_to_file()
-        writer.write_tensors_to_file(progress=True)
-        writer.close()
+        planned = handle_tensors(path, writer, state_dict, model_arch, plan)
+        if plan is not None:
+            writer.add_file_type(plan_file_type(planned))
+        write_streamed(writer, out_path, state_dict, planned)
 
     except (ValueError, IndexError):
         print("Invalid choice. Please enter a valid number.")
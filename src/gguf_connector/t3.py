@@ -1,11 +1,8 @@
 
 import torch # optional (need torch to work; pip install torch)
-import numpy as np
-from safetensors.torch import save_file
-from typing import Dict, Tuple
+from .sfwriter import stream_gguf_to_safetensors
 from .quant import dequantize
 from .reader import GGUFReader
-from tqdm import tqdm
 
 def load_gguf_and_extract_metadata(gguf_path):
     reader = GGUFReader(gguf_path)
@@ -22,34 +19,10 @@ def load_gguf_and_extract_metadata(gguf_path):
         tensors_metadata.append(tensor_metadata)
     return reader, tensors_metadata
 
-def convert_gguf_to_safetensors(gguf_path, output_path, use_bf16):
-    reader, tensors_metadata = load_gguf_and_extract_metadata(gguf_path)
-    print(f'Extracted {len(tensors_metadata)} tensors from GGUF file')
-    tensors_dict: dict[str, torch.Tensor] = {}
-    for i, tensor_info in enumerate(tqdm(tensors_metadata, desc=
-        'Converting tensors', unit='tensor')):
-        tensor_name = tensor_info['name']
-        tensor_data = reader.get_tensor(i)
-        weights = dequantize(tensor_data.data, tensor_data.tensor_type).copy()
-        try:
-            if use_bf16:
-                weights_tensor = torch.from_numpy(weights).to(dtype=torch.
-                    float32)
-                weights_tensor = weights_tensor.to(torch.bfloat16)
-            else:
-                weights_tensor = torch.from_numpy(weights).to(dtype=torch.
-                    float16)
-            weights_hf = weights_tensor
-        except Exception as e:
-            print(
-                f"Error during BF16 conversion for tensor '{tensor_name}': {e}"
-                )
-            weights_tensor = torch.from_numpy(weights.astype(np.float32)).to(
-                torch.float16)
-            weights_hf = weights_tensor
-        tensors_dict[tensor_name] = weights_hf
-    metadata = {key: str(reader.get_field(key)) for key in reader.fields}
-    save_file(tensors_dict, output_path, metadata=metadata)
+def convert_gguf_to_safetensors(gguf_path, output_path, use_bf16, max_shard_bytes=None):
+    dtype = torch.bfloat16 if use_bf16 else torch.float16
+    stream_gguf_to_safetensors(gguf_path, output_path, dtype, dequantize,
+        max_shard_bytes, desc='Converting tensors')
     print('Conversion complete!')
 
 import os
@@ -2,15 +2,15 @@
 import torch # optional (if you want this conversion tool; pip install torch)
 from .writer import GGUFWriter, GGMLQuantizationType
 from .const import GGML_QUANT_VERSION, LlamaFileType
-from safetensors.torch import load_file
+from .loader import SafetensorsStateDict, add_planned_tensor, write_streamed
 from tqdm import tqdm
 import numpy as np
 
 MAX_TENSOR_NAME_LENGTH = 127  # Max allowed length for tensor names
 
 def load_state_dict(path):
-    state_dict = load_file(path)
-    return {k: v for k, v in state_dict.items()}
+    # tensors are read one at a time as they are converted (see loader.py)
+    return SafetensorsStateDict(path, prefixes=())
 
 def load_model(path, model_arch):
     state_dict = load_state_dict(path)
@@ -27,21 +27,27 @@ def is_tensor_valid(data, key):
     return True
 
 def handle_tensors(writer, state_dict):
+    # header only: the shape of every tensor goes in the tensor infos, the data is converted afterwards, one
+    # tensor at a time (see loader.write_streamed); each one is read once here already, so the ones with
+    # NaN or Inf values are left out of the header; returns [(key, shape, qtype)]
     name_lengths = [(key, len(key)) for key in state_dict.keys()]
     if not name_lengths:
-        return
+        return []
     max_name_len = max(name_lengths, key=lambda x: x[1])[1]
 
-    for key, data in tqdm(state_dict.items(), desc="Processing Tensors"):
-        old_dtype = data.dtype
-        print(f"[INFO] Processing: {key} | Original dtype: {old_dtype} | Shape: {data.shape}")
-        data = data.to(torch.float32).numpy()
+    planned = []
+    for key in tqdm(state_dict.keys(), desc="Processing Tensors"):
+        data_shape, old_dtype = state_dict.tensor_info(key)
+        print(f"[INFO] Processing: {key} | Original dtype: {old_dtype} | Shape: {data_shape}")
+        data = state_dict[key].to(torch.float32).numpy()
         if not is_tensor_valid(data, key):
             continue  # Skip if tensor is invalid
         data_qtype = GGMLQuantizationType.F32  # Force F32 for all tensors
         shape_str = f"{{{', '.join(map(str, reversed(data.shape)))}}}"
         print(f"[INFO] Writing: {key.ljust(max_name_len)} | {old_dtype} -> {data_qtype.name} | Shape: {shape_str}")
-        writer.add_tensor(key, data, raw_dtype=data_qtype)
+        add_planned_tensor(writer, key, data.shape, data_qtype)
+        planned.append((key, data.shape, data_qtype))
+    return planned
 
 import os
 safetensors_files = [file for file in os.listdir() if file.endswith('.safetensors')]
@@ -67,11 +73,8 @@ if safetensors_files:
         writer.add_file_type(LlamaFileType.ALL_F32)
         if os.path.isfile(out_path):
             input("Output file exists. Press Enter to overwrite or Ctrl+C to abort.")
-        handle_tensors(writer, state_dict)
-        writer.write_header_to_file(path=out_path)
-        writer.write_kv_data_to_file()
-        writer.write_tensors_to_file(progress=True)
-        writer.close()
+        planned = handle_tensors(writer, state_dict)
+        write_streamed(writer, out_path, state_dict, planned)
         print(f"Conversion completed: {out_path}")
     except (ValueError, IndexError):
         print("Invalid choice. Please enter a valid number.")
@@ -2,15 +2,15 @@
 import torch # optional (if you want this conversion tool; pip install torch)
 from .writer import GGUFWriter, GGMLQuantizationType
 from .const import GGML_QUANT_VERSION, LlamaFileType
-from safetensors.torch import load_file
+from .loader import SafetensorsStateDict, write_streamed
 from tqdm import tqdm
 import numpy as np
 
 MAX_TENSOR_NAME_LENGTH = 127  # Max allowed length for tensor names
 
 def load_state_dict(path):
-    state_dict = load_file(path)
-    return {k: v for k, v in state_dict.items()}
+    # tensors are read one at a time as they are converted (see loader.py)
+    return SafetensorsStateDict(path, prefixes=())
 
 def load_model(path, model_arch):
     state_dict = load_state_dict(path)
@@ -27,21 +27,24 @@ def is_tensor_valid(data, key):
     return True
 
 def handle_tensors(writer, state_dict):
+    # header only: the shape of every tensor goes in the tensor infos, the data is converted afterwards, one
+    # tensor at a time (see loader.write_streamed); returns [(key, shape, qtype)]
     name_lengths = [(key, len(key)) for key in state_dict.keys()]
     if not name_lengths:
-        return
+        return []
     max_name_len = max(name_lengths, key=lambda x: x[1])[1]
 
-    for key, data in tqdm(state_dict.items(), desc="Processing Tensors"):
-        old_dtype = data.dtype
-        print(f"[INFO] Processing: {key} | Original dtype: {old_dtype} | Shape: {data.shape}")
-        data = data.to(torch.uint16).numpy() # uint8 > uint16
-        if not is_tensor_valid(data, key):
-            continue  # Skip if tensor is invalid
+    planned = []
+    for key in tqdm(state_dict.keys(), desc="Processing Tensors"):
+        data_shape, old_dtype = state_dict.tensor_info(key)
+        print(f"[INFO] Processing: {key} | Original dtype: {old_dtype} | Shape: {data_shape}")
         data_qtype = GGMLQuantizationType.MXFP4
-        shape_str = f"{{{', '.join(map(str, reversed(data.shape)))}}}"
+        shape_str = f"{{{', '.join(map(str, reversed(data_shape)))}}}"
         print(f"[INFO] Writing: {key.ljust(max_name_len)} | {old_dtype} -> {data_qtype.name} | Shape: {shape_str}")
-        writer.add_tensor(key, data, raw_dtype=data_qtype)
+        # written as uint16 (uint8 > uint16), integers have no NaN or Inf to skip
+        writer.add_tensor_info(key, data_shape, np.uint16, 2 * int(np.prod(data_shape)), raw_dtype=data_qtype)
+        planned.append((key, data_shape, data_qtype))
+    return planned
 
 import os
 safetensors_files = [file for file in os.listdir() if file.endswith('.safetensors')]
@@ -67,11 +70,8 @@ if safetensors_files:
         writer.add_file_type(LlamaFileType.MOSTLY_MXFP4_MOE)
         if os.path.isfile(out_path):
             input("Output file exists. Press Enter to overwrite or Ctrl+C to abort.")
-        handle_tensors(writer, state_dict)
-        writer.write_header_to_file(path=out_path)
-        writer.write_kv_data_to_file()
-        writer.write_tensors_to_file(progress=True)
-        writer.close()
+        planned = handle_tensors(writer, state_dict)
+        write_streamed(writer, out_path, state_dict, planned, convert=lambda data, key, qtype: data.to(torch.uint16).numpy())
         print(f"Conversion completed: {out_path}")
     except (ValueError, IndexError):
         print("Invalid choice. Please enter a valid number.")
@@ -1,5 +1,8 @@
 
+import mmap, os, struct
+import numpy as np
 import torch # optional (if you want this tool; pip install torch)
+from .const import GGUF_MAGIC
 from .reader import GGUFReader, GGUFValueType
 
 def get_field(reader, field_name, field_type):
@@ -11,7 +14,7 @@ def get_field(reader, field_name, field_type):
             raise TypeError(f"Bad type for GGUF {field_name} key: expected string, got {field.types!r}")
         return str(field.parts[field.data[-1]], encoding="utf-8")
     elif field_type in [int, float, bool]:
-        return field_type(field.parts[field.data[-1]])
+        return field_type(field.parts[field.data[-1]][0])
     else:
         raise TypeError(f"Unknown field type {field_type}")
 
@@ -26,30 +29,192 @@ def get_list_field(reader, field_name, field_type):
     else:
         raise TypeError(f"Unknown field type {field_type}")
 
-def tokenizer_builder(path):
+# the wanted key/value fields of a gguf, straight from its header: a walk over the metadata that only
+# materializes what is asked for, numbers as numpy scalars/arrays, strings as bytes and string arrays
+# as (utf-8 bytes back to back, length of each); GGUFReader would build every field of the file entry
+# by entry (two numpy views per token of a 256k vocab), which is most of a rebuild
+def read_metadata(path, keys):
+    keys = set(keys)
+    fields = {}
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        magic, version = struct.unpack_from("<II", mm, 0)
+        if magic != GGUF_MAGIC:
+            raise ValueError(f"Not a GGUF file: {path}")
+        bo = ">" if version & 0xffff == 0 else "<"
+        _, n_kv = struct.unpack_from(bo + "QQ", mm, 8)
+        offs = 24
+        for _ in range(n_kv):
+            (key_len,) = struct.unpack_from(bo + "Q", mm, offs)
+            key = mm[offs + 8:offs + 8 + key_len].decode("utf-8")
+            (vtype,) = struct.unpack_from(bo + "I", mm, offs + 8 + key_len)
+            value, offs = read_value(mm, offs + 12 + key_len, GGUFValueType(vtype), bo, key in keys)
+            if key in keys:
+                fields[key] = value
+    return fields
+
+def read_value(mm, offs, vtype, bo, want):
+    # (value or None when not wanted, offset past it)
+    if vtype == GGUFValueType.STRING:
+        (n,) = struct.unpack_from(bo + "Q", mm, offs)
+        return (mm[offs + 8:offs + 8 + n] if want else None), offs + 8 + n
+    nptype = GGUFReader.gguf_scalar_to_np.get(vtype)
+    if nptype is not None:
+        dtype = np.dtype(nptype).newbyteorder(bo)
+        end = offs + dtype.itemsize
+        return (np.frombuffer(mm[offs:end], dtype)[0] if want else None), end
+    if vtype != GGUFValueType.ARRAY:
+        raise ValueError(f"Unknown/unhandled field type {vtype}")
+    itype, n = struct.unpack_from(bo + "IQ", mm, offs)
+    itype = GGUFValueType(itype)
+    offs += 12
+    nptype = GGUFReader.gguf_scalar_to_np.get(itype)
+    if nptype is not None:
+        # numbers are laid out back to back, one slice
+        dtype = np.dtype(nptype).newbyteorder(bo)
+        end = offs + n * dtype.itemsize
+        return (np.frombuffer(mm[offs:end], dtype) if want else None), end
+    if itype == GGUFValueType.STRING:
+        # each string has its length in front, so the walk is sequential; the bytes are then gathered
+        # out of the whole region in one go
+        first = offs
+        lengths = np.empty(n, dtype=np.int64)
+        unpack = struct.Struct(bo + "Q").unpack_from
+        for i in range(n):
+            (lengths[i],) = unpack(mm, offs)
+            offs += 8 + int(lengths[i])
+        if not want:
+            return None, offs
+        region = np.frombuffer(mm[first:offs], dtype=np.uint8)
+        starts = np.cumsum(lengths + 8) - lengths
+        within = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return (region[np.repeat(starts, lengths) + within], lengths), offs
+    values = []
+    for _ in range(n):
+        value, offs = read_value(mm, offs, itype, bo, want)
+        values.append(value)
+    return (values if want else None), offs
+
+# protobuf wire format, for the few fields of sentencepiece's ModelProto the rebuild sets; written
+# directly, so a 256k vocab is a handful of numpy passes instead of 256k SentencePiece messages
+def varint(value):
+    value &= (1 << 64) - 1 # negative int32 are sign extended to 10 bytes
+    out = bytearray()
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def varint_sizes(values):
+    sizes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        sizes += values >= (1 << (7 * k))
+    return sizes
+
+def put_varints(out, pos, values, sizes):
+    values = values.astype(np.uint64)
+    for k in range(int(sizes.max(initial=1))):
+        m = sizes > k
+        byte = (values[m] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        out[pos[m] + k] = byte | np.where(sizes[m] > k + 1, 0x80, 0).astype(np.uint64)
+
+def scalar_fields(fields):
+    # (field number, value) pairs in field number order, None for the ones to leave unset
+    out = b""
+    for number, value in fields:
+        if value is not None:
+            out += varint(number << 3) + varint(int(value))
+    return out
+
+# repeated SentencePiece pieces = 1 of ModelProto, each {piece = 1, score = 2, type = 3}
+def encode_pieces(token_bytes, lengths, scores, toktypes):
+    n = len(lengths)
+    toktypes = toktypes.astype(np.int64)
+    type_sizes = varint_sizes(toktypes.astype(np.uint64))
+    len_sizes = varint_sizes(lengths)
+    # 0x0a len piece, 0x15 score, 0x18 type
+    body = 1 + len_sizes + lengths + 5 + 1 + type_sizes
+    body_sizes = varint_sizes(body)
+    total = 1 + body_sizes + body
+    start = np.cumsum(total) - total
+    out = np.zeros(int(total.sum()), dtype=np.uint8)
+    out[start] = 0x0a
+    put_varints(out, start + 1, body, body_sizes)
+    pos = start + 1 + body_sizes
+    out[pos] = 0x0a
+    put_varints(out, pos + 1, lengths, len_sizes)
+    pos = pos + 1 + len_sizes
+    # the piece bytes, gathered into place in one go
+    src = np.cumsum(lengths) - lengths
+    within = np.arange(int(lengths.sum())) - np.repeat(src, lengths)
+    out[np.repeat(pos, lengths) + within] = token_bytes[np.repeat(src, lengths) + within]
+    pos = pos + lengths
+    out[pos] = 0x15
+    out[(pos + 1)[:, None] + np.arange(4)] = scores.astype('<f4').view(np.uint8).reshape(n, 4)
+    pos = pos + 5
+    out[pos] = 0x18
+    put_varints(out, pos + 1, toktypes, type_sizes)
+    return out.tobytes()
+
+TOKENIZER_KEYS = (
+    "tokenizer.ggml.tokens",
+    "tokenizer.ggml.scores",
+    "tokenizer.ggml.token_type",
+    "tokenizer.ggml.add_space_prefix",
+    "tokenizer.ggml.eos_token_id",
+    "tokenizer.ggml.padding_token_id",
+)
+
+# serialized sentencepiece ModelProto (the bytes of a tokenizer.model) and its vocab size
+def build_tokenizer_model(fields):
+    tokens, lengths = fields["tokenizer.ggml.tokens"]
+    scores = fields["tokenizer.ggml.scores"]
+    toktypes = fields["tokenizer.ggml.token_type"]
+    n = min(len(lengths), len(scores), len(toktypes))
+    tokens, lengths = tokens[:int(lengths[:n].sum())], lengths[:n]
+    pieces = encode_pieces(tokens, lengths, scores[:n], toktypes[:n])
+    add_dummy_prefix = fields.get("tokenizer.ggml.add_space_prefix")
+    # trainer_spec = 2: vocab_size = 4, max_sentence_length = 18, byte_fallback = 35, eos_id = 42, pad_id = 43
+    trainer_spec = scalar_fields([
+        (4, n),
+        (18, 4096),
+        (35, True),
+        (42, fields.get("tokenizer.ggml.eos_token_id")),
+        (43, fields.get("tokenizer.ggml.padding_token_id")),
+    ])
+    model = pieces + b"\x12" + varint(len(trainer_spec)) + trainer_spec
+    if add_dummy_prefix is not None:
+        # normalizer_spec = 3: add_dummy_prefix = 3
+        normalizer_spec = scalar_fields([(3, add_dummy_prefix)])
+        model += b"\x1a" + varint(len(normalizer_spec)) + normalizer_spec
+    return model, n
+
+# serialized tokenizers are kept in the conversion cache (see cache.py) by the sha256 of the gguf,
+# which the cache remembers per (path, size, mtime), so a warm start reads one small file and never
+# parses the gguf; bump TOKENIZER_VERSION when the rebuild changes
+TOKENIZER_VERSION = 1
+
+def tokenizer_cache_path(cache, sha256):
+    return os.path.join(cache.cache_dir, f"tokenizer-{sha256[:16]}-v{TOKENIZER_VERSION}.model")
+
+def to_byte_tensor(data):
+    # a writable copy torch can share (frombuffer on bytes warns), no list of python ints
+    return torch.frombuffer(bytearray(data), dtype=torch.uint8)
+
+def tokenizer_builder(path, use_cache=True, cache_dir=None):
+    cache = entry = None
+    if use_cache:
+        from .cache import ConversionCache, atomic_write_bytes
+        cache = ConversionCache(cache_dir)
+        entry = tokenizer_cache_path(cache, cache.fingerprint(path))
+        if os.path.isfile(entry):
+            with open(entry, "rb") as f:
+                data = f.read()
+            print(f"Loaded cached sentencepiece tokenizer: {entry}")
+            return to_byte_tensor(data)
     print(f"Attempting to rebuild sentencepiece tokenizer from metadata..")
-    try:
-        from sentencepiece import sentencepiece_model_pb2 as model # sentencepiece needed
-    except ImportError:
-        raise ImportError("protobuf is required; pip install protobuf")
-    spm = model.ModelProto() # protobuf needed
-    reader = GGUFReader(path)
-    spm.trainer_spec.model_type == 1
-    spm.normalizer_spec.add_dummy_prefix = get_field(reader, "tokenizer.ggml.add_space_prefix", bool)
-    tokens = get_list_field(reader, "tokenizer.ggml.tokens", str)
-    scores = get_list_field(reader, "tokenizer.ggml.scores", float)
-    toktypes = get_list_field(reader, "tokenizer.ggml.token_type", int)
-    for idx, (token, score, toktype) in enumerate(zip(tokens, scores, toktypes)):
-        piece = spm.SentencePiece()
-        piece.piece = token
-        piece.score = score
-        piece.type = toktype
-        spm.pieces.append(piece)
-    spm.trainer_spec.byte_fallback = True
-    spm.trainer_spec.vocab_size = len(tokens)
-    spm.trainer_spec.max_sentence_length = 4096
-    spm.trainer_spec.eos_id = get_field(reader, "tokenizer.ggml.eos_token_id", int)
-    spm.trainer_spec.pad_id = get_field(reader, "tokenizer.ggml.padding_token_id", int)
-    print(f"Rebuilt tokenizer successfully with vocab size of {len(spm.pieces)}")
-    del reader
-    return torch.ByteTensor(list(spm.SerializeToString()))
+    data, vocab_size = build_tokenizer_model(read_metadata(path, TOKENIZER_KEYS))
+    print(f"Rebuilt tokenizer successfully with vocab size of {vocab_size}")
+    if entry is not None:
+        atomic_write_bytes(entry, data)
+    return to_byte_tensor(data)
@@ -40,16 +40,14 @@ except ImportError:
 # Import gguf_connector utilities - these should always be available
 try:
     from .tph import get_hf_cache_hub_path
-    from .quant3 import convert_gguf_to_safetensors
-    from .quant4 import add_metadata_to_safetensors
+    from .cache import convert_gguf_to_safetensors_cached
 except ImportError:
     # Allow running standalone for testing
     try:
         import sys
         sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
         from gguf_connector.tph import get_hf_cache_hub_path
-        from gguf_connector.quant3 import convert_gguf_to_safetensors
-        from gguf_connector.quant4 import add_metadata_to_safetensors
+        from gguf_connector.cache import convert_gguf_to_safetensors_cached
     except ImportError as e:
         print(f"Warning: Could not import gguf_connector utilities: {e}")
 
@@ -270,8 +268,7 @@ if FASTAPI_AVAILABLE and TORCH_AVAILABLE:
         # Dequantize the GGUF model
         use_bf16 = self.device == "cuda"
         print(f"Dequantizing GGUF model to: {model_path}")
-        convert_gguf_to_safetensors(gguf_path, model_path, use_bf16)
-        add_metadata_to_safetensors(model_path, {'format': 'pt'})
+        convert_gguf_to_safetensors_cached(gguf_path, model_path, use_bf16, metadata={'format': 'pt'})
         
         # Load the model
         print(f"Loading VibeVoice model on {self.device} with dtype {self.dtype}")
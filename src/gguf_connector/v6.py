@@ -72,8 +72,7 @@ def launch_vibevoice_app():
 
 import os
 from .tph import get_hf_cache_hub_path
-from .quant3 import convert_gguf_to_safetensors
-from .quant4 import add_metadata_to_safetensors
+from .cache import convert_gguf_to_safetensors_cached
 gguf_files = [file for file in os.listdir() if file.endswith('.gguf')]
 
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
@@ -96,8 +95,7 @@ if gguf_files:
         else:
             use_bf16 = False
         print(f"Prepare to dequantize: {selected_file_path}")
-        convert_gguf_to_safetensors(selected_file_path, model_path, use_bf16)
-        add_metadata_to_safetensors(model_path, {'format': 'pt'})
+        convert_gguf_to_safetensors_cached(selected_file_path, model_path, use_bf16, metadata={'format': 'pt'})
         launch_vibevoice_app()
     except (ValueError, IndexError) as e:
         print(f"Invalid choice. Please enter a valid number. ({e})")
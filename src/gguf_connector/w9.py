@@ -22,8 +22,7 @@ from nunchaku import (
 )
 from .vrm import get_gpu_vram, get_affordable_precision
 from .f4 import get_hf_cache_hub_path
-from .quant3 import convert_gguf_to_safetensors
-from .quant4 import add_metadata_to_safetensors
+from .cache import convert_gguf_to_safetensors_cached
 
 def launch_app(model_path1,model_path,dtype):
     # image recognition model
@@ -253,8 +252,7 @@ if gguf_files:
         else:
             use_bf16 = False
         print(f"Prepare to dequantize: {selected_file_path}")
-        convert_gguf_to_safetensors(selected_file_path, model_path, use_bf16)
-        add_metadata_to_safetensors(model_path, {'format': 'pt'})
+        convert_gguf_to_safetensors_cached(selected_file_path, model_path, use_bf16, metadata={'format': 'pt'})
     except (ValueError, IndexError) as e:
         print(f"Invalid choice. Please enter a valid number. ({e})")
 else:
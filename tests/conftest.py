@@ -0,0 +1,27 @@
+import os, sys
+
+# the package is not installed here, import it from the source tree
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import numpy as np
+import pytest
+
+# a small GGUF model: a Q8_0 matrix and an F32 vector
+def write_gguf(path, seed=0, rows=16):
+    from gguf_connector.const import GGMLQuantizationType
+    from gguf_connector.quant import quantize
+    from gguf_connector.writer import GGUFWriter
+    rng = np.random.default_rng(seed)
+    writer = GGUFWriter(str(path), 'test')
+    weight = quantize(rng.standard_normal((rows, 256), dtype=np.float32), GGMLQuantizationType.Q8_0)
+    writer.add_tensor('fc.weight', weight, raw_dtype=GGMLQuantizationType.Q8_0)
+    writer.add_tensor('fc.bias', rng.standard_normal(rows, dtype=np.float32))
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_tensors_to_file()
+    writer.close()
+    return str(path)
+
+@pytest.fixture
+def small_gguf(tmp_path):
+    return write_gguf(tmp_path / 'model.gguf')
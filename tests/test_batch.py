@@ -0,0 +1,57 @@
+import json, os
+import pytest
+from gguf_connector import batch
+from conftest import write_gguf
+
+def run(tmp_path, manifest):
+    jobs = batch.expand_jobs(manifest, str(tmp_path), exclude=batch.read_state(str(tmp_path / 'state.json')))
+    return batch.run_batch(jobs, str(tmp_path / 'state.json'), str(tmp_path / 'summary.json'), workers=1)
+
+def statuses(summary):
+    return sorted((os.path.basename(job['output']), job['status']) for job in summary['jobs'])
+
+@pytest.fixture
+def zoo(tmp_path):
+    os.makedirs(tmp_path / 'zoo')
+    write_gguf(tmp_path / 'zoo' / 'a.gguf', seed=0)
+    write_gguf(tmp_path / 'zoo' / 'b.gguf', seed=1)
+    return tmp_path
+
+# a rerun only does what is missing or out of date
+def test_resume(zoo):
+    manifest = {'jobs': [{'input': 'zoo/*.gguf', 'type': 'bf16', 'format': 'safetensors', 'output': 'out/{stem}.safetensors'}]}
+    assert statuses(run(zoo, manifest)) == [('a.safetensors', 'done'), ('b.safetensors', 'done')]
+    assert statuses(run(zoo, manifest)) == [('a.safetensors', 'skipped'), ('b.safetensors', 'skipped')]
+    write_gguf(zoo / 'zoo' / 'a.gguf', seed=2)
+    os.remove(zoo / 'out' / 'b.safetensors')
+    assert statuses(run(zoo, manifest)) == [('a.safetensors', 'done'), ('b.safetensors', 'done')]
+    summary = json.load(open(zoo / 'summary.json'))
+    assert summary['totals']['done'] == 2 and summary['totals']['failed'] == 0
+
+# the default outputs go next to the inputs, and are never taken for new inputs
+def test_outputs_are_not_inputs(zoo):
+    manifest = {'jobs': [{'input': 'zoo/*.gguf', 'type': 'q8_0'}]}
+    assert statuses(run(zoo, manifest)) == [('a-q8_0.gguf', 'done'), ('b-q8_0.gguf', 'done')]
+    assert statuses(run(zoo, manifest)) == [('a-q8_0.gguf', 'skipped'), ('b-q8_0.gguf', 'skipped')]
+    # the state file keeps them out too, once the job that wrote them is gone from the manifest
+    other = {'jobs': [{'input': 'zoo/*.gguf', 'type': 'f32', 'format': 'safetensors', 'output': 'out/{stem}.safetensors'}]}
+    jobs = batch.expand_jobs(other, str(zoo), exclude=batch.read_state(str(zoo / 'state.json')))
+    assert sorted(os.path.basename(job['input']) for job in jobs) == ['a.gguf', 'b.gguf']
+
+def test_failure_is_recorded(zoo):
+    with open(zoo / 'zoo' / 'b.gguf', 'wb') as f:
+        f.write(b'not a gguf')
+    summary = run(zoo, {'jobs': [{'input': 'zoo/*.gguf', 'type': 'f32', 'format': 'safetensors', 'output': 'out/{stem}.safetensors'}]})
+    assert statuses(summary) == [('a.safetensors', 'done'), ('b.safetensors', 'failed')]
+    assert 'b.safetensors' not in ''.join(batch.read_state(str(zoo / 'state.json')))
+    assert not os.path.exists(zoo / 'out' / 'b.safetensors')
+
+@pytest.mark.parametrize('spec', [
+    {'input': 'zoo/*.gguf', 'type': 'q5_k', 'format': 'safetensors'},
+    {'input': 'zoo/*.gguf', 'type': 'q4_2'},
+    {'input': 'zoo/*.gguf', 'type': 'iq2_xxs'},
+    {'input': 'zoo/*.gguf', 'type': 'q4_0', 'rules': [['*attn*', 'iq1_s']]},
+])
+def test_bad_types_fail_up_front(zoo, spec):
+    with pytest.raises(ValueError):
+        batch.expand_jobs({'jobs': [spec]}, str(zoo))
@@ -0,0 +1,82 @@
+import os
+import pytest
+from safetensors import safe_open
+from gguf_connector import cache, quant4
+from gguf_connector.quant3 import convert_gguf_to_safetensors
+from conftest import write_gguf
+
+# the default converter, counting its runs
+@pytest.fixture
+def runs(monkeypatch):
+    calls = []
+    def converter(gguf_path, output_path, use_bf16, metadata=None):
+        calls.append(gguf_path)
+        convert_gguf_to_safetensors(gguf_path, output_path, use_bf16, metadata=metadata)
+    monkeypatch.setattr('gguf_connector.quant3.convert_gguf_to_safetensors', converter)
+    return calls
+
+def test_second_launch_skips_conversion(small_gguf, tmp_path, runs):
+    out = str(tmp_path / 'out' / 'model.safetensors')
+    cache_dir = str(tmp_path / 'cache')
+    cache.convert_gguf_to_safetensors_cached(small_gguf, out, False, cache_dir=cache_dir)
+    cache.convert_gguf_to_safetensors_cached(small_gguf, out, False, cache_dir=cache_dir)
+    assert len(runs) == 1
+    # another output of the same model comes from the cache as well
+    other = str(tmp_path / 'other.safetensors')
+    cache.convert_gguf_to_safetensors_cached(small_gguf, other, False, cache_dir=cache_dir)
+    assert len(runs) == 1
+    with safe_open(other, 'pt') as f:
+        assert sorted(f.keys()) == ['fc.bias', 'fc.weight']
+
+def test_changes_reconvert(small_gguf, tmp_path, runs):
+    out = str(tmp_path / 'model.safetensors')
+    cache_dir = str(tmp_path / 'cache')
+    cache.convert_gguf_to_safetensors_cached(small_gguf, out, False, cache_dir=cache_dir)
+    cache.convert_gguf_to_safetensors_cached(small_gguf, out, True, cache_dir=cache_dir)
+    cache.convert_gguf_to_safetensors_cached(small_gguf, out, True, metadata={'format': 'pt'}, cache_dir=cache_dir)
+    assert len(runs) == 3
+    write_gguf(small_gguf, seed=1)
+    cache.convert_gguf_to_safetensors_cached(small_gguf, out, True, metadata={'format': 'pt'}, cache_dir=cache_dir)
+    assert len(runs) == 4
+
+# an output edited since it was published is replaced, an untouched one is left alone
+def test_modified_output_is_republished(small_gguf, tmp_path, runs):
+    out = str(tmp_path / 'model.safetensors')
+    cache_dir = str(tmp_path / 'cache')
+    cache.convert_gguf_to_safetensors_cached(small_gguf, out, False, cache_dir=cache_dir)
+    os.remove(out)
+    with open(out, 'wb') as f:
+        f.write(b'garbage')
+    cache.convert_gguf_to_safetensors_cached(small_gguf, out, False, cache_dir=cache_dir)
+    assert len(runs) == 1
+    with safe_open(out, 'pt') as f:
+        assert 'fc.weight' in f.keys()
+
+def test_metadata_in_header(small_gguf, tmp_path, monkeypatch):
+    def rewrite(*args):
+        raise AssertionError('the converted file was rewritten')
+    monkeypatch.setattr(quant4, 'add_metadata_to_safetensors', rewrite)
+    out = str(tmp_path / 'model.safetensors')
+    cache.convert_gguf_to_safetensors_cached(small_gguf, out, False, metadata={'format': 'pt'}, cache_dir=str(tmp_path / 'cache'))
+    with safe_open(out, 'pt') as f:
+        assert f.metadata()['format'] == 'pt'
+
+def test_failed_conversion_leaves_nothing(small_gguf, tmp_path):
+    def broken(gguf_path, output_path, use_bf16):
+        with open(output_path, 'wb') as f:
+            f.write(b'partial')
+        raise RuntimeError('conversion failed')
+    cache_dir = str(tmp_path / 'cache')
+    with pytest.raises(RuntimeError):
+        cache.convert_gguf_to_safetensors_cached(small_gguf, str(tmp_path / 'model.safetensors'), False, converter=broken, cache_dir=cache_dir)
+    assert not [name for name in os.listdir(cache_dir) if name.endswith(('.safetensors', '.tmp'))]
+    assert not os.path.exists(tmp_path / 'model.safetensors')
+
+def test_lock_waits_for_holder(tmp_path):
+    path = str(tmp_path / 'key.lock')
+    with cache.FileLock(path):
+        with pytest.raises(TimeoutError):
+            with cache.FileLock(path, timeout=0.2, poll=0.05):
+                pass
+    with cache.FileLock(path, timeout=0.2, poll=0.05):
+        pass
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from gguf_connector import quant
+from gguf_connector.const import GGMLQuantizationType as T
+from gguf_connector.imatrix import load_imatrix, save_imatrix_npz
+from gguf_connector.writer import GGUFWriter
+
+WEIGHTED_TYPES = [T.Q2_K, T.Q3_K, T.Q4_K, T.Q5_K, T.Q6_K, T.IQ4_NL, T.IQ4_XS, T.IQ3_S, T.IQ2_S]
+
+def weights_and_importance(seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.standard_normal((32, 512), dtype=np.float32)
+    imatrix = rng.uniform(0.01, 10, 512).astype(np.float32) ** 2
+    return x, imatrix
+
+# the error that matters (weighted by the importance of each column) goes down with the imatrix
+@pytest.mark.parametrize('qtype', WEIGHTED_TYPES)
+def test_imatrix_lowers_weighted_error(qtype):
+    x, imatrix = weights_and_importance()
+    assert quant._type_traits[qtype].uses_imatrix
+    def error(q):
+        return float((imatrix * (x - quant.dequantize(q, qtype)) ** 2).sum())
+    assert error(quant.quantize(x, qtype, imatrix)) < 0.95 * error(quant.quantize(x, qtype))
+
+def test_types_without_weighted_search_ignore_it():
+    x, imatrix = weights_and_importance()
+    assert np.array_equal(quant.quantize(x, T.Q8_0, imatrix), quant.quantize(x, T.Q8_0))
+
+# one row per matrix of a 3D tensor, the same as quantizing each matrix with its own row
+def test_expert_rows():
+    x = np.random.default_rng(1).standard_normal((2, 16, 256), dtype=np.float32)
+    imatrix = np.random.default_rng(2).uniform(0.1, 4, (2, 256)).astype(np.float32)
+    q = quant.quantize(x, T.Q4_K, imatrix)
+    for i in range(2):
+        assert np.array_equal(q[i], quant.quantize(x[i], T.Q4_K, imatrix[i]))
+
+@pytest.mark.parametrize('shape', [(128,), (3, 256)])
+def test_mismatched_imatrix_raises(shape):
+    x = np.zeros((2, 16, 256), dtype=np.float32)
+    with pytest.raises(quant.QuantError):
+        quant.quantize(x, T.Q4_K, np.ones(shape, dtype=np.float32))
+
+def test_load_npz(tmp_path):
+    imatrix = {'blk.0.attn_q.weight': np.arange(4, dtype=np.float32)}
+    save_imatrix_npz(imatrix, str(tmp_path / 'im.npz'))
+    loaded = load_imatrix(str(tmp_path / 'im.npz'))
+    assert np.array_equal(loaded['blk.0.attn_q.weight'], imatrix['blk.0.attn_q.weight'])
+
+# llama-imatrix files hold sums and token counts, per matrix; unused experts get a uniform importance
+def test_load_gguf(tmp_path):
+    path = str(tmp_path / 'imatrix.gguf')
+    writer = GGUFWriter(path, 'imatrix')
+    writer.add_tensor('w.in_sum2', np.array([[2, 4, 6, 8]], dtype=np.float32))
+    writer.add_tensor('w.counts', np.array([[2]], dtype=np.float32))
+    writer.add_tensor('e.in_sum2', np.array([[3, 6], [5, 5]], dtype=np.float32))
+    writer.add_tensor('e.counts', np.array([[3], [0]], dtype=np.float32))
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_tensors_to_file()
+    writer.close()
+    loaded = load_imatrix(path)
+    assert np.array_equal(loaded['w'], [1, 2, 3, 4])
+    assert np.array_equal(loaded['e'], [[1, 2], [1, 1]])
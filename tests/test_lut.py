@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from gguf_connector import quant
+from gguf_connector.const import GGML_QUANT_SIZES
+
+LUT_TYPES = [cls for cls in quant._type_traits.values() if cls.has_lut_path]
+
+def raw_blocks(cls, n_blocks=64, seed=0):
+    rng = np.random.default_rng(seed)
+    quantized = cls.quantize_blocks(rng.standard_normal((n_blocks, cls.block_size), dtype=np.float32))
+    # arbitrary bytes too, so every bit pattern of the packed values shows up
+    return np.concatenate([quantized, rng.integers(0, 256, (n_blocks, GGML_QUANT_SIZES[cls.qtype][1]), dtype=np.uint8)])
+
+@pytest.fixture
+def keep_paths(monkeypatch):
+    for cls in LUT_TYPES:
+        monkeypatch.setattr(cls, 'use_lut', cls.use_lut)
+
+@pytest.mark.parametrize('cls', LUT_TYPES, ids=lambda cls: cls.qtype.name)
+def test_lut_path_is_bit_exact(cls):
+    blocks = raw_blocks(cls)
+    with np.errstate(invalid='ignore', over='ignore'):
+        expected = cls.dequantize_blocks(blocks)
+        got = cls.dequantize_blocks_lut(blocks)
+    assert got.dtype == expected.dtype
+    assert np.array_equal(got.view(np.uint32), expected.view(np.uint32)) or np.array_equal(got, expected, equal_nan=True)
+
+@pytest.mark.parametrize('force', ['0', '1'])
+def test_forced_path(force, monkeypatch, keep_paths):
+    monkeypatch.setenv('GGUF_DEQUANT_LUT', force)
+    quant._pick_dequantize_paths()
+    assert all(cls.use_lut == (force == '1') for cls in LUT_TYPES)
+
+# a LUT path that doesn't give the same values is never picked, however fast
+def test_mismatching_lut_is_not_picked(monkeypatch, keep_paths):
+    cls = quant.IQ4_NL
+    monkeypatch.setenv('GGUF_DEQUANT_LUT', 'auto')
+    monkeypatch.setattr(cls, 'dequantize_blocks_lut', classmethod(lambda cls, blocks: np.zeros((blocks.shape[0], cls.block_size), dtype=np.float32)))
+    quant._pick_dequantize_paths(n_values=1 << 12, n_runs=1)
+    assert not cls.use_lut
+
+@pytest.mark.parametrize('cls', LUT_TYPES, ids=lambda cls: cls.qtype.name)
+def test_dequantize_same_either_path(cls, monkeypatch):
+    data = quant.quantize(np.random.default_rng(1).standard_normal((4, 256), dtype=np.float32), cls.qtype)
+    monkeypatch.setattr(cls, 'use_lut', False)
+    expected = quant.dequantize(data, cls.qtype)
+    monkeypatch.setattr(cls, 'use_lut', True)
+    assert np.array_equal(quant.dequantize(data, cls.qtype), expected)
@@ -0,0 +1,25 @@
+import numpy as np
+from gguf_connector import planner
+from gguf_connector.const import GGMLQuantizationType as T, LlamaFileType
+
+TENSORS = {
+    'fc.weight': np.zeros((64, 256), dtype=np.float32),
+    'fc.bias': np.zeros((64,), dtype=np.float32),
+    'img_in.weight': np.zeros((64, 256), dtype=np.float32),
+}
+
+# a catch-all rule leaves biases, norms and the blacklisted weights in F32, like the default path
+def test_catch_all_keeps_high_precision():
+    plan = planner.plan_rules(TENSORS, [('*', 'Q8_0')])
+    assert plan == {'fc.weight': T.Q8_0, 'fc.bias': T.F32, 'img_in.weight': T.F32}
+
+def test_named_rule_overrides_high_precision():
+    plan = planner.plan_rules(TENSORS, [('*.bias', 'F16'), ('img_in.*', 'Q8_0'), ('*', 'Q4_0')])
+    assert plan == {'fc.weight': T.Q4_0, 'fc.bias': T.F16, 'img_in.weight': T.Q8_0}
+
+def test_plan_file_type():
+    planned = [('a', (64, 256), T.Q4_K), ('b', (64, 128), T.Q8_0), ('c', (64,), T.F32)]
+    assert planner.plan_file_type(planned) == LlamaFileType.MOSTLY_Q4_K_M
+    assert planner.plan_file_type([('a', (64, 256), T.IQ4_NL)]) == LlamaFileType.MOSTLY_IQ4_NL
+    assert planner.plan_file_type([('a', (64, 256), T.Q8_K)]) == LlamaFileType.GUESSED
+    assert planner.plan_file_type([]) == LlamaFileType.GUESSED
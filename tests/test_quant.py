@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from gguf_connector import quant, quant5
+from gguf_connector.const import GGML_QUANT_SIZES, GGMLQuantizationType as T
+from gguf_connector.lazy import LazyNumpyTensor
+
+NEW_TYPES = [T.IQ4_NL, T.IQ4_XS, T.IQ3_S, T.IQ2_S]
+# rmse bound of a round trip of unit normal values
+MAX_RMSE = {T.IQ4_NL: 0.1, T.IQ4_XS: 0.1, T.IQ3_S: 0.22, T.IQ2_S: 0.4}
+
+def normal(shape, seed=0):
+    return np.random.default_rng(seed).standard_normal(shape, dtype=np.float32)
+
+@pytest.mark.parametrize('qtype', NEW_TYPES)
+def test_round_trip(qtype):
+    x = normal((8, 512))
+    q = quant.quantize(x, qtype)
+    block_size, type_size = GGML_QUANT_SIZES[qtype]
+    assert q.dtype == np.uint8 and q.shape == (8, 512 // block_size * type_size)
+    y = quant.dequantize(q, qtype)
+    assert y.shape == x.shape
+    assert np.sqrt(((x - y) ** 2).mean()) < MAX_RMSE[qtype]
+
+@pytest.mark.parametrize('qtype', NEW_TYPES)
+def test_zero_rows(qtype):
+    x = normal((4, 256))
+    x[1] = 0
+    assert not quant.dequantize(quant.quantize(x, qtype), qtype)[1].any()
+
+# values already on the grid of a type come back bit for bit, and quantize to the same bytes again
+@pytest.mark.parametrize('qtype', [T.IQ4_NL, T.IQ4_XS, T.IQ3_S])
+def test_requantize_is_exact(qtype):
+    q = quant.quantize(normal((8, 512), seed=1), qtype)
+    y = quant.dequantize(q, qtype)
+    assert np.array_equal(quant.quantize(y, qtype), q)
+
+def test_iq4_nl_grid_values():
+    kvalues = np.array(quant.IQ4_NL.kvalues, dtype=np.float32)
+    x = (kvalues[np.arange(32) % 16] / 64).reshape((1, 32))
+    assert np.array_equal(quant.dequantize(quant.quantize(x, T.IQ4_NL), T.IQ4_NL), x)
+
+@pytest.mark.parametrize('qtype', NEW_TYPES)
+def test_threads_and_lazy_are_bit_exact(qtype, monkeypatch):
+    x = normal((64, 256), seed=2)
+    cls = quant._type_traits[qtype]
+    monkeypatch.setattr(cls, 'n_threads', 1)
+    serial = quant.quantize(x, qtype)
+    monkeypatch.setattr(cls, 'n_threads', 4)
+    assert np.array_equal(quant.quantize(x, qtype), serial)
+    lazy = quant.quantize(LazyNumpyTensor.from_eager(x), qtype)
+    assert np.array_equal(LazyNumpyTensor.to_eager(lazy), serial)
+
+def test_unaligned_rows_raise():
+    with pytest.raises(quant.QuantError):
+        quant.quantize(normal((2, 100)), T.IQ4_XS)
+
+@pytest.mark.parametrize('qtype', [T.IQ2_XXS, T.IQ2_XS, T.IQ3_XXS, T.IQ1_S, T.IQ1_M])
+def test_dequantize_only_types(qtype):
+    with pytest.raises(NotImplementedError):
+        quant.quantize(normal((1, 256)), qtype)
+
+# quant5 shares the quantizers of quant; it adds MXFP4 and rounds Q4_0/Q5_0 in float32 by default
+@pytest.mark.parametrize('qtype', NEW_TYPES + [T.Q4_K, T.Q8_0])
+def test_quant5_matches_quant(qtype):
+    x = normal((4, 256), seed=3)
+    assert quant5._type_traits[qtype] is quant._type_traits[qtype]
+    assert np.array_equal(quant5.quantize(x, qtype), quant.quantize(x, qtype))
+
+@pytest.mark.parametrize('qtype', [T.Q4_0, T.Q5_0])
+def test_exact_rounding(qtype):
+    x = normal((64, 256), seed=4)
+    assert np.array_equal(quant5.quantize(x, qtype), quant.quantize(x, qtype, exact=False))
+    assert np.array_equal(quant5.quantize(x, qtype, exact=True), quant.quantize(x, qtype))
+
+def test_mxfp4_only_in_quant5():
+    x = normal((2, 64), seed=5)
+    y = quant5.dequantize(quant5.quantize(x, T.MXFP4), T.MXFP4)
+    assert np.abs(x - y).max() < 1
+    assert T.MXFP4 not in quant._type_traits
+
+# the torch kernels decode the new types bit for bit like the numpy reference
+def test_torch_kernels_match():
+    pytest.importorskip('torch')
+    from gguf_connector import dequant
+    assert dequant.validate(NEW_TYPES) == []
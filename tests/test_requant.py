@@ -0,0 +1,16 @@
+import numpy as np
+from gguf_connector import quant, requant
+from gguf_connector.const import GGMLQuantizationType as T
+from gguf_connector.reader import GGUFReader
+from conftest import write_gguf
+
+# requant's pool over row chunks is the only level of threads: the grid types don't start their own
+def test_one_level_of_threads(tmp_path, monkeypatch):
+    tensor = GGUFReader(write_gguf(tmp_path / 'model.gguf', rows=128)).tensors[0]
+    expected = quant.quantize(quant.dequantize(tensor.data, tensor.tensor_type), T.IQ3_S, n_threads=1)
+    def nested(*args, **kwargs):
+        raise AssertionError('a thread pool inside a requant worker')
+    monkeypatch.setattr(quant, 'ThreadPoolExecutor', nested)
+    monkeypatch.setattr(quant.IQ3_S, 'n_threads', 4)
+    out = requant.requantize_tensor(tensor, T.IQ3_S, chunk_rows=64, n_threads=2)
+    assert np.array_equal(out, expected.reshape(out.shape))